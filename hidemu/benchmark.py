@@ -0,0 +1,503 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# benchmark.py - performance measurements against the simulated reader
+#
+# Usage: python benchmark.py [-o results.json] [benchmark name ...]
+#
+
+import os
+import json
+import time
+import timeit
+import logging
+import platform
+import argparse
+import threading
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from smartcard.util import toHexString, toBytes, PACK
+import hidemu
+from hidemu import HIDEmu, APDUS, TAPS, OUTPUT_DROPPED, QUEUE_POLICIES
+from reader import simulated, specs, cardwatch, exceptions
+
+
+class NullKeyStroker:
+    """Counts output strings instead of typing them"""
+
+    def __init__(self):
+        self.strings = 0
+
+    def send_string(self, string):
+        self.strings += 1
+
+
+class TypingKeyStroker(NullKeyStroker):
+    """Takes as long to output a string as typing it would"""
+
+    def __init__(self, seconds_per_character):
+        NullKeyStroker.__init__(self)
+        self.seconds_per_character = seconds_per_character
+
+    def send_string(self, string):
+        time.sleep(len(string) * self.seconds_per_character)
+        self.strings += 1
+
+
+def _cpu_time():
+    """Process CPU seconds, getrusage where there is one as os.times() only counts whole clock ticks"""
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+    user, system = os.times()[:2]
+    return user + system
+
+
+def _serve(reader, running):
+    """Minimal daemon loop: wait for a card, connect and fetch the UID"""
+    while running.is_set():
+        if reader.wait_for_event(1) == cardwatch.CARD_ARRIVED:
+            connection = reader.connect()
+            if connection is not None:
+                reader.get_serial_number(connection)
+
+
+def bench_detection(idle_seconds=3.0, taps=20, readers=16, poll_interval=0.02):
+    """Idle CPU and arrival-to-first-APDU latency, CardRequest style polling vs event driven detection
+
+    Idle cost is measured across a room's worth of readers, each polled as often as it must be for polling to match
+    the event driven arrival latency: with a single reader polled every 0.1s both modes idle below the resolution of
+    the process CPU clock."""
+    for mode, interval in (("polling", poll_interval), ("event", None)):
+        idle = [simulated.Reader("Simulated Reader {0}".format(i), poll_interval=interval) for i in range(readers)]
+        reader = idle[0]
+        running = threading.Event()
+        running.set()
+        workers = [threading.Thread(target=_serve, args=(each, running)) for each in idle]
+        for worker in workers:
+            worker.start()
+
+        checks_start = sum(each.checks for each in idle)
+        cpu_start = _cpu_time()
+        time.sleep(idle_seconds)
+        idle_cpu = (_cpu_time() - cpu_start) / idle_seconds
+        checks = (sum(each.checks for each in idle) - checks_start) / idle_seconds
+
+        latencies = []
+        for i in range(taps):
+            reader.reader.connection = None
+            arrival = time.time()
+            reader.present(simulated.VirtualCard())
+            while reader.reader.connection is None:
+                time.sleep(0.0005)
+            reader.reader.connection.first_apdu.wait(5)
+            latencies.append(reader.reader.connection.first_apdu_time - arrival)
+            reader.remove()
+            time.sleep(0.05)
+
+        running.clear()
+        for each in idle:
+            each.cancel_wait()
+        for worker in workers:
+            worker.join()
+        latencies.sort()
+        print("detection/{0}: {1} readers idle CPU {2:.2%} ({3:.0f} card checks/s), arrival to first APDU mean "
+              "{4:.2f} ms, max {5:.2f} ms".format(mode, readers, idle_cpu, checks,
+                                                  1000 * sum(latencies) / len(latencies), 1000 * latencies[-1]))
+
+
+def _feed(reader, running, new_card):
+    """Keep tapping fresh cards (from new_card()) on a simulated reader as fast as the daemon releases them"""
+    while running.is_set():
+        card = new_card()
+        reader.present(card)
+        while running.is_set() and not card.released.wait(0.1):
+            pass
+
+
+def _run_daemon(hid_emu, readers, seconds, new_card=simulated.VirtualCard, key_stroker=None):
+    """Run the HIDEmu workers and output stage against simulated readers, returns the number of taps output"""
+    hid_emu.running = True
+    hid_emu.key_stroker = key_stroker or NullKeyStroker()
+    hid_emu._start_workers(readers)
+    output_stage = threading.Thread(target=hid_emu._run_output_stage)
+    output_stage.start()
+
+    feeding = threading.Event()
+    feeding.set()
+    feeders = [threading.Thread(target=_feed, args=(reader, feeding, new_card)) for reader in readers]
+    for feeder in feeders:
+        feeder.start()
+    time.sleep(seconds)
+    feeding.clear()
+    for feeder in feeders:
+        feeder.join()
+    hid_emu._stop_workers()
+    output_stage.join()
+    return hid_emu.key_stroker.strings
+
+
+def bench_readers(seconds=3.0, apdu_latency=0.01):
+    """Throughput with 1, 2 and 3 simulated readers served concurrently"""
+    for count in (1, 2, 3):
+        readers = [simulated.Reader("Simulated Reader {0}".format(i), apdu_latency) for i in range(count)]
+        taps = _run_daemon(HIDEmu(), readers, seconds)
+        print("readers/{0}: {1:.1f} taps/s".format(count, taps / seconds))
+
+
+def _output_inline(hid_emu):
+    """The synchronous pipeline: each card is output on its reader worker before the card is released"""
+    def enqueue(card_event, timeout=None):
+        hid_emu._output(card_event)
+        return True
+    hid_emu._enqueue = enqueue
+
+
+def bench_output(seconds=3.0, apdu_latency=0.005, seconds_per_character=0.002, queue_size=4):
+    """Sustained taps/minute read and output when typing is the bottleneck, output inline on the reader worker
+    ("sync", as before the output queue) vs each output queue policy"""
+    results = []
+    for policy in ("sync",) + QUEUE_POLICIES:
+        hid_emu = HIDEmu(queue_size=queue_size, queue_policy="block" if policy == "sync" else policy)
+        if policy == "sync": _output_inline(hid_emu)
+        taps, dropped = TAPS.value, OUTPUT_DROPPED.value
+        output = _run_daemon(hid_emu, [simulated.Reader(apdu_latency=apdu_latency)], seconds,
+                             key_stroker=TypingKeyStroker(seconds_per_character))
+        result = {"benchmark": "output", "policy": policy, "queue_size": queue_size,
+                  "seconds_per_character": seconds_per_character, "apdu_latency": apdu_latency,
+                  "read_per_minute": 60 * (TAPS.value - taps) / seconds, "output_per_minute": 60 * output / seconds,
+                  "dropped": OUTPUT_DROPPED.value - dropped}
+        results.append(result)
+        print("output/{policy}: {read_per_minute:.0f} taps/min read, {output_per_minute:.0f} output, "
+              "{dropped} dropped".format(**result))
+    return results
+
+
+def bench_feedback(taps=20, apdu_latency=0.005, error_duration=2):
+    """ACR122 LED commands per UID-only tap and time to the next tap after an error signal, always sending busy and
+    ready and sleeping through the error signal vs the feedback scheduler"""
+    reader = simulated.create(specs.ACR122, apdu_latency=apdu_latency)
+    legacy = (lambda connection: reader._output_control(connection, 0x0F),
+              lambda connection: reader._output_control(connection, 0x0E),
+              lambda: reader._error_signal(error_duration))  # Held the read loop while blinking
+    scheduled = (reader.busy_signal, reader.ready_signal, lambda: reader.error_signal(error_duration))
+    results = []
+    for mode, (busy_signal, ready_signal, error_signal) in (("legacy", legacy), ("scheduled", scheduled)):
+        apdus = 0
+        for i in range(taps):
+            reader.present(simulated.VirtualCard())
+            connection = reader.connect()
+            busy_signal(connection)
+            reader.get_serial_number(connection)
+            ready_signal(connection)
+            apdus += reader.apdu_counter.count
+            connection.disconnect()
+        started = time.time()
+        error_signal()
+        connection = reader.connect()
+        reader.get_serial_number(connection)
+        result = {"benchmark": "feedback", "mode": mode, "apdus_per_tap": float(apdus) / taps,
+                  "error_duration": error_duration, "recovery_seconds": time.time() - started}
+        results.append(result)
+        print("feedback/{mode}: {apdus_per_tap:.1f} APDUs per tap, next tap read {recovery_seconds:.3f} s after "
+              "an error signal".format(**result))
+    return results
+
+
+def bench_replug(replugs=5, unplugged_seconds=1.0):
+    """Time from a reader being plugged back in, with a card already waiting on it, to the card being output"""
+    plugged = threading.Event()
+    plugged.set()
+    readers = []
+
+    def find_reader(name):  # Stands in for autodetect.find_reader
+        if not plugged.is_set(): raise exceptions.ReaderNotFoundException(name)
+        readers.append(simulated.Reader(name))
+        return readers[-1]
+
+    hidemu.autodetect.find_reader, real_find_reader = find_reader, hidemu.autodetect.find_reader
+    hid_emu = HIDEmu()
+    hid_emu.running = True
+    hid_emu.key_stroker = NullKeyStroker()
+    hid_emu._start_workers([find_reader("Simulated Reader 0")])
+    output_stage = threading.Thread(target=hid_emu._run_output_stage)
+    output_stage.start()
+    latencies = []
+    try:
+        for i in range(replugs):
+            plugged.clear()
+            readers[-1].unplug()
+            time.sleep(unplugged_seconds)
+            strings = hid_emu.key_stroker.strings
+            replugged = time.time()
+            plugged.set()
+            while len(readers) < i + 2:
+                time.sleep(0.001)
+            readers[-1].present(simulated.VirtualCard())
+            while hid_emu.key_stroker.strings == strings:
+                time.sleep(0.001)
+            latencies.append(time.time() - replugged)
+    finally:
+        hid_emu._stop_workers()
+        output_stage.join()
+        hidemu.autodetect.find_reader = real_find_reader
+    latencies.sort()
+    result = {"benchmark": "replug", "replugs": replugs, "unplugged_seconds": unplugged_seconds,
+              "mean_seconds": sum(latencies) / len(latencies), "max_seconds": latencies[-1]}
+    print("replug: first tap output {0:.2f} s after replugging on average, {1:.2f} s at most".format(
+        result["mean_seconds"], result["max_seconds"]))
+    return [result]
+
+
+def _legacy_send_string(key_stroker, string):
+    """The original per character emulation: two syncs and a 1 ms sleep for every character"""
+    from Xlib import X
+    shift_keycode = key_stroker.modifier_keycodes[X.ShiftMask]
+    for character in string:
+        keycode, modifiers = key_stroker.keymap[character]
+        shifted = modifiers & X.ShiftMask
+        if shifted: key_stroker._key_down(shift_keycode)
+        key_stroker._key_down(keycode)
+        key_stroker.display.sync()
+        time.sleep(0.001)
+        key_stroker._key_up(keycode)
+        if shifted: key_stroker._key_up(shift_keycode)
+        key_stroker.display.sync()
+
+
+def bench_xtest(repeat=25):
+    """Characters per second through XTest, run against a local Xvfb (e.g. Xvfb :99 & DISPLAY=:99)"""
+    if not os.environ.get("DISPLAY"):
+        print("xtest: skipped, DISPLAY not set")
+        return
+    from output import xkeystroker
+    key_stroker = xkeystroker.KeyStroker()
+    track = "%7MFC^123456789012345?;1234567890123?" + "\n"  # Typical 40 character output
+    for mode, send in (("per-character", lambda s: _legacy_send_string(key_stroker, s)),
+                       ("batched", key_stroker.send_string)):
+        started = time.time()
+        for i in range(repeat):
+            send(track)
+        elapsed = time.time() - started
+        print("xtest/{0}: {1:.0f} characters/s".format(mode, repeat * len(track) / elapsed))
+
+
+def _legacy_render(hid_emu, uid_bytes, data_list, reader):
+    """The original per tap rendering: concatenate the template then str.format every field"""
+    output_string = hid_emu.head + hid_emu.start1 + hid_emu.track1 + hid_emu.end + hid_emu.tail
+    return output_string.format(UIDLEN=str(len(uid_bytes)), TYPE=reader.card_type, SUBTYPE=reader.card_subtype,
+                                UIDINT=str(HIDEmu._little_endian_value(uid_bytes)), UID=toHexString(uid_bytes, PACK),
+                                CR=os.linesep, DATA=data_list[0], DATA0=data_list[0], DATA1=data_list[1],
+                                DATA2=data_list[2], DATA3=data_list[3], DATA4=data_list[4], DATA5=data_list[5],
+                                DATA6=data_list[6], DATA7=data_list[7])
+
+
+def bench_render(repeat=100000):
+    """Output rendering time per tap, str.format of every field vs the compiled template"""
+    reader = simulated.Reader()
+    card = simulated.VirtualCard()
+    reader.process_atr(card.atr)
+    data_list = ["", "", "", "", "", "", "", ""]
+    for name, track1 in (("default", "{UIDLEN}{TYPE}^{UIDINT}"), ("uid-only", "{UID}"),
+                         ("data", "{UID}^{DATA0}^{DATA1}")):
+        hid_emu = HIDEmu(track1=track1)
+        for mode, render in (("format", lambda: _legacy_render(hid_emu, card.uid, data_list, reader)),
+                             ("compiled", lambda: hid_emu._process_output_string(card.uid, data_list, reader))):
+            seconds = min(timeit.repeat(render, number=repeat, repeat=5))  # Best of 5, the others caught noise
+            print("render/{0}/{1}: {2:.2f} us per tap".format(name, mode, 1e6 * seconds / repeat))
+
+
+# Six fields over three sectors, interleaved the way definitions tend to grow
+DATA_DEFINITION = [
+    {"keyA": 0, "block": 4, "offset": 0, "length": 4, "type": "hex"},
+    {"keyA": 0, "block": 8, "offset": 0, "length": 8, "type": "ascii"},
+    {"keyA": 0, "block": 4, "offset": 4, "length": 4, "type": "int"},
+    {"keyA": 0, "block": 12, "offset": 2, "length": 6, "type": "hex"},
+    {"keyA": 0, "block": 5, "offset": 0, "length": 16, "type": "hex"},
+    {"keyA": 0, "block": 8, "offset": 8, "length": 8, "type": "hex"},
+]
+
+
+def _legacy_read_defined_data(hid_emu, reader, connection):
+    """The original per entry reading: one read (and possibly an authentication) for every data definition entry"""
+    data_list = ["", "", "", "", "", "", "", ""]
+    for i, data_spec in enumerate(hid_emu.data_definition[:8]):
+        offset = data_spec.get("offset", 0)
+        block_read = reader.read_block(connection, data_spec.get("block", 0), data_spec.get("length", 1) + offset,
+                                       data_spec.get("keyA", None), data_spec.get("keyB", None))[offset:]
+        data_list[i] = HIDEmu.bytes_to_type(block_read, data_spec.get("type", "hex"))
+    return data_list
+
+
+def bench_dataread(taps=50, apdu_latency=0.005):
+    """APDUs and time per tap reading a six field data definition, one read per entry vs the read plan"""
+    hid_emu = HIDEmu(track1="{DATA0}{DATA1}{DATA2}{DATA3}{DATA4}{DATA5}", data_definition=DATA_DEFINITION)
+    reader = simulated.Reader(apdu_latency=apdu_latency)
+    for mode, read in (("per-entry", lambda connection: _legacy_read_defined_data(hid_emu, reader, connection)),
+                       ("planned", lambda connection: hid_emu._read_defined_data(reader, connection))):
+        apdus = 0
+        started = time.time()
+        for i in range(taps):
+            reader.present(simulated.VirtualCard())
+            connection = reader.connect()
+            read(connection)
+            apdus += reader.apdu_counter.count
+            connection.disconnect()
+        elapsed = time.time() - started
+        print("dataread/{0}: {1:.1f} APDUs, {2:.2f} ms per tap".format(mode, float(apdus) / taps,
+                                                                       1000 * elapsed / taps))
+
+
+def _legacy_transmit(connection, command, command_vars=None):
+    """The original per module transmit (Omnikey's): status word formatted as a string and walked through if/elif"""
+    if command_vars is None: command_vars = []
+    command_desc = command[0]
+    full_command = command[1] + command_vars
+    sw = [0, 0]
+    try:
+        data, sw[0], sw[1] = connection.transmit(full_command)
+    except(AttributeError, IndexError):
+        raise exceptions.ConnectionLostException
+    response_code = toHexString(sw)
+    if response_code == "64 00":
+        raise exceptions.FailedException(command_desc)
+    elif response_code == "67 00":
+        raise exceptions.NotSupportedException(command_desc)
+    elif response_code == "68 00":
+        raise exceptions.NotSupportedException(command_desc)
+    elif response_code == "69 81":
+        raise exceptions.FailedException(command_desc)
+    elif response_code == "69 82":
+        raise exceptions.FailedException(command_desc)
+    elif response_code == "69 86":
+        raise exceptions.FailedException(command_desc)
+    elif response_code == "6A 81":
+        raise exceptions.NotSupportedException(command_desc)
+    elif response_code == "6A 82":
+        raise exceptions.FailedException(command_desc)
+    elif response_code.startswith("6C"):
+        raise exceptions.NotSupportedException(command_desc)
+    elif response_code != "90 00":
+        raise exceptions.UnexpectedErrorCodeException(response_code, command_desc, sw[0], sw[1])
+    return data
+
+
+def bench_transmit(repeat=100000):
+    """Per-APDU overhead of the transmit path (zero latency card), string compared vs table driven status words"""
+    reader = simulated.Reader()
+    card = simulated.VirtualCard()
+    reader.present(card)
+    connection = reader.connect()
+    reader.read_block(connection, 4, 16, 0)  # Authenticates sector 1
+    command = ["Read Block", [0xFF, 0xB0, 0x00]]
+    for mode, transmit in (("string", lambda: _legacy_transmit(connection, command, [4, 16])),
+                           ("table", lambda: reader._transmit(connection, "read_block", [4, 16]))):
+        started = time.time()
+        for i in range(repeat):
+            transmit()
+        print("transmit/{0}: {1:.2f} us per APDU".format(mode, 1e6 * (time.time() - started) / repeat))
+
+
+class LatencySink:
+    """Collects each card's detection to output latency, in place of a JSON sink"""
+
+    def __init__(self):
+        self.latencies = []
+
+    def send(self, card_event):
+        self.latencies.append(time.time() - card_event.detected)
+
+    def flush(self):
+        pass
+
+
+HIGH_SECTOR_KEY = "A0A1A2A3A4A5"
+
+# name: (card kind, sector keys, track 1, data definition)
+SHAPES = [
+    ("uid-only", "MFC1K", None, "{UID}", []),
+    # Eight fields, one per sector, at varying blocks within the sector
+    ("8-fields", "MFC1K", None, "{UID}^" + "".join("{DATA%d}" % i for i in range(8)),
+     [{"keyA": 1, "block": 4 * sector + sector % 3, "offset": sector % 4, "length": 8,
+       "type": ("hex", "ascii", "int")[sector % 3]} for sector in range(1, 9)]),
+    # The 16 block sectors at the end of a 4K card, behind a non-default key A
+    ("4k-high", "MFC4K", dict((sector, (toBytes(HIGH_SECTOR_KEY), simulated.DEFAULT_KEY))
+                              for sector in range(32, 40)),
+     "{UID}^{DATA0}^{DATA1}^{DATA2}^{DATA3}",
+     [{"keyA": 0, "block": block, "offset": 0, "length": 16, "type": "hex"} for block in (128, 134, 160, 250)]),
+]
+
+
+def _percentile(ordered, q):
+    if not ordered: return None
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def bench_suite(seconds=2.0, apdu_latency=0.005):
+    """Taps/s and per tap latency (detection to output) for every reader model and template/data definition shape"""
+    results = []
+    for spec in specs.SPECS:
+        for shape, kind, sector_keys, track1, data_definition in SHAPES:
+            reader = simulated.create(spec, apdu_latency=apdu_latency)
+            hid_emu = HIDEmu(track1=track1, data_definition=data_definition, key1=HIGH_SECTOR_KEY)
+            reader.set_keys(hid_emu.key1, hid_emu.key2)
+            sink = LatencySink()
+            hid_emu.sinks = [sink]
+            apdus = APDUS.value
+            taps = _run_daemon(hid_emu, [reader], seconds,
+                               lambda: simulated.VirtualCard(kind=kind, sector_keys=sector_keys))
+            latencies = sorted(sink.latencies)
+            result = {
+                "benchmark": "suite", "reader": spec.prefix, "shape": shape, "apdu_latency": apdu_latency,
+                "taps": taps, "taps_per_second": taps / seconds,
+                "apdus_per_tap": float(APDUS.value - apdus) / taps if taps else None,
+                "latency_seconds": dict(("p{0:g}".format(100 * q), _percentile(latencies, q))
+                                        for q in (0.5, 0.95, 0.99)),
+            }
+            results.append(result)
+            print("suite/{0}/{1}: {2:.1f} taps/s, {3} APDUs per tap, latency p50 {4:.1f} ms, p95 {5:.1f} ms".format(
+                spec.prefix, shape, result["taps_per_second"], result["apdus_per_tap"],
+                1000 * (result["latency_seconds"]["p50"] or 0), 1000 * (result["latency_seconds"]["p95"] or 0)))
+    return results
+
+
+BENCHMARKS = {
+    "dataread": bench_dataread,
+    "detection": bench_detection,
+    "feedback": bench_feedback,
+    "output": bench_output,
+    "readers": bench_readers,
+    "render": bench_render,
+    "replug": bench_replug,
+    "suite": bench_suite,
+    "transmit": bench_transmit,
+    "xtest": bench_xtest,
+}
+
+
+def _save(path, results):
+    """Write the results of the benchmarks which return them (a list of dicts) as JSON, for comparing runs"""
+    with open(path, "w") as results_file:
+        json.dump({"time": time.time(), "python": platform.python_version(), "platform": platform.platform(),
+                   "results": results}, results_file, indent=1, sort_keys=True)
+    print("Results saved to " + path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks against the simulated reader")
+    parser.add_argument("-o", "--output", default="benchmark-results.json",
+                        help="JSON file for the results of the benchmarks which produce them")
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help="Benchmarks to run (default all): " + ", ".join(sorted(BENCHMARKS)))
+    args = parser.parse_args()
+    logging.getLogger('hidemu').addHandler(logging.NullHandler())
+    for name in args.names:
+        if name not in BENCHMARKS: parser.error("unknown benchmark: " + name)
+    results = []
+    for name in (args.names or sorted(BENCHMARKS)):
+        results += BENCHMARKS[name]() or []
+    if results: _save(args.output, results)
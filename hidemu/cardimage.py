@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# cardimage.py - whole card memory snapshot
+#
+
+"""Card memory images
+
+With --memory-image every readable block of the card is read once per tap into a CardImage: a single bytearray plus
+a bitmap of the blocks which were read successfully (the rest failed authentication or could not be read). Data
+definitions are then cut out of the image as memoryview slices, costing no further APDUs, and the whole image is
+handed to the sinks for audit dumps.
+
+"""
+
+import binascii
+import logging
+from reader.base import ReaderBase
+from reader.exceptions import FailedException, NotSupportedException, UnexpectedErrorCodeException
+
+# (type code, sub-type code): (block count, block size), block meaning page for Ultralight and iCODE
+LAYOUTS = {
+    ("MFC", "1K"): (64, 16),
+    ("MFC", "4K"): (256, 16),
+    ("MFU", ""): (16, 4),
+    ("ICD", "SLIX"): (28, 4),
+}
+
+
+class CardImage:
+    """The memory of one card"""
+
+    def __init__(self, block_count, block_size):
+        self.block_count = block_count
+        self.block_size = block_size
+        self.data = bytearray(block_count * block_size)
+        self.valid = bytearray((block_count + 7) // 8)  # Bit n set once block n has been read
+
+    def store(self, block, data):
+        """Copy data read from block onwards into the image and mark the blocks it covers valid"""
+        start = block * self.block_size
+        self.data[start:start + len(data)] = bytearray(data)
+        for n in range(block, min(block + len(data) // self.block_size, self.block_count)):
+            self.valid[n >> 3] |= 1 << (n & 7)
+
+    def is_valid(self, block):
+        return bool(self.valid[block >> 3] & (1 << (block & 7)))
+
+    def view(self, block, offset, length):
+        """Returns a memoryview of length bytes at offset into block, None if any of them weren't read"""
+        start = block * self.block_size + offset
+        end = start + length
+        if start < 0 or end > len(self.data):
+            return None
+        for n in range(start // self.block_size, (end - 1) // self.block_size + 1):
+            if not self.is_valid(n):
+                return None
+        return memoryview(self.data)[start:end]
+
+    def to_hex(self):
+        """Returns: (memory, valid block bitmap) as hex strings"""
+        return binascii.hexlify(self.data).upper(), binascii.hexlify(self.valid).upper()
+
+
+def read(reader, connection, sector_keys=None):
+    """Returns a CardImage of the card on reader, None for card types without a known layout
+
+    sector_keys maps Mifare Classic sectors to the (key A, key B) reader key numbers to authenticate with, sectors
+    not listed use key A 0. Sectors which fail to authenticate are left invalid."""
+    layout = LAYOUTS.get((reader.card_type, reader.card_subtype))
+    if layout is None or not reader.card_readable:
+        return None
+    if sector_keys is None: sector_keys = {}
+    image = CardImage(*layout)
+    if not reader.card_authable or reader.card_type != "MFC":
+        try:  # One range read, multi-block commands where the card has them
+            image.store(0, reader.read_block(connection, 0, len(image.data), 0x00))
+        except (FailedException, NotSupportedException, UnexpectedErrorCodeException):
+            logging.getLogger('hidemu').info("Card memory could not be read")
+        return image
+    block = 0
+    while block < image.block_count:
+        sector = ReaderBase.sector_of(block)
+        key_a, key_b = sector_keys.get(sector, (0x00, None))
+        sector_end = block + (16 if sector >= 32 else 4)
+        try:
+            while block < sector_end:
+                image.store(block, reader.read_block(connection, block, image.block_size, key_a, key_b))
+                block += 1
+        except (FailedException, NotSupportedException, UnexpectedErrorCodeException):
+            logging.getLogger('hidemu').debug("Sector " + str(sector) + " could not be read")
+            block = sector_end
+    return image
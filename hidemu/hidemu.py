@@ -8,30 +8,119 @@
 
 import os
 import sys
+import json
+import hashlib
+import binascii
+import struct
 import time
 import string
+import Queue
 import logging
+import threading
 import traceback
 
 logger = logging.getLogger('hidemu')  # Global logging.Logger instance (defined in main.py)
 
 try:  # Non-standard module imports that may fail
     import singleproc
-    from output import keystroker
+    import metrics
+    import template
+    import readplan
+    import cardimage
+    import tracing
+    import ttlcache
+    from output import keystroker, jsonsink
     from smartcard.util import toHexString, toBytes, PACK, HEX, UPPERCASE, COMMA
-    from smartcard.Exceptions import CardRequestTimeoutException, CardConnectionException
+    from smartcard.Exceptions import CardConnectionException
+    import supervisor
+    from reader import cardwatch, autodetect, classifier, replay
+    from reader.registry import registry
     from reader.exceptions import ReaderNotFoundException, FailedException, ConnectionLostException, PyScardFailure
 except BaseException:
     logger.critical(traceback.format_exc())
     raise
 
 
+APDUS = metrics.counter("apdus_total", "Commands sent to cards")
+TAPS = metrics.counter("taps_total", "Cards processed")
+CARDS = metrics.counter("cards_total", "Cards processed by card type", ["card_type"])
+REMOVED_TOO_SOON = metrics.counter("cards_removed_too_soon_total", "Cards whose connection was lost while being read")
+KEYSTROKE_SECONDS = metrics.histogram("keystroke_seconds", "Time taken to emit the keystrokes for one card")
+TAPS_SUPPRESSED = metrics.counter("taps_suppressed_total", "Repeat taps of a card within the debounce window")
+RESULT_CACHE_LOOKUPS = metrics.counter("result_cache_lookups_total", "Data definition result cache lookups",
+                                       ["result"])
+RESULT_CACHE_ENTRIES = metrics.gauge("result_cache_entries", "Cards in the data definition result cache")
+RESULT_CACHE_BYTES = metrics.gauge("result_cache_bytes", "Approximate memory used by the result cache")
+OUTPUT_QUEUE_DEPTH = metrics.gauge("output_queue_depth", "Cards read and waiting to be output", local=True)
+OUTPUT_DROPPED = metrics.counter("output_dropped_total", "Cards read but never output because the queue was full")
+REACQUIRED = metrics.counter("readers_reacquired_total", "Readers served again after being unplugged")
+REPLUG_TO_TAP_SECONDS = metrics.histogram("replug_to_first_tap_seconds",
+                                          "Time from re-acquiring an unplugged reader to its first tap")
+READER_PRESENT = metrics.gauge("reader_present", "1 while the reader is attached and being served", ["reader"])
+
+
+DEBOUNCE_SIZE = 256  # Cards remembered for debouncing, the least recently tapped are forgotten first
+QUEUE_POLICIES = ("block", "drop-oldest", "drop-newest")  # What a reader does with a card when the queue is full
+QUEUE_WAIT = 0.5  # Seconds between checks the daemon is still running, while waiting on a full queue or for workers
+REACQUIRE_MIN_DELAY = 0.25  # Seconds between checks for an unplugged reader, doubling each time up to the max
+REACQUIRE_MAX_DELAY = 2.0   # Also bounds how long stopping the daemon waits on a worker which is re-acquiring
+RESULT_CACHE_SIZE = 1024  # Cards whose data is cached, the least recently tapped are forgotten first
+PRINTABLE = frozenset(string.printable)  # Characters kept by the ascii data type
+INT_FORMATS = {1: "<B", 2: "<H", 4: "<I", 8: "<Q"}  # struct formats for the int data type, by length
+
+
+def _result_size(key, result):
+    """Approximate bytes used by a result cache entry, result is (data list tuple, cardimage.CardImage or None)"""
+    data_list, image = result
+    size = sum(sys.getsizeof(item) for item in (key, data_list) + key + data_list)
+    if image is not None:
+        size += sys.getsizeof(image.data) + sys.getsizeof(image.valid)
+    return size
+
+
 class GracefulExit(Exception):
     """Card connection no longer valid"""
     def __init__(self, *args):
         Exception.__init__(self, "Process terminated", *args)
 
 
+# How to compute each template field from (UID bytes, data list, reader), only referenced fields are computed
+FIELD_VALUES = {
+    "UIDLEN": lambda uid, data_list, reader: str(len(uid)),
+    "TYPE": lambda uid, data_list, reader: reader.card_type,
+    "SUBTYPE": lambda uid, data_list, reader: reader.card_subtype,
+    "UIDINT": lambda uid, data_list, reader: str(HIDEmu._little_endian_value(uid)),
+    "UID": lambda uid, data_list, reader: binascii.hexlify(bytearray(uid)).upper(),  # toHexString PACK, in C
+    "CR": lambda uid, data_list, reader: os.linesep,
+    "DATA": lambda uid, data_list, reader: data_list[0],
+}
+for _n in range(8):
+    FIELD_VALUES["DATA" + str(_n)] = lambda uid, data_list, reader, n=_n: data_list[n]
+
+
+def _field_values(output_template):
+    """Returns (field, FIELD_VALUES function) for each field output_template references"""
+    return tuple((field, FIELD_VALUES[field]) for field in output_template.fields)
+
+
+class CardEvent:
+    """Everything known about one processed card, passed from a reader worker to the output stage"""
+    def __init__(self, reader, uid, data_list, output_string, detected, image=None, trace=None, apdus=0):
+        self.reader_name = reader.name
+        self.atr = reader.card_ATR
+        self.card_type = reader.card_type
+        self.card_subtype = reader.card_subtype
+        self.card_description = reader.card_description
+        self.uid = uid
+        self.data_list = data_list
+        self.output_string = output_string
+        self.detected = detected      # time.time() the card arrived
+        self.processed = time.time()  # time.time() the card had been read
+        self.image = image            # cardimage.CardImage when the whole card memory was read
+        self.trace = trace            # tracing.TapTrace, finished by the output stage
+        self.apdus = apdus            # Commands sent to the card
+
+
 class HIDEmu:
     def __init__(self,
                  head="",
@@ -41,13 +130,36 @@ class HIDEmu:
                  tail="{CR}",
                  key1="FFFFFFFFFFFF",
                  key2="FFFFFFFFFFFF",
-                 data_definition=None):
+                 data_definition=None,
+                 supervised=False,
+                 watchdog=10,
+                 key_pacing=0,
+                 output=None,
+                 paste_threshold=None,
+                 json_sinks=None,
+                 memory_image=False,
+                 atr_overrides=None,
+                 metrics_address=None,
+                 trace_sample=0,
+                 record=None,
+                 replay_trace=None,
+                 replay_realtime=False,
+                 debounce=None,
+                 result_cache=None,
+                 result_cache_bypass=None,
+                 queue_size=16,
+                 queue_policy="block"):
         self.running = False
         self.name = 'HIDEmu'
         self.status = 'INIT'
         self.logger = logging.getLogger('hidemu')     # Use the global logger internally
-        self.reader = None       # hidemu.reader.Reader instance (see reader.ReaderBase)
-        self.key_stroker = None  # hidemu.output.keystroker.KeyStroker instance
+        self.readers = []        # hidemu.reader.ReaderBase instances, one per attached reader
+        self.workers = []        # One thread per reader, see _serve_reader
+        self.key_stroker = None  # KeyStroker instance from hidemu.output.keystroker.create, None for no keystrokes
+        self.sinks = []          # output.jsonsink.JsonSink instances
+        self.queue_size = queue_size
+        self.output_queue = Queue.Queue(queue_size)  # CardEvents from the workers to the output worker, None stops it
+        self.worker_failure = None  # sys.exc_info() of a failure in a worker which should stop the daemon
 
         # Process configuration settings
         self.head = head
@@ -62,9 +174,67 @@ class HIDEmu:
         self.key1 = key1
         self.key2 = key2
         self.data_definition = data_definition
+        self.supervised = supervised  # Serve each reader from its own child process (see supervisor.py)
+        self.watchdog = watchdog      # Seconds a supervised reader may go without progress before it is restarted
+        self.key_pacing = key_pacing  # Milliseconds between emulated key presses
+        self.output = output          # Keystroke backend (see output.keystroker.BACKENDS), None for default, "none"
+        self.paste_threshold = paste_threshold  # Paste rather than type output this long (X only), None to always type
+        self.json_sinks = json_sinks or []      # JsonSink targets ("-", file, named pipe or Unix socket path)
+        self.memory_image = memory_image  # Read the whole card once per tap and take data definitions from the image
+        self.atr_overrides = atr_overrides  # ATR hex string: card support list, see reader.classifier
+        self.metrics_address = metrics_address  # "[host:]port" or Unix socket path to serve metrics on, None for none
+        self.trace_sample = trace_sample  # Fraction of taps to log the stage timing trace of
+        self.recorder = replay.TraceRecorder(record) if record else None  # Appends every tap's APDUs to a trace
+        self.replay_trace = replay_trace  # Trace file to serve replayed readers from instead of real ones
+        self.replay_realtime = replay_realtime  # Replay with the recorded timing
+        # (reader name, UID): True for cards tapped within the last debounce seconds, None to output every tap
+        self.recent_taps = ttlcache.TtlCache(debounce, DEBOUNCE_SIZE) if debounce else None
+        self.template = template.compile(self._output_template())
+        self.field_values = _field_values(self.template)
+        self.data_needed = self._referenced_data()  # Indexes into data_definition worth reading
+        self.read_plan = readplan.compile(data_definition, self.data_needed)
+        # (UID, ATR, data definition hash): (data list, card image) of cards read within the last result_cache seconds
+        self.result_cache = None
+        if result_cache and self.read_plan.reads:
+            self.result_cache = ttlcache.TtlCache(result_cache, RESULT_CACHE_SIZE, _result_size)
+        self.result_cache_bypass = frozenset(result_cache_bypass or [])  # Card types always read from the card
+        self.flush_pending = False  # Flush the result cache before its next lookup, see request_flush
+        self.data_definition_hash = hashlib.sha1(json.dumps(data_definition, sort_keys=True)).hexdigest()
+        self.queue_policy = queue_policy  # One of QUEUE_POLICIES
+        self.reacquire = replay_trace is None  # Wait for unplugged readers to come back, replayed ones never do
+
+    def __getstate__(self):
+        """Configuration only, for handing to a supervised reader process"""
+        state = self.__dict__.copy()
+        for runtime_only in ('logger', 'readers', 'workers', 'key_stroker', 'sinks', 'output_queue', 'worker_failure',
+                             'field_values'):
+            del state[runtime_only]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.logger = logging.getLogger('hidemu')
+        self.readers = []
+        self.workers = []
+        self.key_stroker = None
+        self.sinks = []
+        self.output_queue = Queue.Queue(self.queue_size)
+        self.worker_failure = None
+        self.field_values = _field_values(self.template)
 
     @staticmethod
     def bytes_to_type(byte_list, data_type="hex"):
+        """byte_list may also be a memoryview (of a card image), which is read in place rather than copied out"""
+        if isinstance(byte_list, memoryview):
+            if data_type == "ascii":
+                return ''.join([character for character in byte_list if character in PRINTABLE])
+            elif data_type == "int":
+                int_format = INT_FORMATS.get(len(byte_list))
+                if int_format is not None:
+                    return struct.unpack_from(int_format, byte_list)[0]
+                return sum(ord(character) << 8 * i for i, character in enumerate(byte_list))
+            else:
+                return binascii.hexlify(byte_list).upper()
         if data_type == "ascii":
             ascii = ''.join(chr(i) for i in byte_list)
             ascii = filter(lambda x: x in string.printable, ascii)
@@ -74,72 +244,364 @@ class HIDEmu:
         else:
             return toHexString(byte_list, PACK)
 
-    def _read_defined_data(self, connection):
-        """Return a string list of 8 elements based on data_definition."""
+    def _card_data(self, reader, connection, uid):
+        """Returns (data list, cardimage.CardImage or None), from the result cache when the card was read recently"""
+        key = None
+        if self.flush_pending:
+            self.flush_pending = False
+            self.flush_result_cache()
+        if self.result_cache is not None and uid and reader.card_type not in self.result_cache_bypass:
+            key = (tuple(uid), tuple(reader.card_ATR), self.data_definition_hash)
+            cached = self.result_cache.get(key)
+            RESULT_CACHE_LOOKUPS.labels("miss" if cached is None else "hit").inc()
+            if cached is not None:
+                return list(cached[0]), cached[1]
+
+        # parse data definition and read data accordingly
+        image = None
+        if self.memory_image:
+            image = cardimage.read(reader, connection, self.read_plan.sector_keys)
+        failed = []
+        data_list = self._read_defined_data(reader, connection, image, failed)
+        if key is not None and not failed:  # Never cache a partial read
+            self.result_cache.put(key, (tuple(data_list), image))  # The image too, for the sinks
+            self._update_result_cache_metrics()
+        return data_list, image
+
+    def request_flush(self):
+        """Have the result cache flushed before its next lookup
+
+        Only sets a flag, so it's safe from a signal handler: the handler runs on the main thread, which may be a
+        reader worker holding the cache's lock."""
+        self.flush_pending = True
+
+    def flush_result_cache(self):
+        """Forget every cached card, their next taps read the card again"""
+        if self.result_cache is not None:
+            self.result_cache.clear()
+            self._update_result_cache_metrics()
+            self.logger.info("Result cache flushed")
+
+    def _update_result_cache_metrics(self):
+        RESULT_CACHE_ENTRIES.set(len(self.result_cache))
+        RESULT_CACHE_BYTES.set(self.result_cache.bytes)
+
+    def _read_defined_data(self, reader, connection, image=None, failed=None):
+        """Return a string list of 8 elements based on data_definition, following the compiled read plan.
+
+        Fields are cut straight out of image (a cardimage.CardImage) when given, without reading the card. The indexes
+        of fields which couldn't be read are appended to failed when given."""
+        if failed is None: failed = []
         data_list = ["", "", "", "", "", "", "", ""]
-        if self.data_definition is not None and self.reader.card_readable:
-            data_def_list = self.data_definition
-            if type(data_def_list) == dict:
-                data_def_list = [data_def_list]
-            for i in range(0, min(len(data_def_list), 8)):
-                data_spec = data_def_list[i]
-                data_key_a = data_spec.get("keyA", None)
-                data_key_b = data_spec.get("keyB", None)
-                data_type = data_spec.get("type", "hex")
-                data_block = data_spec.get("block", 0)
-                data_offset = data_spec.get("offset", 0)
-                data_length = data_spec.get("length", 1)
-
-                try:  # Read data based on the data definition
-                    # Read data_block with length=data_length+data_offset and then trim everything before the offset
-                    block_read = self._read_block(connection, data_block, data_length + data_offset,
-                                                  data_key_a, data_key_b)[data_offset:]
-                    # Process bytes based on type
-                    data = HIDEmu.bytes_to_type(block_read, data_type)
-                    data_list[i] = data
+        if self.read_plan.reads and reader.card_readable:
+            for read in self.read_plan.reads:
+                if image is not None:
+                    for field in read.fields:
+                        view = image.view(read.block, field.offset, field.length)
+                        if view is not None:
+                            data_list[field.index] = HIDEmu.bytes_to_type(view, field.type)
+                        else:
+                            self.logger.info("Data definition #" + str(field.index) + " not in the card image")
+                            failed.append(field.index)
+                    continue
+                try:  # Read the block once, as long as the longest field in it needs
+                    block_read = self._read_block(reader, connection, read.block, read.length, read.key_a, read.key_b)
                 except FailedException:
-                    self.logger.info("Data definition #" + str(i) + " failed to apply to current card")
-                    data_list[i] = ""
+                    block_read = None
                 except ConnectionLostException:
                     self.logger.warn("Connection lost while processing data definition.")
                     raise
+                if block_read is None:
+                    self._read_fields_separately(reader, connection, read, data_list, failed)
+                    continue
+                for field in read.fields:  # Trim everything outside the field and process bytes based on type
+                    data_list[field.index] = HIDEmu.bytes_to_type(
+                        block_read[field.offset:field.offset + field.length], field.type)
         return data_list
 
-    def _process_card(self, connection):
+    def _read_fields_separately(self, reader, connection, read, data_list, failed):
+        """Fill in read's fields after the read for all of them failed, so one field running past what the card can
+        read doesn't cost the others. Shorter reads go first: once one fails, any longer one would too."""
+        readable = 0               # Length known to read, from the block_read held
+        unreadable = read.length   # Length known to fail
+        block_read = []
+        for field in sorted(read.fields, key=lambda f: f.offset + f.length):
+            end = field.offset + field.length
+            if readable < end < unreadable:
+                reader.card_authentication = None  # The failed read may have cost the authentication
+                try:
+                    block_read = self._read_block(reader, connection, read.block, end, read.key_a, read.key_b)
+                    readable = end
+                except FailedException:
+                    unreadable = end
+                except ConnectionLostException:
+                    self.logger.warn("Connection lost while processing data definition.")
+                    raise
+            if end <= readable:
+                data_list[field.index] = HIDEmu.bytes_to_type(block_read[field.offset:end], field.type)
+            else:
+                self.logger.info("Data definition #" + str(field.index) + " failed to apply to current card")
+                failed.append(field.index)
+
+    def _referenced_data(self):
+        """Returns the indexes of the data definitions whose values are output by the template or a sink"""
+        if self.json_sinks:
+            return frozenset(range(8))  # Records carry the whole data list
+        needed = set()
+        for field in self.template.fields:
+            if field == "DATA":
+                needed.add(0)
+            elif field.startswith("DATA"):
+                needed.add(int(field[4:]))
+        return frozenset(needed)
+
+    def _process_card(self, reader, connection, trace=None):
         """This is where the magic happens"""
-        self.reader.busy_signal(connection)
-        self.logger.info(self.reader.card_description + ' card detected')
-        self.logger.debug('ATR: ' + toHexString(self.reader.card_ATR))
-        card_serial_number = self.reader.get_serial_number(connection)
+        if trace is None: trace = tracing.TapTrace(time.time())
+        reader.busy_signal(connection)
+        trace.mark("signal")
+        self.logger.info(reader.card_description + ' card detected on ' + reader.name)
+        self.logger.debug('ATR: ' + toHexString(reader.card_ATR))
+        card_serial_number = reader.get_serial_number(connection)
         if card_serial_number:
             self.logger.debug('UID: ' + toHexString(card_serial_number))
         else:
             card_serial_number = []
             self.logger.warn('No UID read!')
+        trace.mark("uid")
+        if self._repeat_tap(reader, card_serial_number):
+            self.logger.info('Repeat tap suppressed')
+            TAPS_SUPPRESSED.inc()
+            reader.ready_signal(connection)
+            connection.disconnect()
+            return
 
-        # parse data definition and read data accordingly
-        data_list = self._read_defined_data(connection)
+        data_list, image = self._card_data(reader, connection, card_serial_number)
+        trace.mark("data")
+        apdus = reader.apdu_counter.count
+        self.logger.debug('APDUs: ' + str(apdus))
+        APDUS.inc(apdus)
+        TAPS.inc()
+        CARDS.labels(reader.card_type).inc()
 
-        output_string = self.head + self.start1 + self.track1 + self.end
-        if self.track2 != "": output_string += self.start2 + self.track2 + self.end
-        if self.track3 != "": output_string += self.start3 + self.track3 + self.end
-        output_string += self.tail
-
-        self.key_stroker.send_string(
-            self._process_output_string(output_string, card_serial_number, data_list))
+        output_string = self._process_output_string(card_serial_number, data_list, reader)
+        trace.mark("render")
+        card_event = CardEvent(reader, card_serial_number, data_list, output_string, trace.detected, image, trace,
+                               apdus)
 
-        self.reader.ready_signal(connection)
+        # Hand over to the output worker and release the card straight away
+        self._enqueue(card_event)
+        reader.ready_signal(connection)
         connection.disconnect()
 
-    def _wait_for_reader(self):
+    def _enqueue(self, card_event, timeout=None):
+        """Queue a card for the output worker, when the queue is full the queue policy decides which card is lost
+
+        "block" holds the reader (and the card) until there's room: backpressure, nothing is lost while running.
+        timeout, when given, bounds that wait: returns False if the card still isn't queued, True otherwise."""
+        block = self.queue_policy == "block"
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            wait = QUEUE_WAIT if deadline is None else max(0, min(QUEUE_WAIT, deadline - time.time()))
+            try:
+                self.output_queue.put(card_event, block and self.running, wait)
+                break
+            except Queue.Full:
+                if block and self.running:
+                    if deadline is not None and time.time() >= deadline:
+                        return False
+                    continue
+                if self.queue_policy == "drop-oldest":
+                    try:
+                        self._drop(self.output_queue.get_nowait())
+                    except Queue.Empty:
+                        pass
+                    continue
+                self._drop(card_event)
+                break
+        OUTPUT_QUEUE_DEPTH.set(self.output_queue.qsize())
+        return True
+
+    def _drop(self, card_event):
+        OUTPUT_DROPPED.inc()
+        self.logger.warn("Output queue full, card not output: " + toHexString(card_event.uid))
+
+    def _repeat_tap(self, reader, uid):
+        """Whether the card was on the reader within the debounce window, each tap restarts the window"""
+        if self.recent_taps is None or not uid:
+            return False
+        key = (reader.name, tuple(uid))
+        repeat = self.recent_taps.get(key, False)
+        self.recent_taps.put(key, True)
+        return repeat
+
+    def _serve_reader(self, reader, heartbeat=None):
+        """Reader worker: process cards from one reader until the daemon stops
+
+        An unplugged reader is waited for and served again once it's back, except for replayed readers which are only
+        served to the end of their trace. heartbeat, when given, is called with busy=False on every pass of the loop
+        and busy=True as a card arrives."""
+        replugged = None
+        while self._serve_attached_reader(reader, heartbeat, replugged) and self.reacquire:
+            replugged_reader = self._reacquire(reader.name, heartbeat)
+            if replugged_reader is None:
+                break
+            if reader in self.readers: self.readers[self.readers.index(reader)] = replugged_reader  # For _stop_workers
+            reader = replugged_reader
+            replugged = time.time()
+
+    def _serve_attached_reader(self, reader, heartbeat=None, replugged=None):
+        """Process cards from the reader until it goes away (returns True) or the daemon stops (returns False)
+
+        replugged is the time.time() the reader was re-acquired at, for measuring the time to its first tap."""
+        present = READER_PRESENT.labels(reader.name)
+        present.set(1)
+        try:
+            while self.running:
+                if heartbeat is not None: heartbeat(False)
+                try:
+                    if not reader.exists():
+                        raise ReaderNotFoundException
+                    # Block until the card state changes, the timeout only serves to re-check the reader exists
+                    event = reader.wait_for_event(1)
+                    if event == cardwatch.CARD_ARRIVED:
+                        trace = tracing.TapTrace(time.time())
+                        if heartbeat is not None: heartbeat(True)
+                        conn = reader.connect()
+                        trace.mark("connect")
+                        if conn is not None:
+                            self._process_card(reader, conn, trace)
+                            if replugged is not None:
+                                REPLUG_TO_TAP_SECONDS.observe(time.time() - replugged)
+                                self.logger.info("First tap {0:.1f}s after {1} was reconnected".format(
+                                    time.time() - replugged, reader.name))
+                                replugged = None
+                    elif event == cardwatch.CARD_REMOVED:
+                        self.logger.debug('Card removed from ' + reader.name)
+                except FailedException, args:
+                    # An error occurred while reading card
+                    self.logger.warn("Card processing failed: " + str(args))
+                except ConnectionLostException, args:
+                    # Card likely removed too quickly
+                    self.logger.warn("Card removed too soon: " + str(args))
+                    REMOVED_TOO_SOON.inc()
+                except CardConnectionException:
+                    # Unexpected but recoverable error, possibly caused by a software conflict
+                    self.logger.error(traceback.format_exc())
+                    reader.error_signal(duration=6)
+        except ReaderNotFoundException:
+            if self.reacquire:  # Otherwise it's a replayed reader at the end of its trace, which it has logged
+                self.logger.critical('Reader disconnected: ' + reader.name)
+            return True
+        except BaseException:
+            # Anything else is fatal for the whole daemon, re-raised by the output stage
+            self.worker_failure = sys.exc_info()
+            self.running = False
+        finally:
+            present.set(0)
+            reader.close()
+        return False
+
+    def _reacquire(self, name, heartbeat=None):
+        """Wait for the named reader to be plugged back in, checking with a backoff of up to REACQUIRE_MAX_DELAY
+
+        Returns a new Reader for it, ready to load the keys again, or None if the daemon stopped first."""
+        self.logger.info("Waiting for " + name + " to be reconnected")
+        delay = REACQUIRE_MIN_DELAY
+        while self.running:
+            if heartbeat is not None: heartbeat(False)
+            time.sleep(delay)
+            try:
+                replugged = autodetect.find_reader(name)
+            except (ReaderNotFoundException, CardConnectionException):
+                delay = min(2 * delay, REACQUIRE_MAX_DELAY)
+                continue
+            self._prepare_reader(replugged)
+            REACQUIRED.inc()
+            self.logger.info("Reader reconnected: " + replugged.name)
+            return replugged
+        return None
+
+    def _start_workers(self, readers):
+        self.readers = readers
+        self.workers = []
+        for reader in readers:
+            worker = threading.Thread(target=self._serve_reader, args=(reader,), name=reader.name)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def _stop_workers(self):
+        self.running = False
+        for reader in self.readers:
+            reader.cancel_wait()
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def _run_output_stage(self):
+        """Run the output worker until all reader workers have finished (or the daemon stops)
+
+        The reader workers are stopped first, then the cards already queued are output before returning: every card
+        a worker released is either output or counted as dropped."""
+        output_worker = threading.Thread(target=self._output_worker, name="Output")
+        output_worker.daemon = True
+        output_worker.start()
+        try:
+            while self.running and any(worker.is_alive() for worker in self.workers):
+                time.sleep(QUEUE_WAIT)  # Unlike blocking on the queue, leaves the main thread open to signals
+        finally:
+            self._stop_workers()
+            if output_worker.is_alive():
+                self.output_queue.put(None)
+            while output_worker.is_alive():
+                output_worker.join(QUEUE_WAIT)
+        if self.worker_failure is not None:
+            raise self.worker_failure[0], self.worker_failure[1], self.worker_failure[2]
+
+    def _output_worker(self):
+        """Output the cards from every reader worker in the order they were queued, until told to stop"""
+        try:
+            while True:
+                card_event = self.output_queue.get()
+                if card_event is None:
+                    break
+                OUTPUT_QUEUE_DEPTH.set(self.output_queue.qsize())
+                self._output(card_event)
+                if self.output_queue.empty():
+                    for sink in self.sinks:
+                        sink.flush()
+        except BaseException:
+            # Fatal for the whole daemon, re-raised by _run_output_stage
+            self.worker_failure = sys.exc_info()
+            self.running = False
+
+    def _output(self, card_event):
+        if card_event.trace is not None: card_event.trace.mark("queue")
+        if self.key_stroker is not None:
+            started = time.time()
+            self.key_stroker.send_string(card_event.output_string)
+            KEYSTROKE_SECONDS.observe(time.time() - started)
+        for sink in self.sinks:
+            sink.send(card_event)
+        if card_event.trace is not None: self._finish_trace(card_event)
+
+    def _finish_trace(self, card_event):
+        card_event.trace.mark("output")
+        durations = card_event.trace.finish()
+        if tracing.sampled(self.trace_sample):
+            self.logger.info("Tap trace: " + tracing.format_record(durations, card_event.card_type, card_event.apdus))
+
+    def _wait_for_readers(self):
         self.logger.info("Waiting for compatible reader...")
         busy_error = False  # Flag to avoid logging the Reader Busy message multiple times
+        registry.start()  # Enumerate once, then follow hotplug notifications
         while 1:
             try:
                 time.sleep(1)
-                from reader import autodetect
-                self.logger.info("Reader found")
-                return autodetect.Reader()
+                readers = autodetect.find_readers()
+                self.logger.info("Reader found: " + ", ".join(reader.name for reader in readers))
+                return readers
             except ReaderNotFoundException:
                 pass
             except CardConnectionException:
@@ -147,8 +609,9 @@ class HIDEmu:
                     self.logger.warn("Reader appears busy, this may indicate another piece of software is using it.")
                     busy_error = True
 
-    def _read_block(self, connection, block, length, key_a_num=None, key_b_num=None):
-        ret_list = self.reader.read_block(connection, block, length, key_a_num, key_b_num)
+    @staticmethod
+    def _read_block(reader, connection, block, length, key_a_num=None, key_b_num=None):
+        ret_list = reader.read_block(connection, block, length, key_a_num, key_b_num)
         return ret_list
 
     @staticmethod
@@ -165,32 +628,25 @@ class HIDEmu:
         int(value, 16)  # also throws ValueError if not a hex string
         return toBytes(value)
 
-    def _process_output_string(self, output_string, uid_bytes, data_list=None):
-        if data_list is None: data_list = ["", "", "", "", "", "", "", ""]
-        if uid_bytes is None:
-            uidlen = "0"
-            uidint = ""
-            uid = ""
-        else:
-            uidlen = str(len(uid_bytes))
-            uidint = str(self._little_endian_value(uid_bytes))
-            uid = toHexString(uid_bytes, PACK)
-
-        return output_string.format(UIDLEN=uidlen,
-                                    TYPE=self.reader.card_type,
-                                    SUBTYPE=self.reader.card_subtype,
-                                    UIDINT=uidint,
-                                    UID=uid,
-                                    CR=os.linesep,
-                                    DATA=data_list[0],
-                                    DATA0=data_list[0],
-                                    DATA1=data_list[1],
-                                    DATA2=data_list[2],
-                                    DATA3=data_list[3],
-                                    DATA4=data_list[4],
-                                    DATA5=data_list[5],
-                                    DATA6=data_list[6],
-                                    DATA7=data_list[7])
+    def _output_template(self):
+        """The full output template: head, pseudo-tracks with their sentinels and tail"""
+        output_string = self.head + self.start1 + self.track1 + self.end
+        if self.track2 != "": output_string += self.start2 + self.track2 + self.end
+        if self.track3 != "": output_string += self.start3 + self.track3 + self.end
+        output_string += self.tail
+        return output_string
+
+    def _process_output_string(self, uid_bytes, data_list, reader):
+        """Render the compiled template, computing only the fields it references"""
+        if uid_bytes is None: uid_bytes = []
+        values = {}
+        for field, value in self.field_values:
+            values[field] = value(uid_bytes, data_list, reader)
+        return self.template.render(values)
+
+    def _prepare_reader(self, reader):
+        reader.set_keys(self.key1, self.key2)
+        reader.recorder = self.recorder
 
     def set_status(self, status):
         self.status = status
@@ -203,41 +659,28 @@ class HIDEmu:
         except singleproc.AlreadyLocked:
             self.logger.error('Attempted to start while another instance is already running')
             sys.exit(-1)
+        metrics_server = None
         try:
             self.running = True
-            self.reader = self._wait_for_reader()
-            self.reader.set_keys(self.key1, self.key2)
-            self.key_stroker = keystroker.KeyStroker()
+            if self.metrics_address is not None:
+                metrics_server = metrics.serve(self.metrics_address)
+            classifier.classifier.set_overrides(self.atr_overrides)
+            if self.replay_trace is not None:
+                readers = replay.readers(self.replay_trace, self.replay_realtime)
+            else:
+                readers = self._wait_for_readers()
+            for reader in readers:
+                self._prepare_reader(reader)
+            if self.output != "none":
+                self.key_stroker = keystroker.create(self.output, self.key_pacing, self.paste_threshold)
+            self.sinks = [jsonsink.JsonSink(target) for target in self.json_sinks]
+            if self.supervised:
+                self.readers = readers
+                self.workers = supervisor.start(self, readers, self.watchdog)
+            else:
+                self._start_workers(readers)
             self.set_status('STARTED')
-
-            try:
-                conn = self.reader.connect(1, False)
-            except CardRequestTimeoutException:
-                conn = None
-
-            while self.running:
-                try:
-                    if not self.reader.exists():
-                        raise ReaderNotFoundException
-                    if conn is None: conn = self.reader.connect()
-                    if conn is not None:
-                        self._process_card(conn)
-                except CardRequestTimeoutException:
-                    # Connection not established within the specified time frame (normal behaviour)
-                    pass
-                except FailedException, args:
-                    # An error occurred while reading card
-                    self.logger.warn("Card processing failed: " + str(args))
-                except ConnectionLostException, args:
-                    # Card likely removed too quickly
-                    self.logger.warn("Card removed too soon: " + str(args))
-                except CardConnectionException:
-                    # Unexpected but recoverable error, possibly caused by a software conflict
-                    self.logger.error(traceback.format_exc())
-                    self.reader.error_signal(duration=6)
-                conn = None
-        except ReaderNotFoundException:
-            self.logger.critical('Reader disconnected')
+            self._run_output_stage()
         except KeyboardInterrupt:
             self.logger.warn('Terminated by user')
         except GracefulExit:
@@ -249,10 +692,24 @@ class HIDEmu:
             self.logger.critical(traceback.format_exc())
             raise
         finally:
+            self._stop_workers()
+            registry.stop()
+            if self.key_stroker is not None:
+                self.key_stroker.close()
+            for sink in self.sinks:
+                sink.flush()
+                sink.close()
+            if metrics_server is not None:
+                metrics_server.shutdown()
+                metrics_server.server_close()
             singleproc.unlock(process_lock)
+            self.logger.info('Stats: ' + metrics.summary())
+            self.logger.info('Stage p50/p95/p99: ' + tracing.summary())
             self.set_status('STOPPED')
 
     def stop_daemon(self):
         """Gracefully stop the daemon"""
         # TODO: Research into SIGTERM handler to trigger this and test for cross platform support
         self.running = False
+        for reader in self.readers:
+            reader.cancel_wait()
@@ -11,7 +11,11 @@ import json
 import argparse
 import signal
 
-from hidemu import HIDEmu, GracefulExit
+import template
+import metrics
+from hidemu import HIDEmu, GracefulExit, QUEUE_POLICIES
+from output import keystroker
+from reader import classifier
 
 # These values are also used setup.py
 __app_name__ = "NFC HID Emulator"
@@ -123,6 +127,88 @@ def setup_arg_parser():
                         "  * \"offset\" is optional (default is 0).\n"
                         "  * \"type\":\"int\" recommended for track 2 & 3 data for\n"
                         "    magstripe application compatibilty reasons.")
+    parser.add_argument("-ao", "--atr-overrides", type=atr_overrides_arg,
+                        help="Card classifications to use in place of the built in\n"
+                        "ones - json string mapping ATRs to card details. \n"
+                        "\n"
+                        "E.G. \n'{\"3B8F8001804F0CA000000306030001000000006A\":\n"
+                        "[\"<description>\",\"<type>\",\"<subtype>\",<auth>,<read>]}'\n"
+                        "\n"
+                        "NOTES:\n  * <type> and <subtype> fill {TYPE} and {SUBTYPE}.\n"
+                        "  * <auth> and <read> (true|false) enable sector\n"
+                        "    authentication and data definitions.")
+    parser.add_argument("-db", "--debounce", type=positive_float_arg,
+                        help="Seconds during which the same card tapped again on the\n"
+                        "same reader is ignored (no data read or output), each\n"
+                        "tap restarts the window. \n\nDEFAULT: output every tap")
+    parser.add_argument("-ca", "--result-cache", type=positive_float_arg,
+                        help="Seconds to remember the data read from each card (by UID,\n"
+                        "ATR and data definition), repeat taps within that time\n"
+                        "only read the UID. Only for data which never changes. Send\n"
+                        "SIGUSR1 to flush the cache (to each reader process when\n"
+                        "supervised). \n\nDEFAULT: always read the card")
+    parser.add_argument("-cb", "--cache-bypass", action="append",
+                        help="Card type (as output by {TYPE}, e.g. MFU) which is always\n"
+                        "read from the card, not the result cache. May be repeated.")
+    parser.add_argument("-mi", "--memory-image", action="store_true",
+                        help="Read all of the card's memory once per tap and take the\n"
+                        "data definitions from that image. Worthwhile when many\n"
+                        "fields come from one card, JSON sinks get the image.")
+    parser.add_argument("-o", "--output", choices=sorted(keystroker.BACKENDS) + ["none"],
+                        help="Keystroke backend. \n"
+                        "  * x - X11 XTest (Linux default)\n"
+                        "  * uinput - kernel virtual keyboard, no X session needed\n"
+                        "    (console, Wayland, kiosk), requires /dev/uinput access\n"
+                        "  * win - Windows (Windows default)\n"
+                        "  * none - no keystrokes (use with JSONSINK)")
+    parser.add_argument("-js", "--json-sink", action="append",
+                        help="Also write each card as a JSON Lines record (uid, atr,\n"
+                        "type, subtype, data, timestamps) to \"-\" (stdout), a file,\n"
+                        "a named pipe or a Unix socket. May be repeated.")
+    parser.add_argument("-qs", "--queue-size", type=positive_int_arg,
+                        help="Cards which may be read ahead of the keystrokes. \n\nDEFAULT: 16",
+                        default=16)
+    parser.add_argument("-qp", "--queue-policy", choices=QUEUE_POLICIES,
+                        help="What to do with a card read while the queue is full.\n"
+                        "  * block - hold it on the reader until there's room\n"
+                        "  * drop-oldest - queue it, discarding the oldest queued card\n"
+                        "  * drop-newest - discard it\n"
+                        "\nDEFAULT: block",
+                        default="block")
+    parser.add_argument("-kp", "--key-pacing", type=non_negative_int_arg,
+                        help="Milliseconds to wait before each emulated key press,\n"
+                        "for applications which drop fast input. \n\nDEFAULT: 0",
+                        default=0)
+    parser.add_argument("-pt", "--paste-threshold", type=positive_int_arg,
+                        help="Paste output of at least this many characters through\n"
+                        "the clipboard (Ctrl+V) instead of typing it, the previous\n"
+                        "clipboard contents are restored afterwards. X only. \n\nDEFAULT: always type")
+    parser.add_argument("-me", "--metrics", type=metrics_address_arg,
+                        help="Serve counters and histograms in Prometheus text format\n"
+                        "over HTTP on [HOST:]PORT (HOST defaults to 127.0.0.1) or on\n"
+                        "a Unix socket when given a path.")
+    parser.add_argument("-ts", "--trace-sample", type=fraction_arg,
+                        help="Fraction of taps (0 to 1) to log a stage timing trace\n"
+                        "for: connect, LED signal, UID, data, render, output queue\n"
+                        "and keystrokes. Stage p50/p95/p99 are always collected. \n\nDEFAULT: 0",
+                        default=0)
+    parser.add_argument("-rc", "--record",
+                        help="Append every tap's commands and responses (with ATR and\n"
+                        "timing) to this trace file, for replaying later. Keys are\n"
+                        "not recorded.")
+    parser.add_argument("-rp", "--replay",
+                        help="Serve the taps in this trace file instead of real readers,\n"
+                        "stopping once they have all been played.")
+    parser.add_argument("-rr", "--replay-realtime", action="store_true",
+                        help="Replay with the recorded response times and gaps between\n"
+                        "taps instead of as fast as possible.")
+    parser.add_argument("-sv", "--supervise", action="store_true",
+                        help="Serve each reader from its own child process and restart\n"
+                        "any reader which stops making progress (see WATCHDOG).")
+    parser.add_argument("-wd", "--watchdog", type=positive_float_arg,
+                        help="Seconds a supervised reader may go without progress\n"
+                        "before it is restarted. \n\nDEFAULT: 10",
+                        default=10)
     parser.add_argument("-l", "--log", type=log_file_arg,
                         help="\nLog file. \n\nDEFAULT: hidemu.log",
                         default="hidemu.log")
@@ -136,6 +222,53 @@ def mifare_key_arg(value):
     return value
 
 
+def non_negative_int_arg(value):
+    """Validate a whole number of zero or more"""
+    value = int(value)
+    if value < 0: raise ValueError
+    return value
+
+
+def positive_int_arg(value):
+    """Validate a whole number greater than zero"""
+    value = int(value)
+    if value <= 0: raise ValueError
+    return value
+
+
+def positive_float_arg(value):
+    """Validate a number greater than zero"""
+    value = float(value)
+    if value <= 0: raise ValueError
+    return value
+
+
+def atr_overrides_arg(value):
+    """Validate ATR classification overrides json string"""
+    overrides = json.loads(value)
+    if type(overrides) != dict: raise ValueError
+    try:
+        classifier.AtrClassifier().set_overrides(overrides)
+    except (TypeError, ValueError):
+        raise ValueError
+    return overrides
+
+
+def fraction_arg(value):
+    """Validate a number from 0 to 1"""
+    value = float(value)
+    if not 0 <= value <= 1: raise ValueError
+    return value
+
+
+def metrics_address_arg(address):
+    try:
+        metrics.check_address(address)
+    except ValueError, e:
+        raise argparse.ArgumentTypeError(str(e))
+    return address
+
+
 def log_file_arg(file_name):
     """Validate log file is writable"""
     try:  # Test write app name and version to the file
@@ -149,12 +282,8 @@ def log_file_arg(file_name):
 
 
 def substitution_string_arg(string):
-    try:
-        # Keep this list in sync with the format list in HIDEmu._process_output_string
-        string.format(UIDLEN="", TYPE="", SUBTYPE="", UIDINT="", UID="", CR="", DATA="",
-                      DATA0="", DATA1="", DATA2="", DATA3="", DATA4="", DATA5="", DATA6="", DATA7="")
-    except KeyError:
-        raise ValueError
+    """Validate an output template string (raises ValueError), see template.FIELDS"""
+    template.compile(string)
     return string
 
 
@@ -162,6 +291,10 @@ def signal_handler(signal, frame):
     raise GracefulExit()
 
 
+def flush_signal_handler(signal, frame):
+    hid_emu.request_flush()
+
+
 def main():
     """Validate args, initialise logger and start up HIDEmu"""
     global hid_emu
@@ -169,6 +302,7 @@ def main():
     # For testing json parser...
     # -dd '[{"auth":"A0","type":"int","mad":"HHHH","block":12,"offset":1,"length":4}]'
     args = parser.parse_args()
+    if args.replay and args.supervise: parser.error("--replay can't be supervised")
     hidemu_logger = setup_logger('hidemu', args.log)
 
     hid_emu = HIDEmu(head=args.head,
@@ -180,11 +314,31 @@ def main():
                      tail=args.tail,
                      key1=args.key0,
                      key2=args.key1,
-                     data_definition=args.data_definition)
+                     data_definition=args.data_definition,
+                     supervised=args.supervise,
+                     watchdog=args.watchdog,
+                     key_pacing=args.key_pacing,
+                     output=args.output,
+                     paste_threshold=args.paste_threshold,
+                     json_sinks=args.json_sink,
+                     memory_image=args.memory_image,
+                     atr_overrides=args.atr_overrides,
+                     metrics_address=args.metrics,
+                     trace_sample=args.trace_sample,
+                     record=args.record,
+                     replay_trace=args.replay,
+                     replay_realtime=args.replay_realtime,
+                     debounce=args.debounce,
+                     result_cache=args.result_cache,
+                     result_cache_bypass=args.cache_bypass,
+                     queue_size=args.queue_size,
+                     queue_policy=args.queue_policy)
+    if hasattr(signal, "SIGUSR1"): signal.signal(signal.SIGUSR1, flush_signal_handler)
     hid_emu.start_daemon()
 
 
 if __name__ == '__main__':
     # TODO: No luck getting this to work on Windows as yet
     signal.signal(signal.SIGTERM, signal_handler)
+    if hasattr(signal, "SIGUSR1"): signal.signal(signal.SIGUSR1, signal.SIG_IGN)  # Until there's a cache to flush
     main()
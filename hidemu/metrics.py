@@ -0,0 +1,408 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# metrics.py - process wide performance counters
+#
+
+"""Daemon statistics
+
+Counters, gauges and histograms are created once at import time by the modules that own them and updated in place,
+so they are cheap enough to leave on in the hot path. Labelled metrics create the child for a new combination of
+label values once (under a lock), after that a child is one dictionary lookup away.
+
+Everything can be served in the Prometheus text exposition format over HTTP, on a local TCP port or a Unix socket.
+
+A supervised reader process reports what it recorded with take(), the parent adds that to its own metrics with
+merge() so there is one set of metrics to serve. Gauges created with local=True describe one process and are not
+reported.
+
+"""
+
+import os
+import socket
+import bisect
+import threading
+import collections
+import BaseHTTPServer
+import SocketServer
+
+METRICS = []  # Every metric (or labelled family) in creation order
+NAMES = {}    # Name: metric
+
+# Histogram bucket upper bounds in seconds, suits APDUs (milliseconds) through to whole taps
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Counter:
+    """Monotonically increasing value"""
+    type = "counter"
+    local = False
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self.reported = 0  # Value as of the last take()
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def take(self):
+        """Returns the increase since the last take(), None if there was none"""
+        with self.lock:
+            change, self.reported = self.value - self.reported, self.value
+        return change or None
+
+    def merge(self, change):
+        self.inc(change)
+
+    def samples(self, labels=""):
+        yield self.name + labels, self.value
+
+
+class Gauge:
+    """Value which may go up and down"""
+    type = "gauge"
+    local = False
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self.reported = 0  # Value as of the last take()
+        self.lock = threading.Lock()
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+    def take(self):
+        """Returns the change since the last take(), None if there was none"""
+        with self.lock:
+            change, self.reported = self.value - self.reported, self.value
+        return change or None
+
+    def merge(self, change):
+        with self.lock:
+            self.value += change
+
+    def samples(self, labels=""):
+        yield self.name + labels, self.value
+
+
+class Histogram:
+    """Distribution of observed values over preallocated buckets"""
+    type = "histogram"
+    local = False
+
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last one is +Inf
+        self.sum = 0
+        self.count = 0
+        self.reported = (list(self.counts), 0, 0)  # counts, sum and count as of the last take()
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def take(self):
+        """Returns (counts, sum, count) observed since the last take(), None if nothing was"""
+        with self.lock:
+            counts, total, count = self.reported
+            if count == self.count:
+                return None
+            change = [now - then for now, then in zip(self.counts, counts)], self.sum - total, self.count - count
+            self.reported = (list(self.counts), self.sum, self.count)
+        return change
+
+    def merge(self, change):
+        counts, total, count = change
+        with self.lock:
+            for i, n in enumerate(counts):
+                self.counts[i] += n
+            self.sum += total
+            self.count += count
+
+    def samples(self, labels=""):
+        separator = labels[:-1] + "," if labels else "{"
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative = 0
+        for bound, n in zip(self.buckets + ("+Inf",), counts):
+            cumulative += n
+            yield '{0}_bucket{1}le="{2}"}}'.format(self.name, separator, bound), cumulative
+        yield self.name + "_sum" + labels, total
+        yield self.name + "_count" + labels, count
+
+
+class Quantiles:
+    """Quantiles of the most recent observations (a Prometheus summary)"""
+    type = "summary"
+    local = False
+
+    def __init__(self, name, description, window=1000, quantiles=(0.5, 0.95, 0.99)):
+        self.name = name
+        self.description = description
+        self.quantiles = quantiles
+        self.recent = collections.deque(maxlen=window)
+        self.sum = 0
+        self.count = 0
+        self.reported = (0, 0)  # sum and count as of the last take()
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.recent.append(value)
+            self.sum += value
+            self.count += 1
+
+    def take(self):
+        """Returns (observations, sum, count) since the last take(), None if there were none
+
+        Only the observations still in the window are returned."""
+        with self.lock:
+            total, count = self.reported
+            if count == self.count:
+                return None
+            recent = list(self.recent)[-min(self.count - count, len(self.recent)):]
+            change = recent, self.sum - total, self.count - count
+            self.reported = (self.sum, self.count)
+        return change
+
+    def merge(self, change):
+        recent, total, count = change
+        with self.lock:
+            self.recent.extend(recent)
+            self.sum += total
+            self.count += count
+
+    @property
+    def value(self):
+        return self.count
+
+    def quantile(self, q):
+        """Returns the q quantile of the recent observations, None if there are none"""
+        with self.lock:
+            recent = sorted(self.recent)
+        return Quantiles._pick(recent, q)
+
+    def samples(self, labels=""):
+        separator = labels[:-1] + "," if labels else "{"
+        with self.lock:
+            recent, total, count = sorted(self.recent), self.sum, self.count
+        for q in self.quantiles:
+            value = Quantiles._pick(recent, q)
+            yield '{0}{1}quantile="{2}"}}'.format(self.name, separator, q), float("nan") if value is None else value
+        yield self.name + "_sum" + labels, total
+        yield self.name + "_count" + labels, count
+
+    @staticmethod
+    def _pick(ordered, q):
+        if not ordered:
+            return None
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class Family:
+    """A metric split by label values, labels(...) returns the child for one combination"""
+    local = False
+
+    def __init__(self, metric_class, name, description, label_names, **kwargs):
+        self.metric_class = metric_class
+        self.type = metric_class.type
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.kwargs = kwargs
+        self.children = {}  # Label values tuple: metric
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.get(values)
+                if child is None:
+                    child = self.metric_class(self.name, self.description, **self.kwargs)
+                    self.children[values] = child
+        return child
+
+    @property
+    def value(self):
+        return sum(child.value for child in self.children.values())
+
+    def take(self):
+        """Returns [(label values, change)] for the children which changed since the last take(), None if none did"""
+        changes = []
+        for values, child in self.children.items():
+            change = child.take()
+            if change is not None:
+                changes.append((values, change))
+        return changes or None
+
+    def merge(self, changes):
+        for values, change in changes:
+            self.labels(*values).merge(change)
+
+    def samples(self, labels=""):
+        for values, child in sorted(self.children.items()):
+            pairs = ",".join('{0}="{1}"'.format(name, _escape(value)) for name, value in zip(self.label_names, values))
+            for sample in child.samples("{" + pairs + "}"):
+                yield sample
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _register(metric):
+    METRICS.append(metric)
+    NAMES[metric.name] = metric
+    return metric
+
+
+def counter(name, description, labels=None):
+    """Create and register a Counter, or a family of them when label names are given"""
+    if labels:
+        return _register(Family(Counter, name, description, labels))
+    return _register(Counter(name, description))
+
+
+def gauge(name, description, labels=None, local=False):
+    """Create and register a Gauge, or a family of them when label names are given
+
+    A local gauge describes this process only, take() leaves it out."""
+    metric = Family(Gauge, name, description, labels) if labels else Gauge(name, description)
+    metric.local = local
+    return _register(metric)
+
+
+def histogram(name, description, labels=None, buckets=LATENCY_BUCKETS):
+    """Create and register a Histogram, or a family of them when label names are given"""
+    if labels:
+        return _register(Family(Histogram, name, description, labels, buckets=buckets))
+    return _register(Histogram(name, description, buckets))
+
+
+def quantiles(name, description, labels=None, window=1000):
+    """Create and register a Quantiles, or a family of them when label names are given"""
+    if labels:
+        return _register(Family(Quantiles, name, description, labels, window=window))
+    return _register(Quantiles(name, description, window))
+
+
+def take():
+    """Returns what every metric recorded since the last take(), as [(name, change)] for merge() in another process"""
+    changes = []
+    for metric in METRICS:
+        change = None if metric.local else metric.take()
+        if change is not None:
+            changes.append((metric.name, change))
+    return changes
+
+
+def after_fork():
+    """Replace locks a parent thread may have held when the process forked and start take() from here"""
+    for metric in METRICS:
+        metric.lock = threading.Lock()
+        for child in getattr(metric, "children", {}).values():
+            child.lock = threading.Lock()
+    take()
+
+
+def merge(changes, gauges=None):
+    """Add changes from take() in another process to the metrics here
+
+    The gauge changes are also added up in the dict gauges when it is given, see withdraw()."""
+    for name, change in changes:
+        metric = NAMES[name]
+        metric.merge(change)
+        if gauges is not None and metric.type == "gauge":
+            for values, amount in change if isinstance(metric, Family) else [(None, change)]:
+                gauges[name, values] = gauges.get((name, values), 0) + amount
+
+
+def withdraw(gauges):
+    """Take back gauge changes added up by merge(), once the process which reported them has gone"""
+    for (name, values), amount in gauges.items():
+        metric = NAMES[name]
+        (metric if values is None else metric.labels(*values)).merge(-amount)
+    gauges.clear()
+
+
+def summary():
+    """One line summary of all counters for the log"""
+    return ", ".join("{0}={1:g}".format(m.name, m.value) for m in METRICS if m.type == "counter")
+
+
+def exposition():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in METRICS:
+        lines.append("# HELP {0} {1}".format(metric.name, metric.description))
+        lines.append("# TYPE {0} {1}".format(metric.name, metric.type))
+        for name, value in metric.samples():
+            lines.append("{0} {1!r}".format(name, float(value)))
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = exposition()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        return "metrics client"  # No reverse lookups (and Unix socket clients have no address)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _UnixHTTPServer(BaseHTTPServer.HTTPServer):
+    address_family = getattr(socket, "AF_UNIX", None)  # None where there are no Unix sockets (Windows)
+
+    def server_bind(self):
+        if os.path.exists(self.server_address): os.unlink(self.server_address)
+        SocketServer.TCPServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def is_socket_path(address):
+    return "/" in address
+
+
+def check_address(address):
+    """Raises ValueError for an address this platform can't serve on"""
+    if is_socket_path(address) and _UnixHTTPServer.address_family is None:
+        raise ValueError("Unix sockets are not supported on this platform: " + address)
+
+
+def serve(address):
+    """Serve exposition() on a background thread, returns the server (call shutdown() and server_close() to stop)
+
+    address is "[host:]port" (host defaults to 127.0.0.1) or the path of a Unix socket, see check_address."""
+    check_address(address)
+    if is_socket_path(address):
+        server = _UnixHTTPServer(address, _Handler)
+    else:
+        host, port = address.rsplit(":", 1) if ":" in address else ("127.0.0.1", address)
+        server = BaseHTTPServer.HTTPServer((host, int(port)), _Handler)
+    thread = threading.Thread(target=server.serve_forever, name="Metrics")
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# jsonsink.py - structured card event output
+#
+
+"""JsonSink class
+
+Writes one JSON Lines record per processed card to stdout, a file, a named pipe or a Unix socket. Needs no desktop
+session, so it can replace or run alongside keystroke output.
+
+Records are buffered and written out by flush(), which the output stage calls whenever it runs out of cards to
+output. A consumer which goes away (closed pipe or socket) costs the records written meanwhile, the sink reconnects on
+the next record.
+
+"""
+
+import os
+import sys
+import stat
+import json
+import socket
+import logging
+import metrics
+from smartcard.util import toHexString, PACK
+
+RECORDS = metrics.counter("json_sink_records_total", "Card events written by JSON sinks")
+DROPPED = metrics.counter("json_sink_dropped_total", "Card events lost because a JSON sink consumer was not connected")
+
+
+def to_record(card_event):
+    """Returns the JSON-able dict for a hidemu.CardEvent"""
+    record = {
+        "reader": card_event.reader_name,
+        "uid": toHexString(card_event.uid, PACK),
+        "atr": toHexString(card_event.atr, PACK),
+        "type": card_event.card_type,
+        "subtype": card_event.card_subtype,
+        "description": card_event.card_description,
+        "data": card_event.data_list,
+        "detected": card_event.detected,
+        "processed": card_event.processed,
+    }
+    if card_event.image is not None:  # Audit dump of the whole card
+        record["memory"], record["memory_valid"] = card_event.image.to_hex()
+    return record
+
+
+class JsonSink:
+    """Card event writer, target is "-" for stdout or the path of a file, named pipe or Unix socket"""
+
+    def __init__(self, target):
+        self.target = target
+        self.logger = logging.getLogger('hidemu')
+        self.stream = None
+        self.pending = []  # Encoded records waiting for flush()
+
+    def send(self, card_event):
+        self.pending.append(json.dumps(to_record(card_event), separators=(',', ':')) + "\n")
+
+    def flush(self):
+        if not self.pending:
+            return
+        records = self.pending
+        self.pending = []
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write("".join(records))
+            self.stream.flush()
+            RECORDS.inc(len(records))
+        except (IOError, OSError, socket.error), args:
+            self.logger.warn("JSON sink " + self.target + " unavailable: " + str(args))
+            DROPPED.inc(len(records))
+            self.close()
+
+    def close(self):
+        if self.stream is not None and self.stream is not sys.stdout:
+            try:
+                self.stream.close()
+            except (IOError, OSError, socket.error):
+                pass
+        self.stream = None
+
+    def _open(self):
+        if self.target == "-":
+            return sys.stdout
+        mode = os.stat(self.target).st_mode if os.path.exists(self.target) else 0
+        if stat.S_ISSOCK(mode):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.target)
+            return sock.makefile("w")
+        if stat.S_ISFIFO(mode):
+            import fcntl
+            # Open fails straight away (rather than blocking the output stage) when nothing is reading the pipe
+            fd = os.open(self.target, os.O_WRONLY | os.O_NONBLOCK)
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) & ~os.O_NONBLOCK)
+            return os.fdopen(fd, "w")
+        return open(self.target, "a")
@@ -13,22 +13,38 @@
 
 """Key stroke emulation
 
-The KeyStroker class sends text to a supported OS in the form of phony key strokes.
+KeyStroker objects send text to a supported OS in the form of phony key strokes, create() picks the backend.
 
 """
 
 import sys
 import exceptions
 
+# Backend name: module providing its KeyStroker class
+BACKENDS = {
+    "x": "xkeystroker",
+    "uinput": "uinputkeystroker",
+    "win": "winkeystroker",
+}
 
-if sys.platform.startswith('linux'):
-    import xkeystroker as key_stroker
-elif sys.platform.startswith('win32'):
-    import winkeystroker as key_stroker
-else:
+
+def default_backend():
+    """Returns the name of the usual backend for this platform"""
+    if sys.platform.startswith('linux'):
+        return "x"
+    elif sys.platform.startswith('win32'):
+        return "win"
     raise exceptions.UnsupportedPlatformException
 
 
-class KeyStroker(key_stroker.KeyStroker):
-    """Emulate keystrokes."""
-    pass
+def create(backend=None, pacing=0, paste_threshold=None):
+    """Returns a KeyStroker from the named backend (the platform default when None)
+
+    Backend modules are only imported when selected, so e.g. uinput works on hosts without Xlib.
+    paste_threshold (X backend only) pastes strings of at least that many characters through the clipboard."""
+    if backend is None:
+        backend = default_backend()
+    module = __import__(BACKENDS[backend], globals(), locals(), ["KeyStroker"])
+    if backend == "x":
+        return module.KeyStroker(pacing, paste_threshold)
+    return module.KeyStroker(pacing)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# uinputkeystroker.py - Linux kernel uinput virtual keyboard
+#
+
+"""KeyStroker class for Linux (using uinput)
+
+Creates a persistent virtual keyboard through /dev/uinput and writes the input_event records for a whole string in a
+single write. Works without an X session (console, Wayland, kiosk) but the user needs write access to /dev/uinput.
+
+Kernel keycodes are layout agnostic, the characters below assume the session uses a US keyboard layout.
+
+"""
+
+import os
+import time
+import stat
+import fcntl
+import struct
+
+# linux/input.h and linux/uinput.h
+EV_SYN = 0x00
+EV_KEY = 0x01
+SYN_REPORT = 0x00
+BUS_VIRTUAL = 0x06
+UI_DEV_CREATE = 0x5501
+UI_DEV_DESTROY = 0x5502
+UI_SET_EVBIT = 0x40045564
+UI_SET_KEYBIT = 0x40045565
+
+INPUT_EVENT = struct.Struct('llHHi')  # struct input_event {struct timeval time; __u16 type; __u16 code; __s32 value;}
+UINPUT_USER_DEV = struct.Struct('80sHHHHi' + 'i' * 64 * 4)  # name, input_id, ff_effects_max, abs max/min/fuzz/flat
+
+KEY_LEFTSHIFT = 42
+
+# US layout: characters typed by each kernel keycode, unshifted and shifted
+US_LAYOUT = [
+    (1, '\x1b', None), (2, '1', '!'), (3, '2', '@'), (4, '3', '#'), (5, '4', '$'), (6, '5', '%'), (7, '6', '^'),
+    (8, '7', '&'), (9, '8', '*'), (10, '9', '('), (11, '0', ')'), (12, '-', '_'), (13, '=', '+'), (14, '\b', None),
+    (15, '\t', None), (16, 'q', 'Q'), (17, 'w', 'W'), (18, 'e', 'E'), (19, 'r', 'R'), (20, 't', 'T'), (21, 'y', 'Y'),
+    (22, 'u', 'U'), (23, 'i', 'I'), (24, 'o', 'O'), (25, 'p', 'P'), (26, '[', '{'), (27, ']', '}'), (28, '\n', None),
+    (30, 'a', 'A'), (31, 's', 'S'), (32, 'd', 'D'), (33, 'f', 'F'), (34, 'g', 'G'), (35, 'h', 'H'), (36, 'j', 'J'),
+    (37, 'k', 'K'), (38, 'l', 'L'), (39, ';', ':'), (40, '\'', '"'), (41, '`', '~'), (43, '\\', '|'), (44, 'z', 'Z'),
+    (45, 'x', 'X'), (46, 'c', 'C'), (47, 'v', 'V'), (48, 'b', 'B'), (49, 'n', 'N'), (50, 'm', 'M'), (51, ',', '<'),
+    (52, '.', '>'), (53, '/', '?'), (57, ' ', None),
+]
+
+KEYMAP = {}  # character: (keycode, shifted)
+for _keycode, _plain, _shifted in US_LAYOUT:
+    KEYMAP[_plain] = (_keycode, False)
+    if _shifted is not None:
+        KEYMAP[_shifted] = (_keycode, True)
+KEYMAP['\r'] = KEYMAP['\n']
+
+
+def _event(event_type, code, value):
+    return INPUT_EVENT.pack(0, 0, event_type, code, value)
+
+
+SYN = _event(EV_SYN, SYN_REPORT, 0)
+SHIFT_DOWN = _event(EV_KEY, KEY_LEFTSHIFT, 1) + SYN
+SHIFT_UP = _event(EV_KEY, KEY_LEFTSHIFT, 0) + SYN
+
+# Pre-packed press/release records for every character
+STROKES = {}
+for _character, (_keycode, _shifted) in KEYMAP.items():
+    STROKES[_character] = (_event(EV_KEY, _keycode, 1) + SYN + _event(EV_KEY, _keycode, 0) + SYN, _shifted)
+
+
+class KeyStroker:
+    """Emulate key strokes required to output specified characters"""
+
+    def __init__(self, pacing=0, device_path="/dev/uinput"):
+        """device_path may be a regular file or pipe (the device setup is skipped and only the events are written)"""
+        self.pacing = pacing  # Milliseconds to wait before each character, for apps that drop fast input
+        self.fd = os.open(device_path, os.O_WRONLY)
+        self.is_device = stat.S_ISCHR(os.fstat(self.fd).st_mode)
+        if self.is_device:
+            self._create_device()
+
+    def send_string(self, string):
+        """Emulate typing a string with a single write (one per character when pacing)"""
+        records = []
+        shift_down = False
+        for character in string:
+            try:
+                stroke, shifted = STROKES[character]
+            except KeyError:
+                continue  # Invalid character
+            if shifted != shift_down:
+                records.append(SHIFT_DOWN if shifted else SHIFT_UP)
+                shift_down = shifted
+            records.append(stroke)
+            if self.pacing:
+                self._write(''.join(records))
+                records = []
+                time.sleep(self.pacing / 1000.0)
+        if shift_down:
+            records.append(SHIFT_UP)
+        self._write(''.join(records))
+
+    def send_character(self, character):
+        """Emulate typing a character"""
+        self.send_string(character)
+
+    def close(self):
+        """Remove the virtual keyboard"""
+        if self.fd is not None:
+            if self.is_device:
+                fcntl.ioctl(self.fd, UI_DEV_DESTROY)
+            os.close(self.fd)
+            self.fd = None
+
+    def _write(self, data):
+        while data:
+            written = os.write(self.fd, data)
+            data = data[written:]
+
+    def _create_device(self):
+        fcntl.ioctl(self.fd, UI_SET_EVBIT, EV_KEY)
+        fcntl.ioctl(self.fd, UI_SET_EVBIT, EV_SYN)
+        for keycode in set(keycode for keycode, shifted in KEYMAP.values()) | set([KEY_LEFTSHIFT]):
+            fcntl.ioctl(self.fd, UI_SET_KEYBIT, keycode)
+        self._write(UINPUT_USER_DEV.pack("hidemu virtual keyboard", BUS_VIRTUAL, 0x0001, 0x0001, 1, 0,
+                                         *([0] * 64 * 4)))
+        fcntl.ioctl(self.fd, UI_DEV_CREATE)
+        time.sleep(0.5)  # Give udev and the session a moment to pick up the new keyboard before the first keys
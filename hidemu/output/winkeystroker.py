@@ -13,6 +13,7 @@ specific WinAPI functions.
 
 """
 
+import time
 from ctypes import windll
 
 # VkKeyScanA high order flag key codes (SHIFT, CTRL, ALT)
@@ -24,12 +25,13 @@ MODIFIER_KEYCODE = {1: 16,
 class KeyStroker:
     """Emulate key strokes required to output specified characters"""
 
-    def __init__(self):
-        pass
+    def __init__(self, pacing=0):
+        self.pacing = pacing  # Milliseconds to wait before each character, for apps that drop fast input
 
     def send_string(self, string):
         """Emulate typing a string"""
         for character in string:
+            if self.pacing: time.sleep(self.pacing / 1000.0)
             try:
                 self.send_character(character)
             except KeyError:
@@ -43,6 +45,9 @@ class KeyStroker:
         self._key_up(vk_code)
         self._release_modifiers(modifiers)
 
+    def close(self):
+        pass
+
     def _apply_modifiers(self, modifiers):
         for bit in self._modifier_bit_split(modifiers):
             self._key_down(MODIFIER_KEYCODE[bit])
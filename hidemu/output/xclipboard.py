@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# xclipboard.py - X CLIPBOARD selection owner used for paste output
+#
+
+"""Clipboard class for Linux (using Xlib)
+
+Takes ownership of the CLIPBOARD selection and answers selection requests from other clients on a background thread,
+which lets a long output string be delivered with one paste instead of hundreds of key strokes.
+
+"""
+
+import threading
+import Xlib.threaded  # Before any Display: the serving thread waits for events while the output thread makes requests
+from Xlib import display, X, Xatom
+from Xlib.protocol import event, request
+
+
+class Clipboard:
+    """Hold text on the X clipboard"""
+
+    def __init__(self):
+        self.display = display.Display()  # Own connection, its events are read by the serving thread only
+        self.window = self.display.screen().root.create_window(0, 0, 1, 1, 0, X.CopyFromParent)
+        self.CLIPBOARD = self.display.intern_atom('CLIPBOARD')
+        self.TARGETS = self.display.intern_atom('TARGETS')
+        self.UTF8_STRING = self.display.intern_atom('UTF8_STRING')
+        self.PROPERTY = self.display.intern_atom('HIDEMU_CLIPBOARD')
+        self.contents = None     # Text served while we own the clipboard
+        self.restore = None      # Text to put back on the clipboard once contents has been served, see set()
+        self.owned = False
+        self.fetched = None      # Result of the last fetch from another owner
+        self.fetch_done = threading.Event()
+        self.served = threading.Event()  # Set when another client has taken the contents
+        self.thread = threading.Thread(target=self._serve, name="Clipboard")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def get(self, timeout=0.5):
+        """Returns the current clipboard text, or None if it is empty or the owner doesn't answer in time
+
+        While contents waits to be served, that's the text it will be replaced with."""
+        if self.owned:
+            return self.contents if self.restore is None else self.restore
+        if self.display.get_selection_owner(self.CLIPBOARD) == X.NONE:
+            return None
+        self.fetched = None
+        self.fetch_done.clear()
+        self.window.convert_selection(self.CLIPBOARD, self.UTF8_STRING, self.PROPERTY, X.CurrentTime)
+        self.display.flush()
+        self.fetch_done.wait(timeout)
+        return self.fetched
+
+    def set(self, text, restore=None):
+        """Put text on the clipboard, or None to give up ownership
+
+        restore, when given, is put back on the clipboard by the serving thread once another client has taken text."""
+        self.restore = restore
+        self._set(text)
+
+    def _set(self, text):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        self.contents = text
+        self.served.clear()
+        if text is None:
+            if self.owned:
+                request.SetSelectionOwner(display=self.display.display, window=X.NONE, selection=self.CLIPBOARD,
+                                          time=X.CurrentTime)
+                self.owned = False
+        elif not self.owned:
+            self.window.set_selection_owner(self.CLIPBOARD, X.CurrentTime)
+            self.owned = True
+        self.display.flush()
+
+    def close(self):
+        self.set(None)
+        self.display.close()
+
+    def _serve(self):
+        while True:
+            e = self.display.next_event()
+            if e.type == X.SelectionRequest:
+                self._answer(e)
+            elif e.type == X.SelectionClear:
+                self.owned = False
+            elif e.type == X.SelectionNotify:
+                if e.property != X.NONE:
+                    self.fetched = self.window.get_full_property(e.property, X.AnyPropertyType).value
+                    self.window.delete_property(e.property)
+                self.fetch_done.set()
+
+    def _answer(self, selection_request):
+        requestor = selection_request.requestor
+        target = selection_request.target
+        prop = selection_request.property
+        if prop == X.NONE:
+            prop = target  # Obsolete clients
+        text = self.contents
+        if target == self.TARGETS:
+            requestor.change_property(prop, Xatom.ATOM, 32, [self.TARGETS, self.UTF8_STRING, Xatom.STRING])
+        elif target in (self.UTF8_STRING, Xatom.STRING) and text is not None:
+            requestor.change_property(prop, target, 8, text)
+        else:
+            prop = X.NONE
+        notify = event.SelectionNotify(time=selection_request.time, requestor=requestor,
+                                       selection=selection_request.selection, target=target, property=prop)
+        requestor.send_event(notify)
+        self.display.flush()
+        if prop != X.NONE and target != self.TARGETS:
+            restore, self.restore = self.restore, None
+            if restore is not None:
+                self._set(restore)
+            self.served.set()  # After _set, which clears it
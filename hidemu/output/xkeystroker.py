@@ -7,105 +7,157 @@
 
 """KeyStroker class for Linux (using Xlib)
 
-Simple keystroke emulation module.
+Simple keystroke emulation module. Characters are looked up in a table built from the X server's own keyboard mapping,
+so the right keycode and modifiers are used whatever the keyboard layout.
 
 """
 
-import time
+import logging
 from Xlib import display, X, XK
 from Xlib.ext.xtest import fake_input
-
-SPECIAL_KEYSYM = {
-    ' ': "space",
-    '\t': "Tab",
-    '\n': "Linefeed",
-    '\r': "Return",
-    '\e': "Escape",
-    '!': "exclam",
-    '#': "numbersign",
-    '%': "percent",
-    '$': "dollar",
-    '&': "ampersand",
-    '"': "quotedbl",
-    '\'': "apostrophe",
-    '(': "parenleft",
-    ')': "parenright",
-    '*': "asterisk",
-    '=': "equal",
-    '+': "plus",
-    ',': "comma",
-    '-': "minus",
-    '.': "period",
-    '/': "slash",
-    ':': "colon",
-    ';': "semicolon",
-    '<': "less",
-    '>': "greater",
-    '?': "question",
-    '@': "at",
-    '[': "bracketleft",
-    ']': "bracketright",
-    '\\': "backslash",
-    '^': "asciicircum",
-    '_': "underscore",
-    '`': "grave",
-    '{': "braceleft",
-    '|': "bar",
-    '}': "braceright",
-    '~': "asciitilde"
+import metrics
+import xclipboard
+
+UNSERVED_PASTES = metrics.counter("pastes_unserved_total",
+                                  "Outputs pasted with Ctrl+V which no client took from the clipboard in time")
+
+# Non-printing keysyms which have a character equivalent
+CONTROL_KEYSYM = {
+    XK.XK_Return: '\r',
+    XK.XK_Linefeed: '\n',
+    XK.XK_Tab: '\t',
+    XK.XK_Escape: '\x1b',
+    XK.XK_BackSpace: '\b',
 }
 
+# Position in each keycode's keysym list and the modifiers which select it (group 1, levels 1 to 4)
+KEYSYM_LEVELS = [(0, 0), (1, X.ShiftMask), (4, X.Mod5Mask), (5, X.ShiftMask | X.Mod5Mask)]
+
+
+def _keysym_to_character(keysym):
+    """Returns the character typed by keysym, or None if it doesn't type one"""
+    if 0x20 <= keysym <= 0x7e or 0xa0 <= keysym <= 0xff:  # Latin-1 keysyms equal their character code
+        return chr(keysym)
+    if 0x01000100 <= keysym <= 0x0110ffff:  # Unicode keysyms
+        return unichr(keysym - 0x01000000)
+    return CONTROL_KEYSYM.get(keysym)
+
 
 class KeyStroker:
     """Emulate key strokes required to output specified characters"""
 
-    def __init__(self):
+    def __init__(self, pacing=0, paste_threshold=None):
         self.display = display.Display()
-        self.shift_keycode = self.display.keysym_to_keycode(XK.XK_Shift_L)
+        self.logger = logging.getLogger('hidemu')
+        self.pacing = pacing  # Milliseconds the X server waits before each key press, for apps that drop fast input
+        self.paste_threshold = paste_threshold  # Paste strings at least this long rather than typing them
+        self.clipboard = None  # xclipboard.Clipboard, created for the first paste
+        self.keymap = None    # character: (keycode, modifier mask)
+        self.modifier_keycodes = {}  # modifier mask: keycode to press for it
+        self._build_keymap()
 
     def send_string(self, string):
-        """Emulate typing a string"""
+        """Emulate typing a string
+
+        All the events are queued up and flushed with a single sync, modifiers are held across runs of characters
+        which need them and any pacing is applied by the X server (XTest event delay) rather than by sleeping here.
+        Strings of paste_threshold characters or more are pasted through the clipboard, falling back to typing."""
+        self._check_mapping()
+        if self.paste_threshold and len(string) >= self.paste_threshold and self._paste(string):
+            return
+        keymap = self.keymap
+        held = 0  # Modifier mask currently pressed
         for character in string:
             try:
-                self.send_character(character)
+                keycode, modifiers = keymap[character]
             except KeyError:
-                pass  # Invalid character
+                continue  # Invalid character
+            if modifiers != held:
+                self._set_modifiers(held, modifiers)
+                held = modifiers
+            self._key_down(keycode, self.pacing)
+            self._key_up(keycode)
+        self._set_modifiers(held, 0)
+        self.display.sync()
 
     def send_character(self, character):
         """Emulate typing a character"""
-        keycode, shifted = self._to_keycode(character)
-
-        # Press
-        if shifted:
-            self._key_down(self.shift_keycode)
-        self._key_down(keycode)
+        self.send_string(character)
+
+    def close(self):
+        if self.clipboard is not None:
+            self.clipboard.close()
+        self.display.close()
+
+    def _paste(self, string, timeout=1.0):
+        """Paste string with Ctrl+V, the previous clipboard contents are restored once a client has taken it
+
+        Returns False if the keyboard has no Ctrl+V to press (the string is typed instead). Once Ctrl+V has been sent
+        it's never typed as well: a client which reads the clipboard late would get it twice. If nobody takes the
+        string within timeout it's left on the clipboard for a late reader and counted as unserved."""
+        control_keycode = self.display.keysym_to_keycode(XK.XK_Control_L)
+        v_keycode, v_modifiers = self.keymap.get('v', (None, None))
+        if not control_keycode or v_keycode is None or v_modifiers:
+            return False
+        if self.clipboard is None:
+            self.clipboard = xclipboard.Clipboard()
+
+        self.clipboard.set(string, restore=self.clipboard.get())  # Nothing to restore if get() failed (None)
+        self._key_down(control_keycode)
+        self._key_down(v_keycode)
+        self._key_up(v_keycode)
+        self._key_up(control_keycode)
         self.display.sync()
+        if not self.clipboard.served.wait(timeout):
+            UNSERVED_PASTES.inc()
+            self.logger.warn("Pasted output not taken from the clipboard within {0:g}s".format(timeout))
+        return True
 
-        time.sleep(0.001)
-
-        # Release
-        self._key_up(keycode)
-        if shifted:
-            self._key_up(self.shift_keycode)
-        self.display.sync()
+    def _set_modifiers(self, held, wanted):
+        for mask, keycode in self.modifier_keycodes.items():
+            if held & mask and not wanted & mask:
+                self._key_up(keycode)
+            elif wanted & mask and not held & mask:
+                self._key_down(keycode)
 
-    def _key_down(self, keycode):
-        fake_input(self.display, X.KeyPress, keycode)
+    def _key_down(self, keycode, delay=0):
+        fake_input(self.display, X.KeyPress, keycode, delay)
 
     def _key_up(self, keycode):
         fake_input(self.display, X.KeyRelease, keycode)
 
-    def _to_keycode(self, character):
-        shifted = self._is_shifted(character)
-        keysym = XK.string_to_keysym(character)
-        if keysym == 0:
-            keysym = XK.string_to_keysym(SPECIAL_KEYSYM[character])
-        return self.display.keysym_to_keycode(keysym), shifted
-
-    @staticmethod
-    def _is_shifted(character):
-        if character.isupper():
-            return True
-        if character in '~!@#$%^&*()_+{}|:"<>?':
-            return True
-        return False
+    def _check_mapping(self):
+        """Rebuild the keymap if it is missing or the server has announced a new keyboard mapping"""
+        while self.display.pending_events():
+            event = self.display.next_event()
+            if event.type == X.MappingNotify and event.request != X.MappingPointer:
+                self.display.refresh_keyboard_mapping(event)
+                self.keymap = None
+        if self.keymap is None:
+            self._build_keymap()
+
+    def _build_keymap(self):
+        """Map every character the keyboard can type to its keycode and modifiers"""
+        self.modifier_keycodes = {X.ShiftMask: self.display.keysym_to_keycode(XK.XK_Shift_L)}
+        level3_keycode = self.display.keysym_to_keycode(XK.XK_ISO_Level3_Shift)
+        if level3_keycode:
+            self.modifier_keycodes[X.Mod5Mask] = level3_keycode
+        available = 0
+        for mask in self.modifier_keycodes:
+            available |= mask
+
+        first_keycode = self.display.display.info.min_keycode
+        count = self.display.display.info.max_keycode - first_keycode + 1
+        mapping = self.display.get_keyboard_mapping(first_keycode, count)
+        keymap = {}
+        for index, modifiers in KEYSYM_LEVELS:  # Prefer the fewest modifiers
+            if modifiers & ~available:
+                continue  # No key to press for this modifier
+            for offset, keysyms in enumerate(mapping):
+                if index < len(keysyms):
+                    character = _keysym_to_character(keysyms[index])
+                    if character is not None and character not in keymap:
+                        keymap[character] = (first_keycode + offset, modifiers)
+        if '\n' not in keymap and '\r' in keymap:
+            keymap['\n'] = keymap['\r']  # Few layouts have a Linefeed key, {CR} is os.linesep
+        self.keymap = keymap
@@ -9,43 +9,41 @@
 
 """Auto Detect Reader Model
 
-Attempt to detect the reader and select the correct class from the (not so extensive) list of supported readers.
+Attempt to detect every attached reader and drive each according to its spec from the (not so extensive) list of
+supported readers in specs.py.
 
 """
 
 import exceptions
-
-from smartcard.System import readers
-from smartcard.pcsc import PCSCExceptions
-
-
-def reader_exists(reader_prefix):
-    """Returns boolean based on the existence of our reader."""
-    try:
-        for r in readers():
-            if r.name.startswith(reader_prefix):
-                return True
-        return False
-    except TypeError:  # Occurs when SCardSvr is not running on Windows
-        raise exceptions.PyScardFailure
-    except PCSCExceptions.ListReadersException:  # When pcscd is not running
-        raise exceptions.PyScardFailure
-
-
-# Search for readers by name and import the appropriate backend module
-# SUPPORT FOR ADDITIONAL READERS MAY BE ADDED IN VIA THIS BLOCK HERE!
-if reader_exists("ACS ACR122"):
-    import acr122 as reader
-elif reader_exists("OMNIKEY CardMan 5x21-CL"):
-    import omnikey5x21cl as reader
-elif reader_exists("SCM Microsystems Inc. SDI011"):
-    import sdi011 as reader
-# elif reader_exists("MY READER"):
-#     import my_reader as reader
-else:
-    raise exceptions.ReaderNotFoundException
-
-
-class Reader(reader.Reader):
-    """NFC Reader class"""
-    pass
+import specs
+from registry import registry
+
+
+def _create_reader(r):
+    """Returns a Reader instance driving pyscard reader r, or None if unsupported (see specs.SPECS)"""
+    spec = specs.find_spec(r.name)
+    if spec is None:
+        return None
+    return spec.reader_class()(r, spec)
+
+
+def find_reader(name):
+    """Returns a Reader instance for the attached reader with exactly this name"""
+    for r in registry.list():
+        if r.name == name:
+            reader = _create_reader(r)
+            if reader is not None:
+                return reader
+    raise exceptions.ReaderNotFoundException(name)
+
+
+def find_readers():
+    """Returns a Reader instance for every attached supported reader (in any mix of models)"""
+    found = []
+    for r in registry.list():
+        reader = _create_reader(r)
+        if reader is not None:
+            found.append(reader)
+    if not found:
+        raise exceptions.ReaderNotFoundException
+    return found
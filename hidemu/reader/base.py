@@ -4,37 +4,72 @@
 #
 # base.py - reader-agnostic stuff
 
-"""ReaderBase abstract class defined here"""
-
-from smartcard.System import readers
-from smartcard.util import toHexString
-
-# Card feature support matrix as determined by ATR
-# The key purpose is to enable specific features only on recognised card types
-# [description, type code, sub-type code, sector auth, read]
-ATR_SUPPORT_MATRIX = {
-    "3B 8F 80 01 80 4F 0C A0 00 00 03 06 0B 00 14 00 00 00 00 77":
-    ["iCODE", "ICD", "SLIX", False, True],
-    "3B 8F 80 01 80 4F 0C A0 00 00 03 06 03 00 01 00 00 00 00 6A":
-    ["Mifare Classic 1k", "MFC", "1K", True, True],
-    "3B 8F 80 01 80 4F 0C A0 00 00 03 06 03 00 02 00 00 00 00 69":
-    ["Mifare Classic 4k", "MFC", "4K", True, True],
-    "3B 8F 80 01 80 4F 0C A0 00 00 03 06 03 00 03 00 00 00 00 68":
-    ["Mifare Ultralight", "MFU", "", True, True],
-    "3B 87 80 01 C1 05 2F 2F 01 BC D6 A9":
-    ["Mifare Plus", "MFP", "", False, False],
-}
-DEFAULT_SUPPORT = ["Unknown", "UKN", "", False, False]
-
-# TODO: Consolidate all the common Reader methods into ReaderBase
+"""ReaderBase class defined here
+
+ReaderBase drives any reader described by a specs.ReaderSpec, reader modules only add what their model does
+differently.
+
+"""
+
+import time
+import logging
+import metrics
+import exceptions
+import cardwatch
+import classifier
+import feedback
+from registry import registry
+from smartcard.CardConnectionObserver import CardConnectionObserver
+from smartcard.Exceptions import CardConnectionException, NoCardException
+from smartcard.util import toBytes
+
+# Block (page) size of the card types with a multi-block read command, see read_multiple
+MULTI_READ_BLOCK_SIZE = {"MFU": 4, "ICD": 4}
+
+APDU_SECONDS = metrics.histogram("apdu_seconds", "Card command round trip time", ["command"])
+AUTH_FAILURES = metrics.counter("auth_failures_total", "Mifare Classic sector authentications refused")
+
+PCSC_TAG_RESPONSE = 0x97  # Data object holding the card's response to a transparent session transceive
+
+ISO15693_READ_MULTIPLE_MAX = 32  # Blocks per Read Multiple Blocks command, well inside any reader's frame size
+
+
+class ApduCounter(CardConnectionObserver):
+    """Counts the commands sent over the card connections it observes"""
+
+    def __init__(self):
+        self.count = 0
+
+    def update(self, connection, event):
+        if event.type == 'command':
+            self.count += 1
 
 
 class ReaderBase:
     """Reader base class"""
 
-    def __init__(self):
+    def __init__(self, reader=None, spec=None):
+        """reader is the pyscard reader to drive, the first one matching the spec's prefix is used when omitted"""
         self.prefix = "Unknown"
+        self.name = "Unknown"
         self.reader = None
+        self.spec = spec  # specs.ReaderSpec
+        self.logger = logging.getLogger('hidemu')
+        if spec is not None:
+            self.prefix = spec.prefix
+            if reader is None: reader = ReaderBase._find_reader(self.prefix)
+            self.reader = reader
+            self.name = reader.name
+        self.watcher = None  # cardwatch.CardWatcher, created on first wait_for_event
+        self.recorder = None  # replay.TraceRecorder while recording taps
+        self.feedback = feedback.FeedbackScheduler(self)
+
+        # Flag to ensure keys are loaded upon next connection.
+        # These values are reset once keys are loaded.
+        self.key_load_pending = False
+        self.key_0_byte_list = [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
+        self.key_1_byte_list = [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
+        self.apdu_counter = ApduCounter()  # Commands sent to the current card, reset by connect
         # TODO: Seems like a Card class is in order
         self.card_ATR = None
         self.card_authentication = None
@@ -43,75 +78,248 @@ class ReaderBase:
         self.card_subtype = None
         self.card_authable = False
         self.card_readable = False
+        self.card_multi_read = True  # Cleared once the card rejects its multi-block read command
 
     def exists(self):
-        return ReaderBase._exists(self.prefix)
+        return ReaderBase._exists(self.name)
 
     def process_atr(self, atr):
-        """Find details of supported features from ATR_SUPPORT_MATRIX"""
+        """Find details of supported features by classifying the ATR (see classifier.py)"""
         self.card_ATR = atr
-        try:
-            support = ATR_SUPPORT_MATRIX[toHexString(atr)]
-        except KeyError:
-            support = DEFAULT_SUPPORT
+        support = classifier.classify(atr)
         self.card_description, self.card_type, self.card_subtype, self.card_authable, self.card_readable = support
+        self.card_multi_read = True
 
-    def connect(self, timeout=1, new_card_only=True):
-        """Returns a connection if possible, otherwise returns None"""
-        return None
+    def wait_for_event(self, timeout=1):
+        """Block until a card arrives or is removed, or until timeout (seconds) expires
 
-    def error_signal(self, duration):
-        pass
+        Returns cardwatch.CARD_ARRIVED, cardwatch.CARD_REMOVED or None"""
+        if self.watcher is None:
+            self.watcher = cardwatch.CardWatcher(self.reader.name)
+        return self.watcher.wait(timeout)
 
-    @staticmethod
-    def busy_signal(connection):
-        pass
+    def cancel_wait(self):
+        """Wake up any thread blocked in wait_for_event"""
+        if self.watcher is not None:
+            self.watcher.cancel()
 
-    @staticmethod
-    def ready_signal(connection):
-        pass
+    def close(self):
+        """Release the PC/SC context held for card detection"""
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
 
-    def read_block(self, connection, block, length, key_a_num=None, key_b_num=None):
-        return []
+    def connect(self):
+        """Returns a connection to the card currently on the reader if possible, otherwise returns None"""
+        try:
+            # Establish reader-centric connection
+            connection = self.reader.createConnection()
+            if self.recorder is not None: connection = self.recorder.wrap(connection, self.name)
+            self.apdu_counter.count = 0
+            connection.addObserver(self.apdu_counter)
+            connection.connect()
+            self.process_atr(connection.getATR())
+
+            # Load keys if need be
+            self.card_authentication = None
+            if self.key_load_pending and self.card_authable:
+                self._load_keys(connection)
+
+            return connection
+        except (CardConnectionException, NoCardException):
+            return None
 
     def error_signal(self, duration=6):
-        """If possible, blink or bleep at the user (for about 6 seconds by default)"""
+        """If possible, blink or bleep at the user (for about 6 seconds by default), returns without waiting
+
+        Intended to alert the user that there's a problem, details of the issue will be logged"""
+        self.feedback.error(duration)
+
+    def busy_signal(self, connection):
+        """The card is being read, shown if it takes long enough to notice (see feedback.py)"""
+        self.feedback.busy()
+
+    def ready_signal(self, connection):
+        """Ready for the next card"""
+        self.feedback.ready(connection)
+
+    def _show_signal(self, connection, signal):
+        """Model specific: show "busy" or "ready" using connection"""
         pass
 
-    def set_keys(self, key_0=None, key_1=None):
+    def _error_signal(self, duration):
+        """Model specific: blink or bleep for duration seconds, runs on a thread of its own"""
         pass
 
-    @staticmethod
-    def _find_reader(prefix):
-        """Iterate through the list of readers looking for the first one with matching prefix"""
-        for r in readers():
-            if r.name.startswith(prefix):
-                return r
-        raise exceptions.ReaderNotFoundException
+    def read_block(self, connection, block, length, key_a_num=None, key_b_num=None):
+        """Either key A or B must be specified for Mifare Classic cards"""
+        if not self.card_readable: raise exceptions.NotSupportedException("Read From Card")
+        if self.card_authable:
+            valid_num = [0x00, 0x01]
+            assert key_a_num in valid_num or key_b_num in valid_num
+            sector = ReaderBase.sector_of(block)
+            if self.card_authentication != [sector, key_a_num, key_b_num]:
+                self._auth_mfc(connection, block, key_a_num, key_b_num)
+                self.card_authentication = [sector, key_a_num, key_b_num]
+        data = self.read_multiple(connection, block, length)
+        if data is None: data = self._read_block(connection, block, length)
+        return data
+
+    def read_multiple(self, connection, block, length):
+        """Returns length bytes from block onwards, read with the card's multi-block read command
+
+        Returns None when the card has no such command, the read fits in one block or the card rejected the command
+        (for the rest of this card), read_block then falls back to a single read."""
+        block_size = MULTI_READ_BLOCK_SIZE.get(self.card_type)
+        if block_size is None or length <= block_size or not self.card_multi_read:
+            return None
+        try:
+            return self._read_multiple(connection, block, length)
+        except (exceptions.NotSupportedException, exceptions.UnexpectedErrorCodeException,
+                exceptions.FailedException), args:
+            self.logger.debug("Multi-block read rejected, using single reads: " + str(args))
+            self.card_multi_read = False
+            return None
+
+    def _read_multiple(self, connection, block, length):
+        """Raises NotSupportedException where the reader has no way to send the card's multi-block read"""
+        if self.card_type == "ICD":
+            return self._iso15693_read_multiple(connection, block, length)
+        raise exceptions.NotSupportedException("Multi-block Read")
+
+    def _iso15693_read_multiple(self, connection, block, length):
+        """ISO 15693 Read Multiple Blocks through a PC/SC Part 3 transparent session"""
+        block_size = MULTI_READ_BLOCK_SIZE["ICD"]
+        last_block = block + (length + block_size - 1) // block_size - 1
+        data = []
+        self._transmit(connection, "start_session")
+        try:
+            while block <= last_block:
+                count = min(last_block - block + 1, ISO15693_READ_MULTIPLE_MAX)
+                frame = [0x02, 0x23, block, count - 1]  # High data rate, Read Multiple Blocks, first block, count - 1
+                response = ReaderBase._tlv_value(
+                    self._transmit(connection, "transceive", [len(frame) + 2, 0x95, len(frame)] + frame),
+                    PCSC_TAG_RESPONSE)
+                if not response or response[0] & 0x01:  # Error flag set
+                    raise exceptions.NotSupportedException("Read Multiple Blocks")
+                data += response[1:]
+                block += count
+        finally:
+            self._transmit(connection, "end_session")
+        return data[:length]
 
     @staticmethod
-    def _exists(reader_prefix):
-        """Returns boolean based on the existence of the specified reader
+    def _tlv_value(data, wanted_tag):
+        """Returns the value of the first wanted_tag data object in a BER-TLV byte list, or None"""
+        i = 0
+        while i + 1 < len(data):
+            tag = data[i]
+            i += 1
+            if tag & 0x1F == 0x1F:  # Two byte tag
+                tag = (tag << 8) | data[i]
+                i += 1
+            length = data[i]
+            i += 1
+            if length == 0x81:
+                length = data[i]
+                i += 1
+            elif length == 0x82:
+                length = (data[i] << 8) | data[i + 1]
+                i += 2
+            if tag == wanted_tag:
+                return data[i:i + length]
+            i += length
+        return None
+
+    def set_keys(self, key_0=None, key_1=None):
+        """Specify reader keys 0 and 1 as 12 character hex strings (not to be confused with sector keys A and B)
+
+        These keys will be used to access blocks, at that time either key 1 or 2 can be used as key A and/or B.
+
+        Omitting a key will revert it to the default FF key"""
+        if key_0 is None: key_0 = "FFFFFFFFFFFF"
+        if key_1 is None: key_1 = "FFFFFFFFFFFF"
+        assert len(key_0) == 12 and len(key_1) == 12
+        assert int(key_0, 16) and int(key_1, 16)  # throws ValueError if not a hex string
+
+        # TODO: Look for more secure way of loading keys
+        # using command line args which then go on to create immutable hex strings seems less than ideal
+
+        # Set a flag to load the keys as soon as the next card arrives
+        self.key_0_byte_list = toBytes(key_0)
+        self.key_1_byte_list = toBytes(key_1)
+        self.key_load_pending = True
+
+    def _load_keys(self, connection):
+        """Load keys into the reader"""
+        assert len(self.key_0_byte_list) == 6 and len(self.key_1_byte_list) == 6
+        self._transmit(connection, "load_key_0", self.key_0_byte_list)
+        self._transmit(connection, "load_key_1", self.key_1_byte_list)
 
-        The just happens to be the first place the app falls over if pcsc isn't available,
-        beware the anecdotal attempt at cross platform exception handling."""
+        for i in range(0, 6):  # Wipe the stored key
+            self.key_0_byte_list[i] = 0xFF
+            self.key_1_byte_list[i] = 0xFF
+        self.key_load_pending = False
+
+    def get_serial_number(self, connection):
+        """Return the card serial number as a list of bytes"""
+        return self._transmit(connection, "get_data")
+
+    def _transmit(self, connection, command, command_vars=None):
+        """Send the spec's named command followed by command_vars, returns: data as a byte list
+
+        Status words other than 90 00 raise the exception the spec maps them to."""
+        description, template = self.spec.commands[command]
+        if self.feedback.busy_due is not None: self.feedback.poll(connection)
+        started = time.time()
         try:
-            for r in readers():
-                if r.name.startswith(reader_prefix):
-                    return True
-            return False
-        except TypeError:  # Occurs when SCardSvr is not running on Windows
-            raise exceptions.PyScardFailure
-        except PCSCExceptions.ListReadersException:  # When pcscd is not running
-            raise exceptions.PyScardFailure
+            data, sw1, sw2 = connection.transmit(template + command_vars if command_vars else template)
+        except (AttributeError, IndexError):
+            # Connection lost
+            raise exceptions.ConnectionLostException
+        APDU_SECONDS.labels(description).observe(time.time() - started)
+        if sw1 == 0x90 and sw2 == 0x00:
+            return data
+        error = self.spec.status_words.get((sw1, sw2)) or self.spec.sw1_status.get(sw1)
+        if error is not None:
+            raise error(description)
+        raise exceptions.UnexpectedErrorCodeException("%02X %02X" % (sw1, sw2), description, sw1, sw2)
 
+    def _read_block(self, connection, block, length):
+        assert 0x00 <= block <= 0xff
+        assert 0x00 <= length <= 0xff
+        return self._transmit(connection, "read_block", [block, length])
+
+    def _auth_mfc(self, connection, block, key_a=None, key_b=None):
+        """Either key A or B must be specified"""
+        reader_keys = [0x00, 0x01]
+        assert key_a in reader_keys or key_b in reader_keys
+        assert 0x00 <= block <= 0xff
+
+        try:
+            if key_a is not None:
+                self._transmit(connection, "mfc_auth", [block, 0x60, key_a])
+            if key_b is not None:
+                self._transmit(connection, "mfc_auth", [block, 0x61, key_b])
+        except exceptions.FailedException:
+            AUTH_FAILURES.inc()
+            raise
 
     @staticmethod
-    def load_keys(connection, key_0=None, key_1=None):
-        """Load one or two keys into the reader"""
-        pass
+    def sector_of(block):
+        """Returns the Mifare Classic sector holding block"""
+        sector = block >> 2
+        if sector >= 32: sector = ((sector-32) >> 2) + 32  # 4K MFC cards have 8 sectors of 16 blocks at the end
+        return sector
 
     @staticmethod
-    def get_serial_number(connection):
-        """Return the card serial number as a list of bytes"""
-        return None
+    def _find_reader(prefix):
+        """Return the first reader with matching prefix"""
+        return registry.find(prefix)
+
+    @staticmethod
+    def _exists(reader_prefix):
+        """Returns boolean based on the existence of the specified reader
+
+        Answered from the reader registry, which also turns PC/SC service failures into PyScardFailure."""
+        return registry.exists(reader_prefix)
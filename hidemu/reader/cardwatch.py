@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# cardwatch.py - Event driven card detection
+#
+
+"""Card arrival/removal detection
+
+A CardWatcher holds one PC/SC context for the life of the reader and blocks in SCardGetStatusChange until the state of
+the reader changes. This replaces building a fresh CardRequest (and PC/SC context) for every poll of the daemon loop.
+
+"""
+
+import exceptions
+from smartcard import scard
+
+# Events returned by CardWatcher.wait()
+CARD_ARRIVED = "arrived"
+CARD_REMOVED = "removed"
+
+# States which indicate the reader itself has gone away
+READER_GONE_STATES = scard.SCARD_STATE_UNKNOWN | scard.SCARD_STATE_UNAVAILABLE
+READER_GONE_ERRORS = (scard.SCARD_E_UNKNOWN_READER, scard.SCARD_E_READER_UNAVAILABLE,
+                      scard.SCARD_E_NO_READERS_AVAILABLE)
+
+
+class CardWatcher:
+    """Watch a single reader for card arrival and removal"""
+
+    def __init__(self, reader_name):
+        self.reader_name = reader_name
+        self.context = None
+        self.state = scard.SCARD_STATE_UNAWARE  # Last event state reported by PC/SC, passed back as the current state
+        self.card_present = False
+
+    def open(self):
+        """Establish the PC/SC context (called automatically by wait)"""
+        hresult, context = scard.SCardEstablishContext(scard.SCARD_SCOPE_USER)
+        if hresult != scard.SCARD_S_SUCCESS:
+            raise exceptions.PyScardFailure(scard.SCardGetErrorMessage(hresult))
+        self.context = context
+
+    def close(self):
+        """Release the PC/SC context"""
+        if self.context is not None:
+            scard.SCardReleaseContext(self.context)
+            self.context = None
+
+    def cancel(self):
+        """Wake up a thread blocked in wait (it returns None)"""
+        if self.context is not None:
+            scard.SCardCancel(self.context)
+
+    def wait(self, timeout=1):
+        """Block until a card arrives or is removed, or until timeout (seconds) expires
+
+        Returns CARD_ARRIVED, CARD_REMOVED or None when nothing changed. The first call reports a card that is already
+        on the reader as an arrival."""
+        if self.context is None:
+            self.open()
+        hresult, states = scard.SCardGetStatusChange(self.context, int(timeout * 1000),
+                                                     [(self.reader_name, self.state)])
+        if hresult in (scard.SCARD_E_TIMEOUT, scard.SCARD_E_CANCELLED):
+            return None
+        if hresult in READER_GONE_ERRORS:
+            raise exceptions.ReaderNotFoundException(self.reader_name)
+        if hresult != scard.SCARD_S_SUCCESS:
+            raise exceptions.PyScardFailure(scard.SCardGetErrorMessage(hresult))
+
+        event_state = states[0][1]
+        self.state = event_state
+        if event_state & READER_GONE_STATES:
+            raise exceptions.ReaderNotFoundException(self.reader_name)
+
+        present = bool(event_state & scard.SCARD_STATE_PRESENT) and not event_state & scard.SCARD_STATE_MUTE
+        if present == self.card_present:
+            return None
+        self.card_present = present
+        if present:
+            return CARD_ARRIVED
+        return CARD_REMOVED
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# classifier.py - Card classification by ATR
+
+"""AtrClassifier class and module wide classifier instance
+
+Contactless readers build the ATR of a storage card as described in PC/SC Part 3: the historical bytes hold the
+registered application provider identifier of PC/SC (RID A0 00 00 03 06), a byte naming the card standard and two
+bytes naming the card. Cards are matched on those rather than the whole ATR, so variants differing only in interface
+bytes are still recognised. Results are memoised by raw ATR bytes, repeat taps cost a single dictionary lookup.
+
+Support entries are [description, type code, sub-type code, sector auth, read], the key purpose being to enable
+specific features only on recognised card types.
+
+"""
+
+import threading
+from collections import OrderedDict
+from smartcard.util import toBytes
+
+PCSC_RID = [0xA0, 0x00, 0x00, 0x03, 0x06]
+
+# PC/SC Part 3 card names
+CARD_NAME_SUPPORT = {
+    0x0001: ["Mifare Classic 1k", "MFC", "1K", True, True],
+    0x0002: ["Mifare Classic 4k", "MFC", "4K", True, True],
+    0x0003: ["Mifare Ultralight", "MFU", "", True, True],
+    0x0014: ["iCODE", "ICD", "SLIX", False, True],
+}
+
+# PC/SC Part 3 standards, for cards whose name isn't listed above
+STANDARD_SUPPORT = {
+    0x0B: ["ISO 15693", "ICD", "", False, True],
+}
+
+# Cards which don't present a PC/SC storage card ATR, matched on the whole ATR
+EXACT_SUPPORT = {
+    "3B 87 80 01 C1 05 2F 2F 01 BC D6 A9": ["Mifare Plus", "MFP", "", False, False],
+}
+
+DEFAULT_SUPPORT = ["Unknown", "UKN", "", False, False]
+
+MEMO_SIZE = 64  # Distinct ATRs remembered
+
+
+def historical_bytes(atr):
+    """Returns the historical bytes of an ATR byte list (ISO 7816-3), [] if it is malformed"""
+    if len(atr) < 2:
+        return []
+    count = atr[1] & 0x0F
+    i = 1  # Position of T0 then of each TDi
+    while True:
+        indicator = atr[i]
+        i += bin(indicator >> 4).count("1")  # TAi, TBi, TCi and TDi present
+        if not indicator & 0x80 or i >= len(atr):
+            break  # No TDi, i is the last interface byte
+    return atr[i + 1:i + 1 + count]
+
+
+def parse_storage_card(atr):
+    """Returns (standard, card name) from a PC/SC Part 3 storage card ATR, or None if it isn't one"""
+    historical = historical_bytes(atr)
+    # Category indicator 80, then the application identifier data object: 4F, length, RID, standard, card name
+    if len(historical) < 11 or historical[0] != 0x80 or historical[1] != 0x4F or historical[3:8] != PCSC_RID:
+        return None
+    return historical[8], (historical[9] << 8) | historical[10]
+
+
+class AtrClassifier:
+    """Classify cards by ATR, with memoised results"""
+
+    def __init__(self, memo_size=MEMO_SIZE):
+        self.memo_size = memo_size
+        self.memo = OrderedDict()  # Raw ATR bytes: support, most recently used last
+        self.overrides = {}        # Raw ATR bytes: support, from set_overrides
+        self.lock = threading.Lock()
+
+    def set_overrides(self, overrides):
+        """Replace the user-supplied classifications, a dict of ATR hex strings (spaces optional) to support lists"""
+        parsed = {}
+        for atr, support in (overrides or {}).items():
+            description, type_code, subtype_code, sector_auth, read = support
+            parsed[str(bytearray(toBytes(atr)))] = [description, type_code, subtype_code, bool(sector_auth), bool(read)]
+        with self.lock:
+            self.overrides = parsed
+            self.memo.clear()
+
+    def classify(self, atr):
+        """Returns the support entry for an ATR byte list"""
+        key = str(bytearray(atr))
+        with self.lock:
+            support = self.memo.pop(key, None)
+            if support is None:
+                support = self.overrides.get(key) or AtrClassifier._match(atr)
+                if len(self.memo) >= self.memo_size:
+                    self.memo.popitem(last=False)
+            self.memo[key] = support
+        return support
+
+    @staticmethod
+    def _match(atr):
+        storage_card = parse_storage_card(atr)
+        if storage_card is not None:
+            standard, card_name = storage_card
+            return CARD_NAME_SUPPORT.get(card_name) or STANDARD_SUPPORT.get(standard) or DEFAULT_SUPPORT
+        return EXACT_SUPPORT.get(" ".join("%02X" % byte for byte in atr), DEFAULT_SUPPORT)
+
+
+classifier = AtrClassifier()
+
+
+def classify(atr):
+    """Returns the support entry for an ATR byte list"""
+    return classifier.classify(atr)
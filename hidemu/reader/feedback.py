@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# feedback.py - Scheduling of reader LED/buzzer signals
+
+"""FeedbackScheduler class
+
+Signals cost commands to the reader, so they are only sent when the user would notice them:
+
+  * busy is due BUSY_DELAY seconds after the card arrives and goes out ahead of the next card command after that, so
+    quick taps never show it.
+  * ready is only sent when the reader shows something else (busy, an error, or nothing yet).
+  * error goes out on a thread of its own and the reader carries on straight away. A repeat while one is still
+    blinking is dropped as stale.
+
+"""
+
+import time
+import threading
+
+BUSY_DELAY = 0.1  # Seconds a card may take before it's worth showing it's being read
+
+
+class FeedbackScheduler:
+    """Signals for one reader, whose model sends them with _show_signal and _error_signal"""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.shown = None      # Signal the reader shows, None if unknown
+        self.busy_due = None   # time.time() the busy signal is due, None if not wanted
+        self.error_until = 0   # time.time() the current error signal ends
+
+    def busy(self):
+        self.busy_due = time.time() + BUSY_DELAY
+
+    def poll(self, connection):
+        """Send the busy signal if it's due, called ahead of each card command"""
+        if time.time() >= self.busy_due:
+            self.busy_due = None
+            self._show(connection, "busy")
+
+    def ready(self, connection):
+        self.busy_due = None
+        if self.shown != "ready":
+            self._show(connection, "ready")
+
+    def error(self, duration):
+        now = time.time()
+        if now < self.error_until:
+            return
+        self.error_until = now + duration
+        self.shown = None  # Whatever the blinking leaves the reader showing
+        thread = threading.Thread(target=self.reader._error_signal, args=(duration,),
+                                  name=self.reader.name + " error signal")
+        thread.daemon = True
+        thread.start()
+
+    def _show(self, connection, signal):
+        self.reader._show_signal(connection, signal)
+        self.shown = signal
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# registry.py - Cached list of attached readers
+#
+
+"""Reader registry
+
+Enumerates the PC/SC readers once and keeps the list current from plug and play notifications (the PC/SC
+"\\\\?PnP?\\Notification" pseudo-reader) on a background thread, so that exists() is answered from memory.
+
+Until start() is called, or if the PC/SC service does not support PnP notification, every lookup enumerates again.
+
+"""
+
+import time
+import logging
+import threading
+import exceptions
+import metrics
+from smartcard import scard
+from smartcard.System import readers
+from smartcard.pcsc import PCSCExceptions
+
+PNP_NOTIFICATION = "\\\\?PnP?\\Notification"
+
+ENUMERATIONS = metrics.counter("reader_enumerations_total", "Number of times the PC/SC readers were listed")
+ENUMERATION_SECONDS = metrics.counter("reader_enumeration_seconds_total", "Time spent listing PC/SC readers")
+
+
+class ReaderRegistry:
+    """Cached reader enumeration"""
+
+    def __init__(self):
+        self.logger = logging.getLogger('hidemu')
+        self.readers = []
+        self.watching = False
+        self.context = None
+        self.thread = None
+
+    def refresh(self):
+        """Enumerate the readers now"""
+        started = time.time()
+        try:
+            self.readers = readers()
+        except TypeError:  # Occurs when SCardSvr is not running on Windows
+            raise exceptions.PyScardFailure
+        except PCSCExceptions.ListReadersException:  # When pcscd is not running
+            raise exceptions.PyScardFailure
+        finally:
+            ENUMERATIONS.inc()
+            ENUMERATION_SECONDS.inc(time.time() - started)
+        return self.readers
+
+    def list(self):
+        """Returns the list of attached readers"""
+        if self.watching:
+            return self.readers
+        return self.refresh()
+
+    def find(self, prefix):
+        """Returns the first reader with a name beginning with prefix"""
+        for r in self.list():
+            if r.name.startswith(prefix):
+                return r
+        raise exceptions.ReaderNotFoundException
+
+    def exists(self, prefix):
+        """Returns boolean based on the existence of a reader with a name beginning with prefix"""
+        for r in self.list():
+            if r.name.startswith(prefix):
+                return True
+        return False
+
+    def start(self):
+        """Start keeping the list up to date from PnP notifications"""
+        if self.thread is not None:
+            return
+        hresult, self.context = scard.SCardEstablishContext(scard.SCARD_SCOPE_USER)
+        if hresult != scard.SCARD_S_SUCCESS:
+            raise exceptions.PyScardFailure(scard.SCardGetErrorMessage(hresult))
+        self.refresh()
+        self.watching = True
+        self.thread = threading.Thread(target=self._watch, name="ReaderRegistry")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.watching = False
+        if self.context is not None:
+            scard.SCardCancel(self.context)
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.context is not None:
+            scard.SCardReleaseContext(self.context)
+            self.context = None
+
+    def after_fork(self):
+        """Forget the context and thread inherited from a parent process (call start() again to follow hotplug)"""
+        self.watching = False
+        self.context = None
+        self.thread = None
+
+    def _watch(self):
+        state = scard.SCARD_STATE_UNAWARE
+        while self.watching:
+            hresult, states = scard.SCardGetStatusChange(self.context, scard.INFINITE, [(PNP_NOTIFICATION, state)])
+            if hresult == scard.SCARD_E_CANCELLED or hresult == scard.SCARD_E_TIMEOUT:
+                continue
+            if hresult != scard.SCARD_S_SUCCESS or states[0][1] & scard.SCARD_STATE_UNKNOWN:
+                self.logger.warn("Reader hotplug notification unavailable, reverting to enumeration on every lookup")
+                self.watching = False
+                return
+            if state == scard.SCARD_STATE_UNAWARE:
+                state = states[0][1]  # First call only reports the current state, the list is already fresh
+                continue
+            state = states[0][1]
+            try:
+                self.refresh()
+            except exceptions.PyScardFailure:
+                self.logger.error("Failed to list readers after hotplug notification")
+                self.readers = []
+            self.logger.debug("Readers changed: " + ", ".join(r.name for r in self.readers))
+
+
+registry = ReaderRegistry()  # Shared by every reader in the process
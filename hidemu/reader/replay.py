@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# replay.py - Record taps from real readers and replay them without hardware
+
+"""APDU trace recording and replay
+
+A TraceRecorder wraps each card connection a reader makes (see ReaderBase.connect) and appends every tap to a trace
+file as one JSON line: reader name, time, ATR and each command with its response (data + SW1 SW2) and round trip
+time. Keys sent with load key commands are blanked before they are written.
+
+readers() turns a trace back into readers: each is the recorded model's own Reader class (found by name, see
+specs.find_spec) driving a stand-in for the pyscard reader, which presents the recorded taps one after another and
+answers each command with the recorded response, odd status words included. A command the trace doesn't have fails
+the tap with a CardConnectionException, except LED and buzzer commands which are just acknowledged (whether they
+are sent can depend on timing). A reader goes away at the end of its taps, so a daemon serving only replayed readers
+stops once the trace has been played.
+
+"""
+
+import json
+import time
+import logging
+import threading
+import collections
+from smartcard.Exceptions import CardConnectionException, NoCardException
+from smartcard.CardConnectionEvent import CardConnectionEvent
+from smartcard.util import toHexString, toBytes, PACK
+import cardwatch
+import simulated
+from specs import ReaderSpec, find_spec
+
+LOAD_KEY = [0xFF, 0x82]  # Commands whose data is a key
+FEEDBACK_COMMANDS = ("output_control",)  # Spec commands answered 90 00 when they're not in the trace
+
+
+def _redact(apdu):
+    """Returns apdu with any key blanked"""
+    if apdu[:2] == LOAD_KEY: return apdu[:5] + [0x00] * len(apdu[5:])
+    return apdu
+
+
+class RecordingConnection:
+    """Wraps a pyscard CardConnection, recording each command and response of the tap"""
+
+    def __init__(self, connection, recorder, reader_name):
+        self.connection = connection
+        self.recorder = recorder
+        self.reader_name = reader_name
+        self.record = None  # The tap, from connect until saved
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def connect(self):
+        self.connection.connect()
+        self.record = {"reader": self.reader_name, "at": round(time.time(), 3),
+                       "atr": toHexString(self.connection.getATR(), PACK), "apdus": []}
+
+    def transmit(self, apdu):
+        started = time.time()
+        try:
+            data, sw1, sw2 = self.connection.transmit(apdu)
+        except Exception, e:
+            self._add(apdu, "!" + type(e).__name__, started)
+            raise
+        self._add(apdu, toHexString(data + [sw1, sw2], PACK), started)
+        return data, sw1, sw2
+
+    def disconnect(self):
+        try:
+            self.connection.disconnect()
+        finally:
+            self.save()
+
+    def save(self):
+        if self.record is not None:
+            self.recorder.save(self.record)
+            self.record = None
+
+    def _add(self, apdu, response, started):
+        if self.record is not None:
+            self.record["apdus"].append([toHexString(_redact(apdu), PACK), response, round(time.time() - started, 4)])
+
+
+class TraceRecorder:
+    """Appends the taps of the connections it wraps to a trace file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.open_taps = {}  # Reader name: RecordingConnection of the reader's latest tap
+
+    def __getstate__(self):
+        """Path only, for handing to a supervised reader process"""
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def wrap(self, connection, reader_name):
+        """Returns connection wrapped for recording, saving the reader's previous tap if it was never disconnected"""
+        previous = self.open_taps.get(reader_name)
+        if previous is not None: previous.save()
+        recording = RecordingConnection(connection, self, reader_name)
+        self.open_taps[reader_name] = recording
+        return recording
+
+    def save(self, record):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self.lock:
+            with open(self.path, "a") as trace_file:  # Reopened per tap, supervised readers append from each child
+                trace_file.write(line)
+
+
+class RecordedTap:
+    """One tap from a trace, standing in for the card"""
+
+    def __init__(self, record):
+        self.at = record["at"]
+        self.atr = toBytes(record["atr"])
+        self.exchanges = [(toBytes(command), response, seconds) for command, response, seconds in record["apdus"]]
+
+    def take(self, apdu):
+        """Returns (response, seconds) of the first unanswered recorded command matching apdu, None if there's none"""
+        command = _redact(apdu)
+        for i, exchange in enumerate(self.exchanges):
+            if exchange[0] == command:
+                del self.exchanges[i]
+                return exchange[1:]
+        return None
+
+
+class ReplayConnection:
+    """Stands in for a pyscard CardConnection, answering from a RecordedTap"""
+
+    def __init__(self, pcsc_reader):
+        self.pcsc_reader = pcsc_reader
+        self.tap = None
+        self.observers = []
+
+    def addObserver(self, observer):
+        self.observers.append(observer)
+
+    def connect(self):
+        self.tap = self.pcsc_reader.card
+        if self.tap is None: raise NoCardException("No card on " + self.pcsc_reader.name)
+
+    def disconnect(self):
+        self.tap = None
+
+    def getATR(self):
+        return list(self.tap.atr)
+
+    def transmit(self, apdu):
+        if self.tap is None: raise AttributeError  # Treated as a lost connection by the reader modules
+        for observer in self.observers:
+            observer.update(self, CardConnectionEvent('command', [apdu, None]))
+        exchange = self.tap.take(apdu)
+        if exchange is None:
+            if self.pcsc_reader.is_feedback(apdu):
+                self.pcsc_reader.logger.debug("Feedback not in the trace, answering 90 00: " + toHexString(apdu))
+                return [], 0x90, 0x00
+            message = "Command not in the trace: " + toHexString(_redact(apdu))
+            self.pcsc_reader.logger.warn(message)
+            raise CardConnectionException(message)
+        response, seconds = exchange
+        if self.pcsc_reader.realtime: time.sleep(seconds)
+        if response == "!CardConnectionException": raise CardConnectionException("Replayed transmit failure")
+        if response.startswith("!"): raise AttributeError  # Connection lost
+        response = toBytes(response)
+        return response[:-2], response[-2], response[-1]
+
+
+class ReplayPcscReader:
+    """Stands in for the pyscard reader a trace was recorded from"""
+
+    def __init__(self, name, spec, realtime=False):
+        self.name = name
+        self.realtime = realtime  # Reproduce the recorded round trip times and gaps between taps
+        self.card = None  # RecordedTap on the reader
+        self.feedback = [spec.commands[command][1] for command in FEEDBACK_COMMANDS if command in spec.commands]
+        self.logger = logging.getLogger('hidemu')
+
+    def createConnection(self):
+        return ReplayConnection(self)
+
+    def is_feedback(self, apdu):
+        """True if apdu is one of the model's LED or buzzer commands"""
+        return any(apdu[:len(command)] == command for command in self.feedback)
+
+
+class TraceDetection:
+    """Card detection which presents a reader's recorded taps in turn, each removed once the worker comes back"""
+
+    def __init__(self, taps):
+        self.taps = collections.deque(taps)
+        self.offset = None  # Recorded time minus replay time of the first tap, with realtime
+        self.changed = threading.Condition()
+
+    def exists(self):
+        return bool(self.taps) or self.reader.card is not None
+
+    def wait_for_event(self, timeout=1):
+        with self.changed:
+            event = self._take_event()
+            if event is None and self.taps:
+                self.changed.wait(min(timeout, max(0, self._due() - time.time())))
+                event = self._take_event()
+            return event
+
+    def cancel_wait(self):
+        with self.changed:
+            self.changed.notify_all()
+
+    def close(self):
+        pass
+
+    def _due(self):
+        """time.time() the next tap should be presented at"""
+        if not self.reader.realtime or self.offset is None: return 0
+        return self.taps[0].at - self.offset
+
+    def _take_event(self):
+        if self.reader.card is not None:  # The worker is waiting again, so it's done with the card
+            self.reader.card = None
+            if not self.taps: self.logger.info("End of trace for " + self.name)
+            return cardwatch.CARD_REMOVED
+        if not self.taps or time.time() < self._due():
+            return None
+        self.reader.card = self.taps.popleft()
+        if self.offset is None: self.offset = self.reader.card.at - time.time()
+        return cardwatch.CARD_ARRIVED
+
+
+def load(path):
+    """Returns {reader name: [RecordedTap]} from a trace file"""
+    taps = collections.OrderedDict()
+    with open(path) as trace_file:
+        for line in trace_file:
+            if line.strip():
+                record = json.loads(line)
+                taps.setdefault(record["reader"], []).append(RecordedTap(record))
+    return taps
+
+
+def readers(path, realtime=False):
+    """Returns a reader replaying each reader's taps from the trace file"""
+    replay_readers = []
+    for name, taps in load(path).items():
+        spec = find_spec(name) or ReaderSpec(name)
+        pcsc_reader = ReplayPcscReader(name, spec, realtime)
+        replay_readers.append(simulated.model_reader(spec, pcsc_reader, TraceDetection, taps))
+    return replay_readers
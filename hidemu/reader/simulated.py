@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# simulated.py - Simulated reader for benchmarking without hardware
+
+"""Simulated reader module
+
+Readers that need neither a PC/SC service nor a physical device. A SimulatedPcscReader stands in for the pyscard
+reader a reader module drives: it holds the card and the loaded keys, and answers every APDU the way the model its
+spec describes would (after an optional artificial latency). create() wraps any spec's own Reader class around one,
+so the code under test is the real reader module with only card detection replaced.
+
+Cards are placed on and removed from the reader by calling present() and remove(). VirtualCards model the card types
+classifier.CARD_NAME_SUPPORT recognises: their ATR, memory and Mifare Classic sector keys.
+
+"""
+
+import time
+import operator
+import threading
+from smartcard.CardConnectionEvent import CardConnectionEvent
+from smartcard.Exceptions import NoCardException
+from base import ReaderBase, PCSC_TAG_RESPONSE
+import cardwatch
+import classifier
+from exceptions import FailedException
+from specs import ReaderSpec
+
+SPEC = ReaderSpec("Simulated Reader")  # The plain PC/SC Part 3 commands
+
+# Card kind: (PC/SC Part 3 standard, card name, memory bytes, block bytes), see classifier.CARD_NAME_SUPPORT
+CARD_KINDS = {
+    "MFC1K": (0x03, 0x0001, 1024, 16),
+    "MFC4K": (0x03, 0x0002, 4096, 16),
+    "MFU":   (0x03, 0x0003, 64, 4),
+    "ICD":   (0x0B, 0x0014, 112, 4),
+}
+
+SECTOR_KINDS = ("MFC1K", "MFC4K")  # Kinds with sector keys, the others acknowledge authentication unchecked
+
+DEFAULT_KEY = [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
+
+
+def storage_card_atr(standard, card_name):
+    """Returns the ATR a contactless reader builds for a storage card (PC/SC Part 3)"""
+    historical = [0x80, 0x4F, 0x0C] + classifier.PCSC_RID + [standard, card_name >> 8, card_name & 0xFF,
+                                                             0x00, 0x00, 0x00, 0x00]
+    atr = [0x3B, 0x80 | len(historical), 0x80, 0x01] + historical
+    return atr + [reduce(operator.xor, atr[1:])]  # TCK
+
+
+ATR_MFC_1K = storage_card_atr(0x03, 0x0001)
+
+
+class VirtualCard:
+    """A card which can be placed on a simulated reader"""
+
+    def __init__(self, uid=None, atr=None, memory=None, kind="MFC1K", sector_keys=None, fast_read=True):
+        """memory is the card contents as a byte list, counting bytes by default
+
+        sector_keys is {sector: (key A, key B)} as byte lists, sectors not listed use the default FF key.
+        fast_read is whether an Ultralight ("MFU") has FAST_READ (NTAG, EV1) or not (the original MF0ICU1)."""
+        standard, card_name, size, self.block_size = CARD_KINDS[kind]
+        if uid is None: uid = [0x04, 0xA1, 0xB2, 0xC3]
+        if atr is None: atr = storage_card_atr(standard, card_name)
+        if memory is None: memory = [i & 0xFF for i in range(size)]
+        self.uid = uid
+        self.atr = atr
+        self.kind = kind
+        self.memory = memory
+        self.sector_keys = sector_keys or {}
+        self.fast_read = fast_read
+        self.halted = False  # An Ultralight halts on rejecting a command, until it's activated again
+        self.released = threading.Event()  # Set when a connection to the card is disconnected
+
+    def key(self, sector, key_type):
+        """Returns the sector's key A (key_type 0x60) or B (0x61)"""
+        return self.sector_keys.get(sector, (DEFAULT_KEY, DEFAULT_KEY))[key_type & 0x01]
+
+    def read(self, block, length):
+        """Returns length bytes from block onwards, None past the end of memory"""
+        start = block * self.block_size
+        if start + length > len(self.memory): return None
+        return self.memory[start:start + length]
+
+
+class SimulatedConnection:
+    """Stands in for a pyscard CardConnection"""
+
+    def __init__(self, pcsc_reader):
+        self.pcsc_reader = pcsc_reader
+        self.card = None
+        self.authenticated = None  # Mifare Classic sector authenticated
+        self.apdu_count = 0
+        self.first_apdu = threading.Event()  # Set as soon as the first APDU reaches the card
+        self.first_apdu_time = None
+        self.observers = []
+
+    def addObserver(self, observer):
+        self.observers.append(observer)
+
+    def connect(self):
+        self.card = self.pcsc_reader.card
+        if self.card is None: raise NoCardException("No card on " + self.pcsc_reader.name)
+        self.card.halted = False  # The reader activated it on arrival
+
+    def disconnect(self):
+        if self.card is not None:
+            self.card.released.set()
+        self.card = None
+
+    def getATR(self):
+        return list(self.card.atr)
+
+    def transmit(self, apdu):
+        if self.card is None: raise AttributeError  # Treated as a lost connection by the reader modules
+        if self.first_apdu_time is None:
+            self.first_apdu_time = time.time()
+            self.first_apdu.set()
+        self.apdu_count += 1
+        for observer in self.observers:
+            observer.update(self, CardConnectionEvent('command', [apdu, None]))
+        if self.pcsc_reader.apdu_latency: time.sleep(self.pcsc_reader.apdu_latency)
+        return self.pcsc_reader.respond(self, apdu)
+
+
+class SimulatedPcscReader:
+    """Stands in for a pyscard reader of the model spec describes"""
+
+    def __init__(self, name, spec=SPEC, apdu_latency=0.0):
+        self.name = name
+        self.spec = spec
+        self.apdu_latency = apdu_latency  # Seconds added to every APDU
+        self.card = None
+        self.key_slots = {0: DEFAULT_KEY, 1: DEFAULT_KEY}  # Reader keys loaded by the load key commands
+        self.connection = None  # Most recent SimulatedConnection
+        # The status word the model reports a failed command with, 63 00 unless the spec says otherwise
+        failures = sorted(sw for sw, error in spec.status_words.items() if error is FailedException)
+        self.failure = (0x63, 0x00) if (0x63, 0x00) in failures else failures[0]
+        self.leds = "output_control" in spec.commands  # ACR122 LEDs, SW2 returns the LED state
+        self.pn532 = "direct" in spec.commands         # ACR122 direct transmit to the PN532
+
+    def createConnection(self):
+        self.connection = SimulatedConnection(self)
+        return self.connection
+
+    def respond(self, connection, apdu):
+        """Returns: (data, sw1, sw2)"""
+        card = connection.card
+        command = apdu[:2]
+        if command == [0xFF, 0xCA]:
+            return list(card.uid), 0x90, 0x00
+        if command == [0xFF, 0x82]:
+            self.key_slots[apdu[3] & 0x01] = apdu[5:11]
+            return [], 0x90, 0x00
+        if command == [0xFF, 0x86]:
+            block, key_type, slot = apdu[7:10]
+            connection.authenticated = None
+            sector = ReaderBase.sector_of(block)
+            if card.kind in SECTOR_KINDS and card.key(sector, key_type) != self.key_slots[slot]:
+                return ([],) + self.failure
+            connection.authenticated = sector
+            return [], 0x90, 0x00
+        if command == [0xFF, 0xB0]:
+            data = None if card.halted else card.read(apdu[3], apdu[4])
+            if card.kind in SECTOR_KINDS and connection.authenticated != ReaderBase.sector_of(apdu[3]): data = None
+            if data is None: return ([],) + self.failure
+            return data, 0x90, 0x00
+        if command == [0xFF, 0xC2]:
+            return self._transparent_session(card, apdu)
+        if apdu[:3] == [0xFF, 0x00, 0x40] and self.leds:
+            return [], 0x90, apdu[3]
+        if apdu[:4] == [0xFF, 0x00, 0x00, 0x00] and self.pn532:
+            return self._pn532(card, apdu[5:]), 0x90, 0x00
+        return [], 0x6A, 0x81
+
+    def _transparent_session(self, card, apdu):
+        status = [0xC0, 0x03, 0x00, 0x90, 0x00]  # Generic error status data object: no error
+        if apdu[3] == 0x00:  # Start or end session
+            return status, 0x90, 0x00
+        frame = apdu[7:7 + apdu[6]]
+        data = None
+        if card.kind == "ICD" and frame[1:2] == [0x23]:  # Read Multiple Blocks
+            data = card.read(frame[2], (frame[3] + 1) * card.block_size)
+        response = [0x01, 0x0F] if data is None else [0x00] + data  # Flags (error flag, error code) then the blocks
+        length = [0x81, len(response)] if len(response) > 0x7F else [len(response)]
+        return status + [PCSC_TAG_RESPONSE] + length + response, 0x90, 0x00
+
+    @staticmethod
+    def _pn532(card, pn532_command):
+        """InListPassiveTarget, and InDataExchange with an Ultralight: READ and FAST_READ"""
+        if pn532_command[:4] == [0xD4, 0x4A, 0x01, 0x00]:
+            card.halted = False
+            return [0xD5, 0x4B, 0x01, 0x01, 0x00, 0x44, 0x00, len(card.uid)] + card.uid
+        card_command = pn532_command[3:]
+        data = None
+        if card.kind == "MFU" and pn532_command[:3] == [0xD4, 0x40, 0x01] and not card.halted:
+            if card_command[0] == 0x30:
+                data = card.read(card_command[1], 16)
+            elif card_command[0] == 0x3A and card.fast_read:
+                data = card.read(card_command[1], (card_command[2] - card_command[1] + 1) * card.block_size)
+            card.halted = data is None  # NAK
+        if data is None: return [0xD5, 0x41, 0x01]  # Timeout, the card didn't answer
+        return [0xD5, 0x41, 0x00] + data
+
+
+class CardDetection:
+    """Card detection for a reader driving a SimulatedPcscReader, replaces the PC/SC card watcher
+
+    poll_interval models the old CardRequest behaviour (wake up every poll_interval seconds and check for a card),
+    leave it as None for event driven detection."""
+
+    def __init__(self, poll_interval=None):
+        self.poll_interval = poll_interval
+        self.attached = True        # Cleared by unplug()
+        self.card_reported = None   # Card on the reader as last reported by wait_for_event
+        self.checks = 0             # Times the reader has been checked for a card, what polling costs
+        self.changed = threading.Condition()
+
+    def present(self, card):
+        """Place a card on the reader (replacing any card already there)"""
+        with self.changed:
+            self.reader.card = card
+            self.changed.notify_all()
+
+    def remove(self):
+        """Take the card off the reader"""
+        with self.changed:
+            self.reader.card = None
+            self.changed.notify_all()
+
+    def unplug(self):
+        """Simulate unplugging the reader"""
+        with self.changed:
+            self.attached = False
+            self.changed.notify_all()
+
+    def exists(self):
+        return self.attached
+
+    def wait_for_event(self, timeout=1):
+        if self.poll_interval is not None:
+            return self._poll_for_event(timeout)
+        with self.changed:
+            if self.reader.card is self.card_reported and self.attached:
+                # Untimed like SCardGetStatusChange, every change notifies. Python 2 would poll a timed wait.
+                self.changed.wait()
+            return self._take_event()
+
+    def cancel_wait(self):
+        with self.changed:
+            self.changed.notify_all()
+
+    def close(self):
+        pass
+
+    def _poll_for_event(self, timeout):
+        deadline = time.time() + timeout
+        while True:
+            with self.changed:
+                event = self._take_event()
+            if event is not None or time.time() >= deadline:
+                return event
+            time.sleep(self.poll_interval)
+
+    def _take_event(self):
+        """Returns the event (if any) since the card on the reader was last reported
+
+        Swapping one card for another is reported as an arrival."""
+        self.checks += 1
+        card = self.reader.card
+        if card is self.card_reported:
+            return None
+        self.card_reported = card
+        if card is not None:
+            return cardwatch.CARD_ARRIVED
+        return cardwatch.CARD_REMOVED
+
+
+class Reader(CardDetection, ReaderBase):
+    """Simulated reader class, speaking the plain PC/SC Part 3 commands"""
+
+    def __init__(self, name="Simulated Reader 0", apdu_latency=0.0, poll_interval=None):
+        ReaderBase.__init__(self, SimulatedPcscReader(name, SPEC, apdu_latency), SPEC)
+        CardDetection.__init__(self, poll_interval)
+
+
+def model_reader(spec, pcsc_reader, detection_class, *detection_args):
+    """Returns the model's own Reader class driving pcsc_reader, with card detection from detection_class"""
+    reader_class = spec.reader_class()
+
+    class ModelReader(detection_class, reader_class):
+        def __init__(self):
+            reader_class.__init__(self, pcsc_reader, spec)
+            detection_class.__init__(self, *detection_args)
+
+    return ModelReader()
+
+
+def create(spec, name=None, apdu_latency=0.0, poll_interval=None):
+    """Returns a simulated reader of the model spec describes, driven by the model's own Reader class"""
+    return model_reader(spec, SimulatedPcscReader(name or spec.prefix + " (Simulated) 0", spec, apdu_latency),
+                        CardDetection, poll_interval)
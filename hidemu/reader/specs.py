@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# Copyright (c) 2017 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# specs.py - Reader model specifications
+#
+# SUPPORT FOR ADDITIONAL READERS MAY BE ADDED IN VIA THE SPECS LIST HERE!
+#
+
+"""ReaderSpec class and the specs of the supported reader models
+
+A spec holds everything ReaderBase needs to drive a model: the name prefix it is detected by, the command byte
+templates (the PC/SC Part 3 pseudo-APDUs unless the model differs) and which exception each status word other than
+90 00 raises. Models which need behaviour of their own (e.g. LEDs) name a module whose Reader class extends ReaderBase.
+
+"""
+
+from exceptions import FailedException, NotSupportedException
+
+# Typical command format: [class, ins, p1, p2, lc] + data byte list
+# name: (description for error handling, command byte template)
+PCSC_COMMANDS = {
+    "get_data":      ("Fetch UID",     [0xFF, 0xCA, 0x00, 0x00, 0x00]),
+    "load_key_0":    ("Load Key 0",    [0xFF, 0x82, 0x00, 0x00, 0x06]),  # + key byte list
+    "load_key_1":    ("Load Key 1",    [0xFF, 0x82, 0x00, 0x01, 0x06]),  # + key byte list
+    "mfc_auth":      ("Sector Auth",   [0xFF, 0x86, 0x00, 0x00, 0x05, 0x01, 0x00]),  # + [block, key type A/B, key num]
+    "read_block":    ("Read Block",    [0xFF, 0xB0, 0x00]),  # + [block num, length]
+    # Transparent session, for sending card commands the reader has no pseudo-APDU for
+    "start_session": ("Start Session", [0xFF, 0xC2, 0x00, 0x00, 0x02, 0x81, 0x00]),
+    "end_session":   ("End Session",   [0xFF, 0xC2, 0x00, 0x00, 0x02, 0x82, 0x00]),
+    "transceive":    ("Transceive",    [0xFF, 0xC2, 0x00, 0x01]),  # + [lc, 0x95, frame length] + frame
+}
+
+# (SW1, SW2): exception raised, anything else but 90 00 raises UnexpectedErrorCodeException
+PCSC_STATUS_WORDS = {
+    (0x63, 0x00): FailedException,
+    (0x6A, 0x81): NotSupportedException,
+}
+
+
+class ReaderSpec:
+    """Description of a reader model"""
+
+    def __init__(self, prefix, commands=None, status_words=None, sw1_status=None, module=None):
+        """commands and status_words are added to (or replace entries of) PCSC_COMMANDS and PCSC_STATUS_WORDS
+
+        sw1_status maps SW1 alone to an exception, for status words not listed in full"""
+        self.prefix = prefix
+        self.commands = dict(PCSC_COMMANDS)
+        self.commands.update(commands or {})
+        self.status_words = dict(PCSC_STATUS_WORDS)
+        self.status_words.update(status_words or {})
+        self.sw1_status = sw1_status or {}
+        self.module = module  # Name of the module with the model's Reader class, None for plain ReaderBase
+
+    def reader_class(self):
+        """Returns the class which drives this model"""
+        if self.module is None:
+            from base import ReaderBase
+            return ReaderBase
+        return __import__(self.module, globals(), locals(), ["Reader"]).Reader
+
+
+ACR122 = ReaderSpec(
+    "ACS ACR122",
+    commands={
+        "output_control": ("Output Ctl.", [0xFF, 0x00, 0x40]),  # + [LED state, lc, T1, T2, repetitions, buzzer]
+        "direct": ("Direct Transmit", [0xFF, 0x00, 0x00, 0x00]),  # + [lc] + PN532 command byte list
+    },
+    module="acr122")
+
+OMNIKEY_5X21_CL = ReaderSpec(
+    "OMNIKEY CardMan 5x21-CL",
+    commands={
+        "load_key_0": ("Load Key 0", [0xFF, 0x82, 0x20, 0x00, 0x06]),
+        "load_key_1": ("Load Key 1", [0xFF, 0x82, 0x20, 0x01, 0x06]),
+    },
+    status_words={
+        (0x63, 0x00): None,                    # Not an error code the Omnikey uses
+        (0x64, 0x00): FailedException,         # Card execution error
+        (0x67, 0x00): NotSupportedException,   # Wrong length
+        (0x68, 0x00): NotSupportedException,   # Invalid class (CLA) byte
+        (0x69, 0x81): FailedException,         # Command incompatible
+        (0x69, 0x82): FailedException,         # Security status not satisfied
+        (0x69, 0x86): FailedException,         # Command not allowed
+        (0x6A, 0x81): NotSupportedException,   # Invalid instruction (INS) byte
+        (0x6A, 0x82): FailedException,         # File not found / Addressed block or byte does not exist
+    },
+    sw1_status={
+        0x6C: NotSupportedException,  # Wrong length
+    })
+
+SDI011 = ReaderSpec(
+    "SCM Microsystems Inc. SDI011",
+    commands={
+        "load_key_0": ("Load Key 0", [0xFF, 0x82, 0x00, 0x60, 0x06]),
+        "load_key_1": ("Load Key 1", [0xFF, 0x82, 0x00, 0x61, 0x06]),
+    })
+
+SPECS = [
+    ACR122,
+    OMNIKEY_5X21_CL,
+    SDI011,
+    # ReaderSpec("MY READER"),
+]
+
+
+def find_spec(name):
+    """Returns the spec of the named reader, or None if unsupported"""
+    for spec in SPECS:
+        if name.startswith(spec.prefix):
+            return spec
+    return None
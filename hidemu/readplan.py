@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# readplan.py - data definition read planner
+#
+
+"""Read plans
+
+A data definition (see --data-definition in main.py) describes up to eight fields, each cut from one card block read
+with key A and/or B. Compiled into a ReadPlan it reads every block those fields use exactly once, as long as the
+longest field needs, with the reads ordered by sector so each sector is authenticated once per tap. Should a read fail
+its fields are read separately (see HIDEmu._read_fields_separately), one bad field only loses itself.
+
+"""
+
+from reader.base import ReaderBase
+
+MAX_FIELDS = 8  # Fields beyond {DATA7} are ignored
+
+
+class Field:
+    """One data definition entry: where its value sits in the block read and how to present it"""
+
+    def __init__(self, index, offset, length, data_type):
+        self.index = index  # Position in the data list ({DATA<index>})
+        self.offset = offset
+        self.length = length
+        self.type = data_type
+
+
+class Read:
+    """One block read serving one or more fields"""
+
+    def __init__(self, block, key_a, key_b):
+        self.block = block
+        self.key_a = key_a
+        self.key_b = key_b
+        self.length = 0
+        self.fields = []
+
+    def add(self, field):
+        self.fields.append(field)
+        self.length = max(self.length, field.offset + field.length)
+
+
+class ReadPlan:
+    """The reads needed for a data definition, in the order to issue them"""
+
+    def __init__(self, data_definition, needed=None):
+        """needed is the collection of field indexes worth reading, None for all of them"""
+        self.reads = []
+        self.sector_keys = {}  # Sector: (key A, key B) of the first read from it, see cardimage.read
+        if data_definition is None:
+            return
+        if type(data_definition) == dict:
+            data_definition = [data_definition]
+        reads = {}  # (block, key A, key B): Read
+        for i in range(0, min(len(data_definition), MAX_FIELDS)):
+            if needed is not None and i not in needed:
+                continue
+            data_spec = data_definition[i]
+            block = data_spec.get("block", 0)
+            key_a = data_spec.get("keyA", None)
+            key_b = data_spec.get("keyB", None)
+            field = Field(i, data_spec.get("offset", 0), data_spec.get("length", 1), data_spec.get("type", "hex"))
+            if (block, key_a, key_b) not in reads:
+                reads[(block, key_a, key_b)] = Read(block, key_a, key_b)
+            reads[(block, key_a, key_b)].add(field)
+        # Keep reads in the same sector with the same keys together, the reader skips authenticating again
+        self.reads = sorted(reads.values(),
+                            key=lambda read: (ReaderBase.sector_of(read.block), read.key_a, read.key_b, read.block))
+        for read in self.reads:
+            self.sector_keys.setdefault(ReaderBase.sector_of(read.block), (read.key_a, read.key_b))
+
+
+def compile(data_definition, needed=None):
+    """Returns a ReadPlan for data_definition"""
+    return ReadPlan(data_definition, needed)
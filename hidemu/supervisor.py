@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# supervisor.py - process-per-reader supervision
+#
+# A pyscard transmit or waitforcard call can hang inside the driver. Running each reader in a child process lets the
+# parent kill and restart a wedged reader while the others keep serving.
+#
+
+"""Reader supervisor
+
+Each reader is served by HIDEmu._serve_reader in its own child process. The child sends card events and heartbeats
+to the parent over a pipe, the parent outputs them and restarts any child which has made no progress within the
+watchdog time budget. The child has an output queue of its own, as bounded as the parent's, and the parent holds
+at most that many cards read from the pipe: with the "block" queue policy the parent stops reading the pipe while
+its output queue is backed up, so the child's queue fills and it holds the card like an unsupervised worker would.
+Heartbeats also carry what the child recorded in its metrics since the last one, the parent
+merges it into its own so --metrics covers every reader.
+
+"""
+
+import os
+import time
+import Queue
+import signal
+import logging
+import threading
+import collections
+import multiprocessing
+from smartcard.Exceptions import CardConnectionException
+
+import metrics
+from reader import autodetect
+from reader.registry import registry
+from reader.exceptions import ReaderNotFoundException
+
+HEARTBEAT_INTERVAL = 1.0  # Seconds between heartbeats from a child
+
+RESTARTS = metrics.counter("supervisor_restarts_total", "Reader processes restarted by the watchdog")
+DROPPED_TAPS = metrics.counter("supervisor_dropped_taps_total", "Cards lost because their reader process was restarted")
+RECOVERY_SECONDS = metrics.counter("supervisor_recovery_seconds_total",
+                                   "Time from killing a wedged reader process until its replacement was serving")
+
+
+class Progress:
+    """Child side record of the reader loop, see HIDEmu._serve_reader"""
+
+    def __init__(self):
+        self.time = time.time()
+        self.busy = False  # True while a card is being processed
+
+    def __call__(self, busy):
+        self.time = time.time()
+        self.busy = busy
+
+
+def _child_main(hid_emu, reader_name, pipe):
+    """Child process entry point: serve one reader and report to the parent"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # The parent decides when to stop
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    send_lock = threading.Lock()
+    progress = Progress()
+
+    def send(message):
+        with send_lock:
+            pipe.send(message)
+
+    def report():
+        send(("heartbeat", progress.time, progress.busy, metrics.take()))
+
+    def heartbeat():
+        while hid_emu.running:
+            report()
+            time.sleep(HEARTBEAT_INTERVAL)
+
+    def forward_output():
+        while hid_emu.running:
+            send(("card", hid_emu.output_queue.get()))
+
+    metrics.after_fork()  # Values inherited from the parent are already counted there
+    registry.after_fork()
+    registry.start()
+    hid_emu.output_queue = Queue.Queue(hid_emu.queue_size)  # Never share queue locks with the parent
+    hid_emu.running = True
+    for target in (heartbeat, forward_output):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+    try:
+        reader = autodetect.find_reader(reader_name)
+        hid_emu._prepare_reader(reader)
+    except (ReaderNotFoundException, CardConnectionException):
+        # Restarted while the reader is unplugged (the usual reason for a wedged child), wait for it heartbeating
+        reader = hid_emu._reacquire(reader_name, progress)
+    if reader is not None:
+        hid_emu._serve_reader(reader, progress)
+    if hid_emu.worker_failure is not None:
+        raise hid_emu.worker_failure[0], hid_emu.worker_failure[1], hid_emu.worker_failure[2]
+    report()
+    send(("stopped", reader_name))
+
+
+class ReaderProcess:
+    """Parent side of one supervised reader
+
+    run() is the body of a thread in the parent, it relays output to HIDEmu.output_queue and acts as the watchdog.
+    Cards wait in self.pending while the output queue is full, so heartbeats are still read and checked. pending
+    holds at most queue_size cards, the queue policy applies to it as it does to the output queue."""
+
+    def __init__(self, hid_emu, reader_name, budget):
+        self.hid_emu = hid_emu
+        self.reader_name = reader_name
+        self.budget = budget
+        self.logger = logging.getLogger('hidemu')
+        self.process = None
+        self.pipe = None
+        self.progress = 0        # Last progress time reported by the child
+        self.busy = False        # Child was processing a card as of the last heartbeat
+        self.killed_at = None    # Time the last wedged child was killed, until its replacement reports progress
+        self.pending = collections.deque()  # Cards from the child not yet on the output queue
+        self.resumed = 0         # Last time reading the pipe was held up by a backed up output queue
+        self.gauges = {}         # The current child's share of the gauges, see metrics.merge()
+
+    def start(self):
+        self.pipe, child_pipe = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(target=_child_main, args=(self.hid_emu, self.reader_name, child_pipe),
+                                               name=self.reader_name)
+        self.process.daemon = True
+        self.process.start()
+        child_pipe.close()
+        self.progress = time.time()
+        self.busy = False
+
+    def stop(self):
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            self.process.join(1)
+            if self.process.is_alive() and hasattr(signal, 'SIGKILL'):
+                os.kill(self.process.pid, signal.SIGKILL)  # Stuck in the driver, SIGTERM is never serviced
+            self.process.join()
+        metrics.withdraw(self.gauges)
+
+    def run(self):
+        self.start()
+        try:
+            while self.hid_emu.running:
+                self._relay()
+                wait = 0 if self.pending else HEARTBEAT_INTERVAL / 2
+                # Drained every time round (a child blocked sending can't heartbeat) unless holding up the child
+                while not self._holding() and self.pipe.poll(wait):
+                    wait = 0
+                    try:
+                        message = self.pipe.recv()
+                    except EOFError:
+                        message = ("stopped", self.reader_name)
+                    if not self._handle(message):
+                        while self.pending and self.hid_emu.running:
+                            self._relay()
+                        return
+                if self._holding():
+                    self.resumed = time.time()  # The child waiting on us is no sign of it being wedged
+                idle = time.time() - max(self.progress, self.resumed)
+                if idle > self.budget:
+                    self._restart("no progress for {0:.1f}s".format(idle))
+                elif not self.process.is_alive():
+                    self._restart("exit code {0}".format(self.process.exitcode))
+        finally:
+            self.stop()
+            while self.pending:  # Queued if there's room, otherwise counted as dropped
+                self.hid_emu._enqueue(self.pending.popleft())
+
+    def _holding(self):
+        """True while the child is left waiting to send: "block" queue policy and pending is full"""
+        return self.hid_emu.queue_policy == "block" and len(self.pending) >= self.hid_emu.queue_size
+
+    def _pend(self, card_event):
+        """Hold a card for the output queue, when pending is full the queue policy decides which card is lost"""
+        if len(self.pending) >= self.hid_emu.queue_size and self.hid_emu.queue_policy != "block":
+            if self.hid_emu.queue_policy == "drop-oldest":
+                self.hid_emu._drop(self.pending.popleft())
+            else:
+                self.hid_emu._drop(card_event)
+                return
+        self.pending.append(card_event)
+
+    def _relay(self):
+        """Move pending cards to the output queue, waiting at most HEARTBEAT_INTERVAL / 2 for room"""
+        while self.pending and self.hid_emu._enqueue(self.pending[0], HEARTBEAT_INTERVAL / 2):
+            self.pending.popleft()
+
+    def _handle(self, message):
+        """Returns False once the child has stopped for good"""
+        kind = message[0]
+        if kind == "heartbeat":
+            self.progress, self.busy = message[1], message[2]
+            metrics.merge(message[3], self.gauges)
+            if self.killed_at is not None and self.progress > self.killed_at:
+                RECOVERY_SECONDS.inc(time.time() - self.killed_at)
+                self.logger.info("Reader process recovered: " + self.reader_name)
+                self.killed_at = None
+        elif kind == "card":
+            self._pend(message[1])
+        elif kind == "stopped":
+            self.process.join()
+            if self.process.exitcode:
+                self._restart("exit code {0}".format(self.process.exitcode))
+                return True
+            return False
+        return True
+
+    def _restart(self, reason):
+        self.logger.error("Restarting reader process for " + self.reader_name + ": " + reason)
+        if self.busy:
+            DROPPED_TAPS.inc()
+        self.stop()
+        RESTARTS.inc()
+        if self.killed_at is None:
+            self.killed_at = time.time()
+        self.start()
+
+
+def start(hid_emu, readers, budget):
+    """Start a supervised child process per reader, returns the parent threads (see HIDEmu._run_output_stage)"""
+    threads = []
+    for reader in readers:
+        reader.close()  # The child opens its own PC/SC context
+        supervised = ReaderProcess(hid_emu, reader.name, budget)
+        thread = threading.Thread(target=supervised.run, name=reader.name)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    return threads
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# template.py - output template compiler
+#
+
+"""Output templates
+
+Templates use str.format syntax with the substitution fields listed in FIELDS. A template is parsed once, checking its
+fields and recording which it references, so that rendering a card only needs the values of those fields.
+
+"""
+
+import string
+
+# Every substitution field available to output templates (see the --track1 help in main.py)
+FIELDS = ("UIDLEN", "TYPE", "SUBTYPE", "UIDINT", "UID", "CR", "DATA",
+          "DATA0", "DATA1", "DATA2", "DATA3", "DATA4", "DATA5", "DATA6", "DATA7")
+
+
+class Template:
+    """A compiled output template"""
+
+    def __init__(self, text):
+        """Raises ValueError for malformed templates and unknown fields"""
+        self.text = text
+        self.fields = set()  # Names of the fields referenced
+        for literal, field, format_spec, conversion in string.Formatter().parse(text):
+            if field is None:
+                continue
+            if field not in FIELDS:
+                raise ValueError("Unknown substitution field: " + field)
+            if "{" in format_spec:
+                raise ValueError("Nested substitution fields are not supported: " + field)
+            self.fields.add(field)
+
+    def render(self, values):
+        """Returns the output string, values maps (at least) each referenced field to its value
+
+        Once parsing has checked every field is known, the template is a plain str.format string: formatting in C
+        beats joining segments in Python, so only the field values are left to compute per card."""
+        return self.text.format(**values)
+
+
+def compile(text):
+    """Returns a Template for text"""
+    return Template(text)
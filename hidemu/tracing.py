@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# tracing.py - per tap stage timing
+#
+
+"""Tap traces
+
+Each card carries a TapTrace from the moment its arrival is detected to its last keystroke. The trace is marked as
+each stage of processing ends and, once finished, every stage's duration is added to the tap_stage_seconds quantiles
+(p50/p95/p99 of recent taps per stage, in the metrics and the final stats). A sample of the traces is also logged as
+one compact line each, for following individual slow taps.
+
+Times come from time.time(), which is also what crosses the supervisor's process boundary with the card.
+
+"""
+
+import time
+import random
+import metrics
+
+# Stages in the order they end, each measured from the end of the previous one (the first from detection)
+STAGES = ("connect", "signal", "uid", "data", "render", "queue", "output")
+
+STAGE_SECONDS = metrics.quantiles("tap_stage_seconds", "Time spent in each stage of processing a tap, recent taps",
+                                  ["stage"])
+_STAGE_QUANTILES = dict((stage, STAGE_SECONDS.labels(stage)) for stage in STAGES + ("total",))
+
+
+class TapTrace:
+    """Timestamps of one tap"""
+
+    def __init__(self, detected):
+        self.detected = detected
+        self.marks = []  # (stage, time.time()) in the order the stages ended
+
+    def mark(self, stage):
+        self.marks.append((stage, time.time()))
+
+    def durations(self):
+        """Returns [(stage, seconds)] ending with the total"""
+        durations = []
+        previous = self.detected
+        for stage, at in self.marks:
+            durations.append((stage, at - previous))
+            previous = at
+        durations.append(("total", previous - self.detected))
+        return durations
+
+    def finish(self):
+        """Add the stage durations to the aggregates, returns them"""
+        durations = self.durations()
+        for stage, seconds in durations:
+            _STAGE_QUANTILES[stage].observe(seconds)
+        return durations
+
+
+def sampled(rate):
+    """Whether to log this tap's trace, rate is the fraction of taps logged"""
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def format_record(durations, card_type, apdus):
+    """Returns the compact one line form of a trace"""
+    return "type={0} apdus={1} ".format(card_type, apdus) + " ".join(
+        "{0}={1:.1f}ms".format(stage, 1000 * seconds) for stage, seconds in durations)
+
+
+def summary():
+    """p50/p95/p99 of each stage, for the log"""
+    parts = []
+    for stage in STAGES + ("total",):
+        quantiles = _STAGE_QUANTILES[stage]
+        if quantiles.count:
+            parts.append("{0} {1:.1f}/{2:.1f}/{3:.1f}ms".format(stage, *[1000 * quantiles.quantile(q)
+                                                                          for q in (0.5, 0.95, 0.99)]))
+    return ", ".join(parts)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# ttlcache.py - bounded cache with expiring entries
+#
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class TtlCache:
+    """Mapping whose entries expire ttl seconds after they were put, holding at most size entries
+
+    The least recently used entry is evicted to make room, so memory stays bounded however many keys are seen.
+    Safe to share between reader workers."""
+
+    def __init__(self, ttl, size, sizeof=None):
+        """sizeof(key, value), when given, returns the bytes an entry uses to keep a running total in self.bytes"""
+        self.ttl = ttl
+        self.size = size
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.entries = OrderedDict()  # Key: (expiry time.time(), value, bytes), most recently used last
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        """Without the lock, for handing to a supervised reader process"""
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the value put for key, default if there's none or it has expired"""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return default
+            if entry[0] <= time.time():
+                self.bytes -= entry[2]
+                return default
+            self.entries[key] = entry
+            return entry[1]
+
+    def put(self, key, value):
+        size = self.sizeof(key, value) if self.sizeof is not None else 0
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None: self.bytes -= entry[2]
+            self.entries[key] = (time.time() + self.ttl, value, size)
+            self.bytes += size
+            while len(self.entries) > self.size:
+                self.bytes -= self.entries.popitem(last=False)[1][2]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
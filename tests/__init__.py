@@ -0,0 +1,12 @@
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# Unit tests, run from the repository root with: python -m unittest discover -s tests -t .
+#
+# The hidemu modules import each other relative to the hidemu directory, as they do when main.py is run.
+#
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "hidemu"))
@@ -0,0 +1,69 @@
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# test_acr122.py - ACR122 Ultralight reads against a simulated reader
+#
+
+import logging
+import unittest
+
+from reader import simulated, specs
+from reader.exceptions import FailedException
+
+logging.getLogger('hidemu').addHandler(logging.NullHandler())
+
+MEMORY = range(64)  # 16 pages
+
+
+class UltralightReadTest(unittest.TestCase):
+
+    def connect(self, card):
+        self.card = card
+        self.reader = simulated.create(specs.ACR122)
+        self.reader.present(card)
+        self.connection = self.reader.connect()
+
+    def apdus(self):
+        return self.reader.reader.connection.apdu_count
+
+    def test_fast_read(self):
+        self.connect(simulated.VirtualCard(kind="MFU", memory=list(MEMORY)))
+        self.assertEqual(self.reader.read_block(self.connection, 4, 20, 0), MEMORY[16:36])
+        self.assertEqual(self.apdus(), 2)  # Authenticate (unchecked) and FAST_READ
+
+    def test_card_without_fast_read(self):
+        self.connect(simulated.VirtualCard(kind="MFU", memory=list(MEMORY), fast_read=False))
+        self.assertEqual(self.reader.read_block(self.connection, 4, 20, 0), MEMORY[16:36])
+        self.assertFalse(self.card.halted)
+        apdus = self.apdus()
+        self.assertEqual(self.reader.read_block(self.connection, 5, 8, 0), MEMORY[20:28])
+        self.assertEqual(self.apdus() - apdus, 1)  # Straight to READ for the rest of the tap
+
+    def test_fast_read_past_the_end(self):
+        self.connect(simulated.VirtualCard(kind="MFU", memory=list(MEMORY)))
+        self.assertEqual(self.reader.read_block(self.connection, 12, 8, 0), MEMORY[48:56])  # FAST_READ of 12 to 13
+        self.assertRaises(FailedException, self.reader.read_block, self.connection, 14, 12, 0)
+        self.assertFalse(self.card.halted)
+        self.assertEqual(self.reader.read_block(self.connection, 0, 4, 0), MEMORY[0:4])
+
+
+class SimulatedUltralightTest(unittest.TestCase):
+    """The simulated card halts on a NAK like a real one"""
+
+    def test_halts_until_activated(self):
+        card = simulated.VirtualCard(kind="MFU", fast_read=False)
+        reader = simulated.SimulatedPcscReader("Simulated", specs.ACR122)
+        reader.card = card
+        connection = reader.createConnection()
+        connection.connect()
+        fast_read = [0xFF, 0x00, 0x00, 0x00, 0x06, 0xD4, 0x40, 0x01, 0x3A, 0x00, 0x03]
+        read = [0xFF, 0x00, 0x00, 0x00, 0x05, 0xD4, 0x40, 0x01, 0x30, 0x00]
+        self.assertEqual(connection.transmit(fast_read), ([0xD5, 0x41, 0x01], 0x90, 0x00))
+        self.assertEqual(connection.transmit(read), ([0xD5, 0x41, 0x01], 0x90, 0x00))
+        self.assertEqual(connection.transmit([0xFF, 0xB0, 0x00, 0x00, 0x04])[1:], reader.failure)
+        connection.transmit([0xFF, 0x00, 0x00, 0x00, 0x04, 0xD4, 0x4A, 0x01, 0x00])
+        self.assertEqual(connection.transmit(read)[0][:3], [0xD5, 0x41, 0x00])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# test_cardimage.py - fields cut from a card memory image, and the image on repeat taps
+#
+
+import logging
+import unittest
+
+import cardimage
+from hidemu import HIDEmu
+from reader import simulated
+
+logging.getLogger('hidemu').addHandler(logging.NullHandler())
+
+
+class BytesToTypeTest(unittest.TestCase):
+    """A memoryview of the image converts as the same bytes in a list would"""
+
+    def setUp(self):
+        self.image = cardimage.CardImage(4, 16)
+        self.image.store(0, [0x41, 0x00, 0x7F, 0x0A] + range(0x80, 0xBC))
+
+    def check(self, offset, length):
+        view = self.image.view(0, offset, length)
+        byte_list = list(self.image.data[offset:offset + length])
+        for data_type in ("hex", "ascii", "int"):
+            self.assertEqual(HIDEmu.bytes_to_type(view, data_type), HIDEmu.bytes_to_type(byte_list, data_type),
+                             "{0} bytes as {1}".format(length, data_type))
+
+    def test_struct_lengths(self):
+        for length in (1, 2, 4, 8):
+            self.check(0, length)
+            self.check(3, length)
+
+    def test_other_lengths(self):
+        for length in (0, 3, 5, 16, 33):
+            self.check(0, length)
+
+    def test_ascii_keeps_printable(self):
+        self.assertEqual(HIDEmu.bytes_to_type(self.image.view(0, 0, 4), "ascii"), "A\n")
+
+
+class CachedImageTest(unittest.TestCase):
+
+    def test_image_on_repeat_tap(self):
+        hid_emu = HIDEmu(track1="{DATA0}", data_definition=[{"keyA": 0, "block": 4, "offset": 0, "length": 2}],
+                         memory_image=True, result_cache=60)
+        reader = simulated.Reader()
+        reader.present(simulated.VirtualCard())
+        uid = [0x04, 0x01, 0x02, 0x03]
+        data_list, image = hid_emu._card_data(reader, reader.connect(), uid)
+        self.assertIsNotNone(image)
+        cached_list, cached_image = hid_emu._card_data(reader, reader.connect(), uid)
+        self.assertEqual(reader.reader.connection.apdu_count, 0)  # From the cache
+        self.assertEqual((cached_list, cached_image), (data_list, image))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# test_classifier.py - card classification from ATR historical bytes
+#
+
+import unittest
+
+from reader import classifier
+
+
+def _atr(hex_string):
+    return [int(byte, 16) for byte in hex_string.split()]
+
+
+MFC_1K = _atr("3B 8F 80 01 80 4F 0C A0 00 00 03 06 03 00 01 00 00 00 00 6A")
+MFC_4K = _atr("3B 8F 80 01 80 4F 0C A0 00 00 03 06 03 00 02 00 00 00 00 69")
+ULTRALIGHT = _atr("3B 8F 80 01 80 4F 0C A0 00 00 03 06 03 00 03 00 00 00 00 68")
+ICODE_SLIX = _atr("3B 8F 80 01 80 4F 0C A0 00 00 03 06 0B 00 14 00 00 00 00 7B")
+ISO_15693 = _atr("3B 8F 80 01 80 4F 0C A0 00 00 03 06 0B 00 99 00 00 00 00 F6")
+MIFARE_PLUS = _atr("3B 87 80 01 C1 05 2F 2F 01 BC D6 A9")
+
+
+class HistoricalBytesTest(unittest.TestCase):
+
+    def test_after_interface_bytes(self):
+        self.assertEqual(classifier.historical_bytes(MFC_1K), MFC_1K[4:19])
+
+    def test_no_interface_bytes(self):
+        self.assertEqual(classifier.historical_bytes([0x3B, 0x02, 0x12, 0x34]), [0x12, 0x34])
+
+    def test_ta1_tb1_tc1(self):
+        self.assertEqual(classifier.historical_bytes([0x3B, 0x71, 0x11, 0x22, 0x33, 0x55]), [0x55])
+
+    def test_malformed(self):
+        self.assertEqual(classifier.historical_bytes([0x3B]), [])
+        self.assertEqual(classifier.historical_bytes([]), [])
+
+
+class ParseStorageCardTest(unittest.TestCase):
+
+    def test_standard_and_card_name(self):
+        self.assertEqual(classifier.parse_storage_card(MFC_1K), (0x03, 0x0001))
+        self.assertEqual(classifier.parse_storage_card(ICODE_SLIX), (0x0B, 0x0014))
+
+    def test_interface_byte_variants_match(self):
+        variant = [0x3B, 0x8F, 0x80, 0x81, 0x01] + MFC_1K[4:]  # TD2 announcing a TD3 as well
+        self.assertEqual(classifier.parse_storage_card(variant), (0x03, 0x0001))
+
+    def test_not_a_storage_card(self):
+        self.assertEqual(classifier.parse_storage_card(MIFARE_PLUS), None)
+
+    def test_other_rid(self):
+        other = MFC_1K[:7] + [0xA0, 0x00, 0x00, 0x00, 0x99] + MFC_1K[12:]
+        self.assertEqual(classifier.parse_storage_card(other), None)
+
+
+class ClassifyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.classifier = classifier.AtrClassifier(memo_size=2)
+
+    def type_of(self, atr):
+        return self.classifier.classify(atr)[1:3]
+
+    def test_card_names(self):
+        self.assertEqual(self.type_of(MFC_1K), ["MFC", "1K"])
+        self.assertEqual(self.type_of(MFC_4K), ["MFC", "4K"])
+        self.assertEqual(self.type_of(ULTRALIGHT), ["MFU", ""])
+        self.assertEqual(self.type_of(ICODE_SLIX), ["ICD", "SLIX"])
+
+    def test_unlisted_card_name_falls_back_to_standard(self):
+        self.assertEqual(self.classifier.classify(ISO_15693)[0], "ISO 15693")
+
+    def test_exact_match(self):
+        self.assertEqual(self.type_of(MIFARE_PLUS), ["MFP", ""])
+
+    def test_unknown(self):
+        self.assertEqual(self.classifier.classify([0x3B, 0x00]), classifier.DEFAULT_SUPPORT)
+
+    def test_memo_bounded(self):
+        for atr in (MFC_1K, MFC_4K, ULTRALIGHT, MFC_1K):
+            self.classifier.classify(atr)
+        self.assertEqual(len(self.classifier.memo), 2)
+
+    def test_overrides(self):
+        self.classifier.classify(MFC_1K)
+        self.classifier.set_overrides({"".join("%02X" % byte for byte in MFC_1K): ["Badge", "BDG", "", 0, 1]})
+        self.assertEqual(self.classifier.classify(MFC_1K), ["Badge", "BDG", "", False, True])
+        self.assertEqual(self.type_of(MFC_4K), ["MFC", "4K"])
+
+
+if __name__ == '__main__':
+    unittest.main()
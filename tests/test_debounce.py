@@ -0,0 +1,120 @@
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# test_debounce.py - repeat taps of a card within the debounce window, against a fake clock
+#
+
+import os
+import json
+import logging
+import tempfile
+import unittest
+
+import ttlcache
+from hidemu import HIDEmu, TAPS_SUPPRESSED
+from reader import simulated, replay
+
+logging.getLogger('hidemu').addHandler(logging.NullHandler())
+
+UID = [0x04, 0xA1, 0xB2, 0xC3, 0xD4, 0xE5, 0xF6]
+
+
+class Clock:
+    """Stands in for the time module in ttlcache, step seconds pass on every reading"""
+
+    def __init__(self, step=0):
+        self.now = 1000.0
+        self.step = step
+
+    def time(self):
+        self.now += self.step
+        return self.now
+
+
+class DebounceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        ttlcache.time, self.time = self.clock, ttlcache.time
+        self.hid_emu = HIDEmu(track1="{UID}", debounce=5)
+        self.hid_emu.running = True
+        self.reader = simulated.Reader()
+        self.reader.present(simulated.VirtualCard(uid=UID))
+
+    def tearDown(self):
+        ttlcache.time = self.time
+
+    def tap(self):
+        self.hid_emu._process_card(self.reader, self.reader.connect())
+
+    def test_repeat_tap(self):
+        self.assertFalse(self.hid_emu._repeat_tap(self.reader, UID))
+        self.clock.now += 4
+        self.assertTrue(self.hid_emu._repeat_tap(self.reader, UID))
+        self.assertFalse(self.hid_emu._repeat_tap(self.reader, UID[:4]))  # Another card
+
+    def test_each_tap_restarts_the_window(self):
+        self.hid_emu._repeat_tap(self.reader, UID)
+        for i in range(3):
+            self.clock.now += 4
+            self.assertTrue(self.hid_emu._repeat_tap(self.reader, UID))
+
+    def test_tap_after_expiry(self):
+        self.hid_emu._repeat_tap(self.reader, UID)
+        self.clock.now += 6
+        self.assertFalse(self.hid_emu._repeat_tap(self.reader, UID))
+
+    def test_second_tap_inside_the_window_suppressed(self):
+        suppressed = TAPS_SUPPRESSED.value
+        self.tap()
+        self.clock.now += 4
+        self.tap()
+        self.assertEqual(self.hid_emu.output_queue.qsize(), 1)
+        self.assertEqual(TAPS_SUPPRESSED.value - suppressed, 1)
+        self.assertEqual(self.reader.reader.connection.apdu_count, 1)  # The UID and nothing more
+
+    def test_tap_after_expiry_output(self):
+        suppressed = TAPS_SUPPRESSED.value
+        self.tap()
+        self.clock.now += 6
+        self.tap()
+        self.assertEqual(self.hid_emu.output_queue.qsize(), 2)
+        self.assertEqual(TAPS_SUPPRESSED.value, suppressed)
+
+
+class ReplayedDebounceTest(unittest.TestCase):
+    """The same card tapped twice in a replayed trace (--replay)"""
+
+    def setUp(self):
+        tap = {"reader": "ACS ACR122U PICC Interface 0", "at": 1500000000.0,
+               "atr": "3B8F8001804F0CA0000003060300030000000068",
+               "apdus": [["FF82000006000000000000", "9000", 0.01], ["FF82000106000000000000", "9000", 0.01],
+                         ["FFCA000000", "04A1B2C3D4E5F69000", 0.01]]}
+        handle, self.path = tempfile.mkstemp(suffix=".jsonl")
+        with os.fdopen(handle, "w") as trace_file:
+            trace_file.write(json.dumps(tap) + "\n")
+            trace_file.write(json.dumps(dict(tap, at=1500000001.0)) + "\n")
+        self.time = ttlcache.time
+
+    def tearDown(self):
+        ttlcache.time = self.time
+        os.remove(self.path)
+
+    def replay(self, clock):
+        ttlcache.time = clock
+        hid_emu = HIDEmu(track1="{UID}", debounce=5, replay_trace=self.path)
+        reader = replay.readers(self.path)[0]
+        hid_emu._prepare_reader(reader)
+        hid_emu.running = True
+        hid_emu._serve_reader(reader)
+        return hid_emu.output_queue.qsize()
+
+    def test_inside_the_window(self):
+        self.assertEqual(self.replay(Clock()), 1)
+
+    def test_after_expiry(self):
+        self.assertEqual(self.replay(Clock(step=10)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
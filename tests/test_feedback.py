@@ -0,0 +1,89 @@
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# test_feedback.py - coalescing and ordering of reader LED/buzzer signals
+#
+
+import logging
+import threading
+import unittest
+
+from reader import feedback, simulated, specs
+
+logging.getLogger('hidemu').addHandler(logging.NullHandler())
+
+BUSY, READY, ERROR = 0x0F, 0x0E, 0x50  # ACR122 LED states
+
+
+class Clock:
+    """Stands in for the time module in feedback"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class FeedbackTest(unittest.TestCase):
+    """An ACR122 whose _output_control records the LED states sent, in order with the card commands (UID fetches)"""
+
+    def setUp(self):
+        self.clock = Clock()
+        feedback.time, self.time = self.clock, feedback.time
+        self.sent = []
+        self.error_sent = threading.Event()
+        self.reader = simulated.create(specs.ACR122)
+        self.reader._output_control = self.output_control
+
+    def tearDown(self):
+        feedback.time = self.time
+
+    def output_control(self, connection, led_state, *args):
+        self.sent.append(led_state)
+        if led_state == ERROR: self.error_sent.set()
+
+    def update(self, connection, event):
+        """Connection observer, records the card commands"""
+        if event.type == 'command': self.sent.append("get_data")
+
+    def tap(self, seconds=0):
+        """A UID only tap taking seconds"""
+        self.reader.present(simulated.VirtualCard())
+        connection = self.reader.connect()
+        connection.addObserver(self)
+        self.reader.busy_signal(connection)
+        self.clock.now += seconds
+        self.reader.get_serial_number(connection)
+        self.reader.get_serial_number(connection)
+        self.reader.ready_signal(connection)
+        connection.disconnect()
+
+    def test_quick_taps_never_show_busy(self):
+        self.tap()
+        self.tap()
+        self.assertEqual(self.sent, ["get_data", "get_data", READY, "get_data", "get_data"])  # Ready once
+
+    def test_slow_tap_shows_busy_before_the_next_command(self):
+        self.tap()
+        del self.sent[:]
+        self.tap(feedback.BUSY_DELAY + 0.01)
+        self.assertEqual(self.sent, [BUSY, "get_data", "get_data", READY])  # Busy once, then back to ready
+
+    def test_error_while_blinking_dropped(self):
+        self.tap()
+        self.reader._error_signal = lambda duration: self.output_control(None, ERROR)
+        self.reader.error_signal(duration=2)
+        self.assertTrue(self.error_sent.wait(1))
+        self.clock.now += 1
+        self.error_sent.clear()
+        self.reader.error_signal(duration=2)
+        self.assertFalse(self.error_sent.wait(0.1))
+        self.assertEqual(self.sent.count(ERROR), 1)
+        self.clock.now += 2
+        self.tap()
+        self.assertEqual(self.sent[-3:], ["get_data", "get_data", READY])  # The error left the LED unknown
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# test_jsonsink.py - JSON Lines card event records written to a file
+#
+
+import os
+import json
+import logging
+import tempfile
+import unittest
+
+import cardimage
+from hidemu import CardEvent
+from output import jsonsink
+from reader import simulated
+
+logging.getLogger('hidemu').addHandler(logging.NullHandler())
+
+UID = [0x04, 0xA1, 0xB2, 0xC3, 0xD4, 0xE5, 0xF6]
+
+
+def _card_event(data_list, image=None):
+    reader = simulated.Reader()
+    reader.present(simulated.VirtualCard(uid=UID))
+    reader.connect()
+    return CardEvent(reader, UID, data_list, "", 1500000000.0, image)
+
+
+class JsonSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(handle)
+        self.sink = jsonsink.JsonSink(self.path)
+
+    def tearDown(self):
+        self.sink.close()
+        os.remove(self.path)
+
+    def lines(self):
+        with open(self.path) as json_file:
+            return json_file.read().split("\n")
+
+    def records(self):
+        lines = self.lines()
+        self.assertEqual(lines[-1], "")  # Every record newline terminated
+        return [json.loads(line) for line in lines[:-1]]
+
+    def test_one_record_per_line(self):
+        self.sink.send(_card_event(["1", "two\nlines"]))
+        self.sink.send(_card_event(["3"]))
+        self.sink.flush()
+        lines = self.lines()
+        self.assertEqual(len(lines), 3)  # The newline in the data is escaped
+        self.assertEqual([record["data"] for record in self.records()], [["1", "two\nlines"], ["3"]])
+
+    def test_written_by_flush(self):
+        written = jsonsink.RECORDS.value
+        self.sink.send(_card_event(["1"]))
+        self.assertEqual(self.lines(), [""])  # Buffered
+        self.sink.flush()
+        self.assertEqual(len(self.records()), 1)
+        self.assertEqual(jsonsink.RECORDS.value - written, 1)
+
+    def test_flush_and_close_at_shutdown(self):
+        self.sink.send(_card_event(["1"]))
+        self.sink.flush()
+        self.sink.send(_card_event(["2"]))
+        self.sink.flush()
+        self.sink.close()
+        self.assertIsNone(self.sink.stream)
+        self.assertEqual([record["data"] for record in self.records()], [["1"], ["2"]])
+        self.sink.send(_card_event(["3"]))  # Reopened for appending
+        self.sink.flush()
+        self.assertEqual([record["data"] for record in self.records()], [["1"], ["2"], ["3"]])
+
+    def test_fields(self):
+        self.sink.send(_card_event(["1"]))
+        self.sink.flush()
+        record = self.records()[0]
+        self.assertEqual(record["uid"], "04A1B2C3D4E5F6")
+        self.assertEqual((record["reader"], record["type"], record["subtype"]), ("Simulated Reader 0", "MFC", "1K"))
+        self.assertEqual(record["detected"], 1500000000.0)
+        self.assertTrue(record["atr"].isalnum() and record["atr"].isupper())
+        self.assertNotIn("memory", record)
+
+    def test_memory_image(self):
+        image = cardimage.CardImage(2, 4)
+        image.store(1, [0x00, 0x01, 0xFE, 0xFF])
+        self.sink.send(_card_event(["1"], image))
+        self.sink.flush()
+        record = self.records()[0]
+        self.assertEqual(record["memory"], "00000000" + "0001FEFF")
+        self.assertEqual(record["memory_valid"], "02")
+
+
+if __name__ == '__main__':
+    unittest.main()
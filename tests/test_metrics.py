@@ -0,0 +1,121 @@
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# test_metrics.py - counters, histograms and the exposition server
+#
+
+import socket
+import unittest
+import threading
+
+import metrics
+
+
+class AddressTest(unittest.TestCase):
+
+    def setUp(self):
+        self.address_family = metrics._UnixHTTPServer.address_family
+
+    def tearDown(self):
+        metrics._UnixHTTPServer.address_family = self.address_family
+
+    def test_tcp_port(self):
+        metrics.check_address("9100")
+        metrics.check_address("0.0.0.0:9100")
+
+    def test_socket_path(self):
+        if not hasattr(socket, "AF_UNIX"):
+            self.skipTest("no Unix sockets")
+        metrics.check_address("/run/hidemu/metrics.sock")
+
+    def test_socket_path_without_unix_sockets(self):
+        metrics._UnixHTTPServer.address_family = None
+        self.assertRaises(ValueError, metrics.check_address, "/run/hidemu/metrics.sock")
+        self.assertRaises(ValueError, metrics.serve, "/run/hidemu/metrics.sock")
+        metrics.check_address("9100")
+
+
+class ThreadSafetyTest(unittest.TestCase):
+
+    def hammer(self, update):
+        threads = [threading.Thread(target=lambda: [update() for _ in xrange(20000)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_counter(self):
+        counter = metrics.Counter("c", "")
+        self.hammer(counter.inc)
+        self.assertEqual(counter.value, 80000)
+
+    def test_histogram(self):
+        histogram = metrics.Histogram("h", "")
+        self.hammer(lambda: histogram.observe(0.003))
+        self.assertEqual(histogram.count, 80000)
+        self.assertEqual(sum(histogram.counts), 80000)
+
+
+class TakeMergeTest(unittest.TestCase):
+    """A supervised child take()s, the parent merge()s (the same metrics stand in for both here)"""
+
+    def setUp(self):
+        self.registered = list(metrics.METRICS), dict(metrics.NAMES)
+        del metrics.METRICS[:]
+        metrics.NAMES.clear()
+        self.counter = metrics.counter("test_total", "")
+        self.family = metrics.counter("test_by_type_total", "", ["type"])
+        self.histogram = metrics.histogram("test_seconds", "")
+        self.quantiles = metrics.quantiles("test_stage_seconds", "", window=3)
+        self.gauge = metrics.gauge("test_present", "", ["reader"])
+        self.local = metrics.gauge("test_depth", "", local=True)
+
+    def tearDown(self):
+        metrics.METRICS[:], metrics.NAMES = self.registered[0], self.registered[1]
+
+    def test_nothing_recorded(self):
+        self.assertEqual(metrics.take(), [])
+
+    def test_changes_are_taken_once(self):
+        self.counter.inc(2)
+        self.family.labels("MFU").inc()
+        self.histogram.observe(0.003)
+        self.assertEqual(len(metrics.take()), 3)
+        self.assertEqual(metrics.take(), [])
+        self.counter.inc()
+        self.assertEqual(metrics.take(), [("test_total", 1)])
+
+    def test_round_trip(self):
+        self.counter.inc(2)
+        self.family.labels("MFU").inc(3)
+        self.histogram.observe(0.003)
+        self.histogram.observe(7)
+        for value in (1, 2, 3, 4):
+            self.quantiles.observe(value)
+        self.local.set(5)
+        changes = metrics.take()
+        self.counter.inc(10)  # The parent's own
+        metrics.merge(changes)
+        self.assertEqual(self.counter.value, 14)
+        self.assertEqual(self.family.labels("MFU").value, 6)
+        self.assertEqual(self.histogram.count, 4)
+        self.assertAlmostEqual(self.histogram.sum, 2 * 7.003)
+        self.assertEqual(self.histogram.counts[-1], 2)
+        self.assertEqual((self.quantiles.count, self.quantiles.sum), (8, 20))
+        self.assertEqual(list(self.quantiles.recent), [2, 3, 4])
+        self.assertEqual(self.local.value, 5)  # Not reported, so only set once
+
+    def test_gauges_withdrawn(self):
+        gauges = {}
+        self.gauge.labels("ACR122").set(1)
+        changes = metrics.take()
+        self.gauge.labels("ACR122").set(0)
+        metrics.merge(changes, gauges)
+        self.assertEqual(self.gauge.labels("ACR122").value, 1)
+        metrics.withdraw(gauges)
+        self.assertEqual(self.gauge.labels("ACR122").value, 0)
+        self.assertEqual(gauges, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
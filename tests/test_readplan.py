@@ -0,0 +1,97 @@
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# test_readplan.py - data definition read planning, and reading the plan from a simulated card
+#
+
+import logging
+import unittest
+
+import readplan
+from hidemu import HIDEmu
+from reader import simulated
+
+logging.getLogger('hidemu').addHandler(logging.NullHandler())
+
+
+def _reads(plan):
+    """Returns (block, key A, key B, length, [field indexes]) for each read in plan order"""
+    return [(read.block, read.key_a, read.key_b, read.length, [field.index for field in read.fields])
+            for read in plan.reads]
+
+
+class ReadPlanTest(unittest.TestCase):
+
+    def test_no_definition(self):
+        self.assertEqual(readplan.compile(None).reads, [])
+
+    def test_single_dict(self):
+        plan = readplan.compile({"keyA": 0, "block": 4, "offset": 2, "length": 3})
+        self.assertEqual(_reads(plan), [(4, 0, None, 5, [0])])
+        self.assertEqual(plan.reads[0].fields[0].type, "hex")
+
+    def test_fields_sharing_a_block_share_one_read(self):
+        plan = readplan.compile([{"keyA": 0, "block": 4, "offset": 0, "length": 4},
+                                 {"keyA": 0, "block": 4, "offset": 8, "length": 8},
+                                 {"keyA": 0, "block": 4, "offset": 4, "length": 2}])
+        self.assertEqual(_reads(plan), [(4, 0, None, 16, [0, 1, 2])])
+
+    def test_different_keys_read_separately(self):
+        plan = readplan.compile([{"keyA": 0, "block": 4, "length": 4}, {"keyB": 1, "block": 4, "length": 4}])
+        self.assertEqual(len(plan.reads), 2)
+
+    def test_reads_grouped_by_sector(self):
+        plan = readplan.compile([{"keyA": 0, "block": 8}, {"keyA": 0, "block": 4}, {"keyA": 0, "block": 9},
+                                 {"keyA": 0, "block": 5}, {"keyA": 0, "block": 130}])
+        self.assertEqual([read.block for read in plan.reads], [4, 5, 8, 9, 130])
+        self.assertEqual(sorted(plan.sector_keys), [1, 2, 32])
+
+    def test_only_needed_fields(self):
+        plan = readplan.compile([{"keyA": 0, "block": 4}, {"keyA": 0, "block": 8}, {"keyA": 0, "block": 12}],
+                                needed=set([0, 2]))
+        self.assertEqual([read.block for read in plan.reads], [4, 12])
+
+    def test_at_most_eight_fields(self):
+        plan = readplan.compile([{"keyA": 0, "block": block} for block in range(4, 14)])
+        self.assertEqual(len(plan.reads), readplan.MAX_FIELDS)
+
+
+class ReadDefinedDataTest(unittest.TestCase):
+    """Following a plan against a simulated reader and Mifare Classic 1K card"""
+
+    def read(self, data_definition):
+        hid_emu = HIDEmu(track1="{DATA0}{DATA1}{DATA2}", data_definition=data_definition)
+        reader = simulated.Reader()
+        card = simulated.VirtualCard()
+        reader.present(card)
+        connection = reader.connect()
+        self.connection = reader.reader.connection
+        failed = []
+        data_list = hid_emu._read_defined_data(reader, connection, failed=failed)
+        return data_list[:3], failed
+
+    def test_one_read_per_block(self):
+        data_list, failed = self.read([{"keyA": 0, "block": 4, "offset": 0, "length": 2},
+                                       {"keyA": 0, "block": 4, "offset": 2, "length": 2}])
+        self.assertEqual((data_list, failed), (["4041", "4243", ""], []))
+        self.assertEqual(self.connection.apdu_count, 2)  # Authenticate and read
+
+    def test_field_overrunning_the_card_only_loses_itself(self):
+        data_list, failed = self.read([{"keyA": 0, "block": 62, "offset": 0, "length": 4},
+                                       {"keyA": 0, "block": 62, "offset": 10, "length": 30},
+                                       {"keyA": 0, "block": 62, "offset": 4, "length": 2}])
+        self.assertEqual((data_list, failed), (["E0E1E2E3", "", "E4E5"], [1]))
+
+    def test_wrong_key_fails_every_field_in_the_read(self):
+        data_definition = [{"keyA": 0, "block": 4, "offset": 0, "length": 2},
+                           {"keyA": 0, "block": 4, "offset": 2, "length": 2}]
+        hid_emu = HIDEmu(track1="{DATA0}{DATA1}", data_definition=data_definition)
+        reader = simulated.Reader()
+        reader.present(simulated.VirtualCard(sector_keys={1: ([0x01] * 6, [0x02] * 6)}))
+        failed = []
+        data_list = hid_emu._read_defined_data(reader, reader.connect(), failed=failed)
+        self.assertEqual((data_list[:2], sorted(failed)), (["", ""], [0, 1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
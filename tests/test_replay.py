@@ -0,0 +1,89 @@
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# test_replay.py - serving readers from a recorded trace
+#
+
+import os
+import json
+import logging
+import tempfile
+import unittest
+from smartcard.Exceptions import CardConnectionException
+
+from hidemu import HIDEmu
+from reader import replay, cardwatch
+
+ULTRALIGHT_ATR = "3B8F8001804F0CA0000003060300030000000068"
+TAP = {"reader": "ACS ACR122U PICC Interface 0", "at": 1500000000.0, "atr": ULTRALIGHT_ATR,
+       "apdus": [["FF82000006000000000000", "9000", 0.01], ["FF82000106000000000000", "9000", 0.01],
+                 ["FFCA000000", "04A1B2C3D4E5F69000", 0.01]]}
+
+
+class Records(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".jsonl")
+        with os.fdopen(handle, "w") as trace_file:
+            trace_file.write(json.dumps(TAP) + "\n")
+        self.records = Records()
+        logging.getLogger('hidemu').addHandler(self.records)
+
+    def tearDown(self):
+        logging.getLogger('hidemu').removeHandler(self.records)
+        os.remove(self.path)
+
+    def connect(self):
+        reader = replay.readers(self.path)[0]
+        self.assertEqual(reader.wait_for_event(0), cardwatch.CARD_ARRIVED)
+        return reader.reader.createConnection()
+
+    def test_recorded_response(self):
+        connection = self.connect()
+        connection.connect()
+        self.assertEqual(connection.transmit([0xFF, 0xCA, 0x00, 0x00, 0x00]),
+                         ([0x04, 0xA1, 0xB2, 0xC3, 0xD4, 0xE5, 0xF6], 0x90, 0x00))
+
+    def test_feedback_not_in_the_trace(self):
+        connection = self.connect()
+        connection.connect()
+        self.assertEqual(connection.transmit([0xFF, 0x00, 0x40, 0x0E, 0x04, 0x00, 0x00, 0x00, 0x00]), ([], 0x90, 0x00))
+
+    def test_command_not_in_the_trace(self):
+        connection = self.connect()
+        connection.connect()
+        self.assertRaises(CardConnectionException, connection.transmit, [0xFF, 0xB0, 0x00, 0x04, 0x10])
+
+    def test_end_of_trace(self):
+        hid_emu = HIDEmu(track1="{UID}", replay_trace=self.path)
+        reader = replay.readers(self.path)[0]
+        hid_emu._prepare_reader(reader)
+        hid_emu.running = True
+        hid_emu._serve_reader(reader)
+        self.assertIsNone(hid_emu.worker_failure)
+        self.assertEqual(hid_emu.output_queue.qsize(), 1)
+        self.assertEqual([record for record in self.records.records if record.levelno >= logging.WARN], [])
+
+    def test_tap_with_a_command_not_in_the_trace(self):
+        hid_emu = HIDEmu(track1="{UID}{DATA}", data_definition=[{"keyA": 0, "block": 4, "offset": 0, "length": 4}],
+                         replay_trace=self.path)
+        reader = replay.readers(self.path)[0]
+        hid_emu._prepare_reader(reader)
+        hid_emu.running = True
+        hid_emu._serve_reader(reader)
+        self.assertIsNone(hid_emu.worker_failure)
+        self.assertTrue([record for record in self.records.records if "not in the trace" in record.getMessage()])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# test_specs.py - reader specs and the status word dispatch of ReaderBase._transmit
+#
+
+import unittest
+
+from reader import specs, simulated, acr122
+from reader.base import ReaderBase
+from reader.exceptions import (FailedException, NotSupportedException, UnexpectedErrorCodeException,
+                               ConnectionLostException)
+
+
+class StubConnection:
+    """Answers every command with the same status word, remembering the commands"""
+
+    def __init__(self, sw1, sw2, data=None):
+        self.response = (data or [], sw1, sw2)
+        self.commands = []
+
+    def transmit(self, apdu):
+        self.commands.append(apdu)
+        if self.response is None: raise AttributeError  # Like a pyscard connection whose card has gone
+        return self.response
+
+
+def _reader(spec):
+    return ReaderBase(simulated.SimulatedPcscReader(spec.prefix + " 0", spec), spec)
+
+
+class TransmitTest(unittest.TestCase):
+
+    def transmit(self, spec, sw1, sw2, command="read_block", command_vars=(4, 16)):
+        return _reader(spec)._transmit(StubConnection(sw1, sw2, [0x01, 0x02]), command, list(command_vars))
+
+    def test_success_returns_data(self):
+        self.assertEqual(self.transmit(specs.SDI011, 0x90, 0x00), [0x01, 0x02])
+
+    def test_command_template_and_vars(self):
+        connection = StubConnection(0x90, 0x00)
+        _reader(specs.OMNIKEY_5X21_CL)._transmit(connection, "load_key_1", [0xFF] * 6)
+        self.assertEqual(connection.commands, [[0xFF, 0x82, 0x20, 0x01, 0x06] + [0xFF] * 6])
+
+    def test_pcsc_status_words(self):
+        self.assertRaises(FailedException, self.transmit, specs.SDI011, 0x63, 0x00)
+        self.assertRaises(NotSupportedException, self.transmit, specs.SDI011, 0x6A, 0x81)
+
+    def test_model_status_words(self):
+        self.assertRaises(FailedException, self.transmit, specs.OMNIKEY_5X21_CL, 0x64, 0x00)
+        self.assertRaises(FailedException, self.transmit, specs.OMNIKEY_5X21_CL, 0x69, 0x82)
+        self.assertRaises(NotSupportedException, self.transmit, specs.OMNIKEY_5X21_CL, 0x68, 0x00)
+
+    def test_status_word_removed_by_model(self):
+        self.assertRaises(UnexpectedErrorCodeException, self.transmit, specs.OMNIKEY_5X21_CL, 0x63, 0x00)
+
+    def test_sw1_only(self):
+        self.assertRaises(NotSupportedException, self.transmit, specs.OMNIKEY_5X21_CL, 0x6C, 0x10)
+
+    def test_unexpected_status_word(self):
+        try:
+            self.transmit(specs.SDI011, 0x6F, 0x00)
+        except UnexpectedErrorCodeException, args:
+            self.assertEqual(args[1:], ("6F 00", "Read Block", 0x6F, 0x00))
+        else:
+            self.fail("No exception")
+
+    def test_connection_lost(self):
+        connection = StubConnection(0x90, 0x00)
+        connection.response = None
+        self.assertRaises(ConnectionLostException, _reader(specs.SDI011)._transmit, connection, "get_data")
+
+
+class SpecTest(unittest.TestCase):
+
+    def test_find_spec(self):
+        self.assertIs(specs.find_spec("ACS ACR122U PICC Interface 00 00"), specs.ACR122)
+        self.assertIs(specs.find_spec("OMNIKEY CardMan 5x21-CL 0"), specs.OMNIKEY_5X21_CL)
+        self.assertIs(specs.find_spec("Unknown Reader 0"), None)
+
+    def test_model_commands_extend_pcsc(self):
+        self.assertIn("direct", specs.ACR122.commands)
+        self.assertEqual(specs.ACR122.commands["read_block"], specs.PCSC_COMMANDS["read_block"])
+        self.assertNotIn("direct", specs.SDI011.commands)
+
+    def test_reader_class(self):
+        self.assertIs(specs.SDI011.reader_class(), ReaderBase)
+        self.assertIs(specs.ACR122.reader_class(), acr122.Reader)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,275 @@
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# test_supervisor.py - parent side of supervised readers, driven without forking
+#
+
+import time
+import signal
+import logging
+import unittest
+import itertools
+
+import hidemu
+import supervisor
+from hidemu import HIDEmu, CardEvent, OUTPUT_DROPPED, TAPS, RESULT_CACHE_ENTRIES
+from reader import simulated, autodetect
+from reader.exceptions import ReaderNotFoundException
+
+logging.getLogger('hidemu').addHandler(logging.NullHandler())
+
+
+def _card_event(number):
+    reader = simulated.Reader()
+    return CardEvent(reader, [0x04, number], [], str(number), 0)
+
+
+class Process:
+    """Stands in for the multiprocessing.Process of a child"""
+
+    def __init__(self):
+        self.exitcode = 0
+
+    def is_alive(self):
+        return True
+
+    def join(self, timeout=None):
+        pass
+
+
+class ChildPipe:
+    """Parent end of the pipe from a child, which sends messages and then falls silent"""
+
+    def __init__(self, messages):
+        self.messages = iter(messages)
+
+    def poll(self, timeout):
+        for message in self.messages:
+            self.message = message
+            return True
+        time.sleep(timeout)
+        return False
+
+    def recv(self):
+        return self.message
+
+
+class ReaderProcessUnderTest(supervisor.ReaderProcess):
+    """A ReaderProcess whose child is never started, children are the messages from each one started in turn"""
+
+    def __init__(self, hid_emu, budget=5, children=()):
+        supervisor.ReaderProcess.__init__(self, hid_emu, "Simulated Reader", budget)
+        self.children = list(children)
+        self.started = 0
+
+    def start(self):
+        self.started += 1
+        if not self.children:  # Nothing more to run
+            self.hid_emu.running = False
+            return
+        self.process = Process()
+        self.pipe = ChildPipe(self.children.pop(0))
+        self.progress = time.time()
+        self.busy = False
+
+    def stop(self):
+        supervisor.metrics.withdraw(self.gauges)
+
+
+class OutputQueueTest(unittest.TestCase):
+    """Cards from the child while the output queue is full"""
+
+    def setUp(self):
+        self.heartbeat_interval = supervisor.HEARTBEAT_INTERVAL
+        supervisor.HEARTBEAT_INTERVAL = 0.02
+
+    def tearDown(self):
+        supervisor.HEARTBEAT_INTERVAL = self.heartbeat_interval
+
+    def process(self, policy):
+        hid_emu = HIDEmu(queue_size=2, queue_policy=policy)
+        hid_emu.running = True
+        for number in (1, 2):
+            hid_emu.output_queue.put(_card_event(number))
+        return ReaderProcessUnderTest(hid_emu)
+
+    def handle(self, process, *numbers):
+        for number in numbers:
+            self.assertTrue(process._handle(("card", _card_event(number))))
+
+    def test_drop_newest(self):
+        process = self.process("drop-newest")
+        dropped = OUTPUT_DROPPED.value
+        self.handle(process, 3, 4, 5)
+        self.assertEqual([card.output_string for card in process.pending], ["3", "4"])
+        self.assertEqual(OUTPUT_DROPPED.value - dropped, 1)
+        self.assertFalse(process._holding())
+
+    def test_drop_oldest(self):
+        process = self.process("drop-oldest")
+        dropped = OUTPUT_DROPPED.value
+        self.handle(process, 3, 4, 5)
+        self.assertEqual([card.output_string for card in process.pending], ["4", "5"])
+        process._relay()  # Makes room on the output queue by dropping the oldest there
+        self.assertEqual(list(process.pending), [])
+        self.assertEqual([process.hid_emu.output_queue.get_nowait().output_string for _ in range(2)], ["4", "5"])
+        self.assertEqual(OUTPUT_DROPPED.value - dropped, 3)
+
+    def test_block(self):
+        process = self.process("block")
+        dropped = OUTPUT_DROPPED.value
+        self.handle(process, 3)
+        self.assertFalse(process._holding())
+        self.handle(process, 4)
+        self.assertTrue(process._holding())  # The pipe is left unread, so the child waits
+        process._relay()
+        self.assertEqual(len(process.pending), 2)
+        process.hid_emu.output_queue.get_nowait()
+        process._relay()
+        self.assertEqual([card.output_string for card in process.pending], ["4"])
+        self.assertFalse(process._holding())
+        self.assertEqual(OUTPUT_DROPPED.value, dropped)
+
+
+def _heartbeats(seconds, busy=False, changes=()):
+    """Heartbeats with progress for seconds"""
+    end = time.time() + seconds
+    while time.time() < end:
+        yield ("heartbeat", time.time(), busy, list(changes))
+        time.sleep(supervisor.HEARTBEAT_INTERVAL)
+
+
+STOPPED = ("stopped", "Simulated Reader")
+
+
+class WatchdogTest(unittest.TestCase):
+    """run() restarting children which make no progress within the budget"""
+
+    def setUp(self):
+        self.heartbeat_interval = supervisor.HEARTBEAT_INTERVAL
+        supervisor.HEARTBEAT_INTERVAL = 0.01
+        self.counts = (supervisor.RESTARTS.value, supervisor.DROPPED_TAPS.value)
+
+    def tearDown(self):
+        supervisor.HEARTBEAT_INTERVAL = self.heartbeat_interval
+
+    def run_process(self, *children):
+        hid_emu = HIDEmu()
+        hid_emu.running = True
+        process = ReaderProcessUnderTest(hid_emu, 0.1, children)
+        process.run()
+        return process
+
+    def restarts(self):
+        return supervisor.RESTARTS.value - self.counts[0], supervisor.DROPPED_TAPS.value - self.counts[1]
+
+    def test_progress_within_budget(self):
+        process = self.run_process(itertools.chain(_heartbeats(0.3), [STOPPED]))
+        self.assertEqual(process.started, 1)
+        self.assertEqual(self.restarts(), (0, 0))
+
+    def test_restarted_after_budget(self):
+        started = time.time()
+        process = self.run_process([])
+        self.assertEqual(process.started, 2)
+        self.assertGreater(time.time() - started, 0.1)
+        self.assertEqual(self.restarts(), (1, 0))
+
+    def test_busy_child_drops_its_tap(self):
+        process = self.run_process(_heartbeats(0.05, busy=True))
+        self.assertEqual(process.started, 2)
+        self.assertEqual(self.restarts(), (1, 1))
+
+    def test_recovery_once_the_new_child_progresses(self):
+        recovery = supervisor.RECOVERY_SECONDS.value
+        process = self.run_process([], itertools.chain(_heartbeats(0.05), [STOPPED]))
+        self.assertIsNone(process.killed_at)
+        self.assertGreater(supervisor.RECOVERY_SECONDS.value, recovery)
+
+
+class HeartbeatTest(unittest.TestCase):
+    """Metrics from a child's heartbeats"""
+
+    def setUp(self):
+        self.process = ReaderProcessUnderTest(HIDEmu())
+
+    def test_merged(self):
+        taps, entries = TAPS.value, RESULT_CACHE_ENTRIES.value
+        changes = [("taps_total", 2), ("result_cache_entries", 3)]
+        self.assertTrue(self.process._handle(("heartbeat", time.time(), False, changes)))
+        self.assertTrue(self.process._handle(("heartbeat", time.time(), True, [("result_cache_entries", -1)])))
+        self.assertEqual((TAPS.value - taps, RESULT_CACHE_ENTRIES.value - entries), (2, 2))
+        self.assertEqual(self.process.gauges, {("result_cache_entries", None): 2})
+        self.assertTrue(self.process.busy)
+        self.process.stop()  # The child's gauges go with it, its counts stay
+        self.assertEqual((TAPS.value - taps, RESULT_CACHE_ENTRIES.value), (2, entries))
+        self.assertEqual(self.process.gauges, {})
+
+    def test_stopped(self):
+        self.process.process = Process()
+        self.assertFalse(self.process._handle(STOPPED))
+        self.process.process.exitcode = 1
+        restarts = supervisor.RESTARTS.value
+        self.assertTrue(self.process._handle(STOPPED))  # Crashed, so restarted
+        self.assertEqual(supervisor.RESTARTS.value - restarts, 1)
+
+
+class Pipe:
+    """Collects what a child sends"""
+
+    def __init__(self):
+        self.messages = []
+
+    def send(self, message):
+        self.messages.append(message)
+
+
+class NoRegistry:
+
+    def after_fork(self):
+        pass
+
+    def start(self):
+        pass
+
+
+class ChildTest(unittest.TestCase):
+    """_child_main run in this process"""
+
+    def setUp(self):
+        self.saved = (supervisor.registry, autodetect.find_reader, hidemu.REACQUIRE_MIN_DELAY,
+                      signal.getsignal(signal.SIGINT), signal.getsignal(signal.SIGTERM))
+        supervisor.registry = NoRegistry()
+        hidemu.REACQUIRE_MIN_DELAY = 0.01
+        self.lookups = 0
+
+    def tearDown(self):
+        supervisor.registry, autodetect.find_reader, hidemu.REACQUIRE_MIN_DELAY = self.saved[:3]
+        signal.signal(signal.SIGINT, self.saved[3])
+        signal.signal(signal.SIGTERM, self.saved[4])
+
+    def find_reader(self, name):
+        """Unplugged for the first two lookups"""
+        self.lookups += 1
+        if self.lookups < 3: raise ReaderNotFoundException(name)
+        return simulated.Reader(name)
+
+    def test_restarted_while_unplugged(self):
+        autodetect.find_reader = self.find_reader
+        hid_emu = HIDEmu()
+        served = []
+
+        def serve_reader(reader, heartbeat=None):
+            served.append(reader.name)
+            hid_emu.running = False
+
+        hid_emu._serve_reader = serve_reader
+        pipe = Pipe()
+        supervisor._child_main(hid_emu, "Simulated Reader", pipe)
+        self.assertEqual(served, ["Simulated Reader"])
+        self.assertEqual(self.lookups, 3)
+        self.assertEqual(pipe.messages[-1], ("stopped", "Simulated Reader"))
+
+
+if __name__ == '__main__':
+    unittest.main()
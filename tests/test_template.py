@@ -0,0 +1,56 @@
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# test_template.py - output template compiler
+#
+
+import unittest
+
+import template
+
+VALUES = {"UIDLEN": "7", "TYPE": "MFU", "UID": "04A1B2C3D4E5F6", "CR": "\n", "DATA0": "ABC", "DATA1": 42}
+
+
+class CompileTest(unittest.TestCase):
+
+    def test_referenced_fields(self):
+        self.assertEqual(template.compile("%{UIDLEN}{TYPE}^{UID}?{CR}").fields, set(["UIDLEN", "TYPE", "UID", "CR"]))
+
+    def test_field_referenced_twice(self):
+        self.assertEqual(template.compile("{UID}-{UID}").fields, set(["UID"]))
+
+    def test_literal_only(self):
+        self.assertEqual(template.compile("%?").fields, set())
+
+    def test_unknown_field(self):
+        self.assertRaises(ValueError, template.compile, "{SERIAL}")
+
+    def test_indexed_field_is_unknown(self):
+        self.assertRaises(ValueError, template.compile, "{DATA0[0]}")
+
+    def test_nested_field(self):
+        self.assertRaises(ValueError, template.compile, "{DATA0:{UIDLEN}}")
+
+    def test_malformed(self):
+        self.assertRaises(ValueError, template.compile, "{UID")
+        self.assertRaises(ValueError, template.compile, "UID}")
+
+
+class RenderTest(unittest.TestCase):
+
+    def render(self, text):
+        return template.compile(text).render(VALUES)
+
+    def test_fields_and_literals(self):
+        self.assertEqual(self.render("%{UIDLEN}{TYPE}^{UID}?{CR}"), "%7MFU^04A1B2C3D4E5F6?\n")
+
+    def test_same_as_str_format(self):
+        text = "{{{UID}}}^{DATA0!r}^{DATA1:>5}^{DATA1:04X}"
+        self.assertEqual(self.render(text), text.format(**VALUES))
+
+    def test_only_referenced_values_needed(self):
+        self.assertEqual(template.compile("{DATA1}").render({"DATA1": 42}), "42")
+
+
+if __name__ == '__main__':
+    unittest.main()
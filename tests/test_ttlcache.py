@@ -0,0 +1,89 @@
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# test_ttlcache.py - bounded cache with expiring entries, and flushing the result cache
+#
+
+import pickle
+import logging
+import unittest
+
+import ttlcache
+from hidemu import HIDEmu
+from reader import simulated
+
+logging.getLogger('hidemu').addHandler(logging.NullHandler())
+
+
+def _sizeof(key, value):
+    return len(value)
+
+
+class TtlCacheTest(unittest.TestCase):
+
+    def test_put_and_get(self):
+        cache = ttlcache.TtlCache(60, 4)
+        cache.put("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("b", False), False)
+
+    def test_expired(self):
+        cache = ttlcache.TtlCache(-1, 4, _sizeof)  # Expired as soon as put
+        cache.put("a", "abc")
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual((len(cache), cache.bytes), (0, 0))
+
+    def test_least_recently_used_evicted(self):
+        cache = ttlcache.TtlCache(60, 2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+        self.assertEqual(len(cache), 2)
+
+    def test_bytes(self):
+        cache = ttlcache.TtlCache(60, 2, _sizeof)
+        cache.put("a", "abc")
+        cache.put("b", "de")
+        cache.put("a", "f")  # Replaced
+        self.assertEqual(cache.bytes, 3)
+        cache.put("c", "ghij")  # Evicts b
+        self.assertEqual(cache.bytes, 5)
+
+    def test_clear(self):
+        cache = ttlcache.TtlCache(60, 2, _sizeof)
+        cache.put("a", "abc")
+        cache.clear()
+        self.assertEqual((len(cache), cache.bytes, cache.get("a")), (0, 0, None))
+
+    def test_pickled(self):
+        cache = ttlcache.TtlCache(60, 2)
+        cache.put("a", 1)
+        copy = pickle.loads(pickle.dumps(cache))
+        self.assertEqual(copy.get("a"), 1)
+        copy.put("b", 2)  # Has a lock of its own
+
+
+class FlushTest(unittest.TestCase):
+    """SIGUSR1 only requests a flush, the worker flushes before its next lookup"""
+
+    def test_flush_before_next_lookup(self):
+        hid_emu = HIDEmu(track1="{DATA0}", data_definition=[{"keyA": 0, "block": 4, "offset": 0, "length": 2}],
+                         result_cache=60)
+        reader = simulated.Reader()
+        reader.present(simulated.VirtualCard())
+        uid = [0x04, 0x01, 0x02, 0x03]
+        hid_emu._card_data(reader, reader.connect(), uid)
+        self.assertEqual(len(hid_emu.result_cache), 1)
+        hid_emu.request_flush()
+        self.assertEqual(len(hid_emu.result_cache), 1)  # Left to the worker
+        connection = reader.connect()
+        hid_emu._card_data(reader, connection, uid)
+        self.assertFalse(hid_emu.flush_pending)
+        self.assertEqual(reader.reader.connection.apdu_count, 2)  # Read from the card again: authenticate and read
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# Copyright (c) 2015 Sam Hall, Charles Darwin University
+# See LICENSE.txt for details.
+#
+# test_uinputkeystroker.py - input_event records written by the uinput backend
+#
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from output import uinputkeystroker
+from output.uinputkeystroker import INPUT_EVENT, EV_KEY, EV_SYN, SYN_REPORT, KEY_LEFTSHIFT
+
+KEY_A = 30
+KEY_B = 48
+KEY_ENTER = 28
+
+
+def _events(data):
+    """Returns (type, code, value) of each input_event record in data"""
+    size = INPUT_EVENT.size
+    return [INPUT_EVENT.unpack(data[i:i + size])[2:] for i in range(0, len(data), size)]
+
+
+def _stroke(keycode):
+    return [(EV_KEY, keycode, 1), (EV_SYN, SYN_REPORT, 0), (EV_KEY, keycode, 0), (EV_SYN, SYN_REPORT, 0)]
+
+
+SHIFT_DOWN = [(EV_KEY, KEY_LEFTSHIFT, 1), (EV_SYN, SYN_REPORT, 0)]
+SHIFT_UP = [(EV_KEY, KEY_LEFTSHIFT, 0), (EV_SYN, SYN_REPORT, 0)]
+
+
+class FileDeviceTest(unittest.TestCase):
+    """A regular file stands in for /dev/uinput, so no device is created and only the events are written"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "uinput")
+        open(self.path, "w").close()
+        self.key_stroker = uinputkeystroker.KeyStroker(device_path=self.path)
+
+    def tearDown(self):
+        self.key_stroker.close()
+        shutil.rmtree(self.directory)
+
+    def written(self):
+        with open(self.path, "rb") as device:
+            return _events(device.read())
+
+    def test_not_a_device(self):
+        self.assertFalse(self.key_stroker.is_device)
+
+    def test_key_down_up_pairs_with_reports(self):
+        self.key_stroker.send_string("ab")
+        self.assertEqual(self.written(), _stroke(KEY_A) + _stroke(KEY_B))
+
+    def test_shift_coalesced_across_shifted_characters(self):
+        self.key_stroker.send_string("aBAb")
+        self.assertEqual(self.written(),
+                         _stroke(KEY_A) + SHIFT_DOWN + _stroke(KEY_B) + _stroke(KEY_A) + SHIFT_UP + _stroke(KEY_B))
+
+    def test_shift_released_at_end_of_string(self):
+        self.key_stroker.send_string("A")
+        self.assertEqual(self.written(), SHIFT_DOWN + _stroke(KEY_A) + SHIFT_UP)
+
+    def test_newline_and_carriage_return_are_enter(self):
+        self.key_stroker.send_string("\n\r")
+        self.assertEqual(self.written(), _stroke(KEY_ENTER) + _stroke(KEY_ENTER))
+
+    def test_characters_without_a_key_are_skipped(self):
+        self.key_stroker.send_string(u"a\u00e9b")
+        self.assertEqual(self.written(), _stroke(KEY_A) + _stroke(KEY_B))
+
+    def test_pacing_writes_the_same_events(self):
+        self.key_stroker.pacing = 1
+        self.key_stroker.send_string("aB")
+        self.assertEqual(self.written(), _stroke(KEY_A) + SHIFT_DOWN + _stroke(KEY_B) + SHIFT_UP)
+
+
+class PipeDeviceTest(unittest.TestCase):
+    """A FIFO stands in for /dev/uinput, read as it's written like the kernel would"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "uinput")
+        os.mkfifo(self.path)
+        self.data = []
+        self.reader = threading.Thread(target=self._read)
+        self.reader.start()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _read(self):
+        with open(self.path, "rb") as device:
+            self.data.append(device.read())
+
+    def test_events_written_to_pipe(self):
+        key_stroker = uinputkeystroker.KeyStroker(device_path=self.path)
+        key_stroker.send_string("a\n")
+        key_stroker.close()
+        self.reader.join(5)
+        self.assertEqual(_events("".join(self.data)), _stroke(KEY_A) + _stroke(KEY_ENTER))
+
+
+if __name__ == '__main__':
+    unittest.main()